@@ -47,11 +47,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'conciliacion_app.middleware.MetricasMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'conciliacion_app.middleware.PerfilamientoMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -79,14 +81,108 @@ WSGI_APPLICATION = 'ad_conciliacion.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
 
+# Perfil de SQLite para varios usuarios concurrentes: WAL deja leer mientras
+# se escribe, synchronous=NORMAL solo sincroniza en los checkpoints (seguro con
+# WAL), y busy_timeout espera el bloqueo de escritura en vez de fallar con
+# "database is locked". IMMEDIATE toma el bloqueo al abrir la transacción y
+# evita los interbloqueos al pasar de lectura a escritura.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 20000,       # ms
+    'cache_size': -64000,        # negativo = KB (64 MB por conexión)
+    'mmap_size': 268435456,      # 256 MB
+    'temp_store': 'MEMORY',
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'init_command': ';'.join(f'PRAGMA {nombre}={valor}' for nombre, valor in SQLITE_PRAGMAS.items()),
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': SQLITE_PRAGMAS['busy_timeout'] / 1000,
+        },
     }
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'conciliacion',
+    }
+}
+
+# Tiempo (segundos) que se mantiene la tabla renderizada de un proceso COMPLETADO.
+# La clave incluye la versión de resoluciones, así que nunca se sirve contenido obsoleto
+RESULTADOS_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Guardar los scripts PowerShell generados comprimidos con gzip
+SCRIPTS_COMPRIMIR = True
+
+# Máximo de fragmentos paralelos que se pueden pedir para un script de bloqueo
+SCRIPTS_MAX_FRAGMENTOS = 32
+
+# Medir la memoria máxima de cada etapa del pipeline con tracemalloc. Hace
+# la lectura de los archivos ~10x más lenta, así que viene desactivado: se
+# activa para diagnosticar (tiempo, CPU y filas por etapa se miden siempre)
+PIPELINE_MEDIR_MEMORIA = env.bool('PIPELINE_MEDIR_MEMORIA', default=False)
+
+# Perfilamiento de solicitudes (ver conciliacion_app.middleware.PerfilamientoMiddleware).
+# Los usuarios staff pueden pedirlo con la cabecera X-Perfilar o ?perfilar=1;
+# además se perfila al azar esta fracción de las solicitudes (0 = nunca)
+PERFILAMIENTO_TASA_MUESTREO = env.float('PERFILAMIENTO_TASA_MUESTREO', default=0.0)
+PERFILAMIENTO_INTERVALO_MUESTREO = 0.005  # segundos entre muestras de pila
+PERFILAMIENTO_DIRECTORIO = BASE_DIR / 'perfiles'
+
+# Direcciones desde las que se puede leer /metricas/ (formato Prometheus)
+METRICAS_IPS_PERMITIDAS = env.list('METRICAS_IPS_PERMITIDAS', default=['127.0.0.1', '::1'])
+
+# Cargas fragmentadas y reanudables (vistas cargas_*): tamaño de fragmento por
+# defecto y permitido, tamaño máximo del archivo y horas sin actividad tras
+# las que se descarta una carga sin finalizar
+CARGAS_TAMANO_FRAGMENTO = 8 * 1024 * 1024
+CARGAS_TAMANO_FRAGMENTO_MINIMO = 256 * 1024
+CARGAS_TAMANO_FRAGMENTO_MAXIMO = 64 * 1024 * 1024
+CARGAS_TAMANO_MAXIMO = 2 * 1024 ** 3
+CARGAS_VIGENCIA_HORAS = 24
+
+# Retención: los procesos completados y sin pendientes con más de estos meses
+# se archivan (manage.py archivar_procesos) en un archivo comprimido por
+# proceso dentro de ARCHIVO_HISTORICO_DIRECTORIO y sus filas se eliminan
+RETENCION_MESES = env.int('RETENCION_MESES', default=12)
+ARCHIVO_HISTORICO_DIRECTORIO = BASE_DIR / 'archivo_historico'
+
+# Procesos para leer en paralelo los exports AD de una conciliación con varios
+# dominios (1 = se leen uno tras otro en el mismo proceso)
+DOMINIOS_PROCESOS = env.int('DOMINIOS_PROCESOS', default=1)
+
+# Reglas de categorización de la conciliación (ver conciliacion_app.utils.reglas).
+# Se releen cuando cambia el archivo
+REGLAS_CONCILIACION_ARCHIVO = env(
+    'REGLAS_CONCILIACION_ARCHIVO',
+    default=str(BASE_DIR / 'conciliacion_app' / 'utils' / 'reglas_conciliacion.json')
+)
+
+# Carpeta de entrada vigilada por `manage.py vigilar_carpeta`. Los patrones
+# indican qué archivos son nómina y cuáles export AD; cada nómina se empareja
+# con el export AD del mismo período (mes y año en el nombre del archivo)
+CARPETA_ENTRADA = env('CARPETA_ENTRADA', default=str(BASE_DIR / 'entrada'))
+CARPETA_PATRON_NOMINA = env('CARPETA_PATRON_NOMINA', default=r'(?i)\.xlsx?$')
+CARPETA_PATRON_AD = env('CARPETA_PATRON_AD', default=r'(?i)\.(txt|csv)$')
+CARPETA_INTERVALO = 30  # segundos entre recorridos
+CARPETA_SEGUNDOS_ESTABLE = 60  # sin cambios de tamaño ni mtime
+# Una entrada tomada hace más que esto sin terminar (el vigilante se detuvo o
+# cayó a mitad de la conciliación) vuelve a la cola. Si el vigilante corría en
+# el mismo equipo basta con que su proceso ya no exista
+CARPETA_SEGUNDOS_PROCESANDO = 2 * 60 * 60
+
+
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 
@@ -1,3 +1,23 @@
 from django.contrib import admin
+from django.urls import reverse
+from django.utils.html import format_html
+
+from .models import PerfilSolicitud
 
 # Register your models here.
+
+
+@admin.register(PerfilSolicitud)
+class PerfilSolicitudAdmin(admin.ModelAdmin):
+    list_display = ['fecha', 'metodo', 'ruta', 'codigo_respuesta', 'duracion_segundos',
+                    'modo', 'origen', 'usuario', 'enlace_archivo']
+    list_filter = ['modo', 'origen', 'codigo_respuesta']
+    search_fields = ['ruta', 'usuario__username']
+    readonly_fields = [f.name for f in PerfilSolicitud._meta.fields] + ['enlace_archivo']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    @admin.display(description='Archivo')
+    def enlace_archivo(self, obj):
+        return format_html('<a href="{}">{}</a>', reverse('descargar_perfil', args=[obj.id]), obj.archivo)
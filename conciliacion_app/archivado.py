@@ -0,0 +1,161 @@
+# conciliacion_app/archivado.py
+"""
+Archivado de procesos antiguos ya resueltos.
+
+Cada proceso se guarda en un archivo propio (<id>.json.xz dentro de
+ARCHIVO_HISTORICO_DIRECTORIO) con sus empleados, cuentas y conciliaciones en
+formato columnar: por tabla, una lista de valores por columna. Estados,
+categorías y descripciones se repiten casi siempre, así que por columna
+comprimen mucho mejor que fila a fila. Después se eliminan sus filas.
+
+Las vistas leen el archivo solo cuando alguien abre el proceso y lo
+reconstruyen como instancias de los modelos, de modo que las plantillas no
+distinguen si los datos vienen de la base o del archivo.
+"""
+import json
+import lzma
+import os
+import uuid
+from datetime import date, datetime
+from functools import lru_cache
+
+from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from .models import (
+    EmpleadoNomina, CuentaActiveDirectory,
+    Conciliacion, ProcesoConciliacion
+)
+from .utils.generadores import CATEGORIAS_ACCION
+
+VERSION_FORMATO = 1
+
+
+def _a_json(valor):
+    if isinstance(valor, uuid.UUID):
+        return str(valor)
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    return valor
+
+
+def _tabla_columnar(queryset):
+    """{'filas': n, 'columnas': {attname: [valores, ...]}} leyendo por bloques"""
+    columnas = [campo.attname for campo in queryset.model._meta.concrete_fields]
+    datos = {columna: [] for columna in columnas}
+    listas = [datos[columna] for columna in columnas]
+    filas = 0
+    for fila in queryset.order_by().values_list(*columnas).iterator(chunk_size=2000):
+        for lista, valor in zip(listas, fila):
+            lista.append(_a_json(valor))
+        filas += 1
+    return {'filas': filas, 'columnas': datos}
+
+
+def _instancias(modelo, tabla):
+    """
+    Reconstruye las filas de una tabla columnar como instancias del modelo.
+    Los campos agregados después de archivar toman su valor por defecto.
+    """
+    campos = {campo.attname: campo for campo in modelo._meta.concrete_fields}
+    columnas = tabla['columnas']
+    nombres = list(columnas)
+    convertidas = []
+    for nombre in nombres:
+        campo = campos[nombre]
+        convertidas.append([None if v is None else campo.to_python(v) for v in columnas[nombre]])
+    for nombre, campo in campos.items():
+        if nombre not in columnas:
+            nombres.append(nombre)
+            convertidas.append([campo.get_default()] * tabla['filas'])
+    return [modelo.from_db(None, nombres, fila) for fila in zip(*convertidas)]
+
+
+def ruta_archivo(nombre):
+    return os.path.join(settings.ARCHIVO_HISTORICO_DIRECTORIO, nombre)
+
+
+def procesos_archivables(meses=None, ahora=None):
+    """
+    Procesos completados, con más de `meses` de antigüedad (RETENCION_MESES
+    por defecto) y sin conciliaciones pendientes que requieran acción
+    """
+    meses = settings.RETENCION_MESES if meses is None else meses
+    limite = (ahora or timezone.now()) - relativedelta(months=meses)
+    pendientes = Conciliacion.objects.filter(
+        Q(empleado_nomina__archivo_origen=OuterRef('archivo_nomina')) |
+        Q(cuenta_ad__archivo_origen=OuterRef('archivo_ad')) |
+        Q(cuenta_ad__archivo_origen__proceso_dominios=OuterRef('pk')),
+        resuelto=False,
+        categoria__in=CATEGORIAS_ACCION
+    )
+    return ProcesoConciliacion.objects.filter(
+        estado='COMPLETADO',
+        archivado=False,
+        fecha_inicio__lt=limite,
+        archivo_nomina__isnull=False,
+        archivo_ad__isnull=False
+    ).exclude(Exists(pendientes)).order_by('fecha_inicio')
+
+
+def archivar_proceso(proceso):
+    """
+    Escribe el archivo del proceso, elimina sus empleados, cuentas y
+    conciliaciones y lo marca como archivado. Retorna las filas archivadas.
+    """
+    tablas = {
+        'empleados': _tabla_columnar(EmpleadoNomina.objects.filter(archivo_origen=proceso.archivo_nomina_id)),
+        'cuentas': _tabla_columnar(CuentaActiveDirectory.objects.filter(archivo_origen__in=proceso.ids_archivos_ad())),
+        'conciliaciones': _tabla_columnar(proceso.conciliaciones()),
+    }
+    contenido = {'version': VERSION_FORMATO, 'proceso': str(proceso.id), 'tablas': tablas}
+    
+    os.makedirs(settings.ARCHIVO_HISTORICO_DIRECTORIO, exist_ok=True)
+    nombre = f'{proceso.id}.json.xz'
+    temporal = ruta_archivo(nombre + '.tmp')
+    with lzma.open(temporal, 'wt', encoding='utf-8') as archivo:
+        json.dump(contenido, archivo, ensure_ascii=False, separators=(',', ':'))
+    # El archivo queda completo antes de borrar cualquier fila
+    os.replace(temporal, ruta_archivo(nombre))
+    
+    with transaction.atomic():
+        proceso.conciliaciones().delete()
+        EmpleadoNomina.objects.filter(archivo_origen=proceso.archivo_nomina_id).delete()
+        CuentaActiveDirectory.objects.filter(archivo_origen__in=proceso.ids_archivos_ad()).delete()
+        proceso.archivado = True
+        proceso.fecha_archivado = timezone.now()
+        proceso.archivo_historico = nombre
+        proceso.save(update_fields=['archivado', 'fecha_archivado', 'archivo_historico'])
+    
+    return sum(tabla['filas'] for tabla in tablas.values())
+
+
+@lru_cache(maxsize=4)
+def _leer_archivo(nombre):
+    with lzma.open(ruta_archivo(nombre), 'rt', encoding='utf-8') as archivo:
+        return json.load(archivo)
+
+
+def conciliaciones_archivadas(proceso):
+    """
+    Conciliaciones de un proceso archivado, leídas de su archivo con
+    empleado_nomina y cuenta_ad ya enlazados (como select_related) y en el
+    orden de ver_resultados
+    """
+    tablas = _leer_archivo(proceso.archivo_historico)['tablas']
+    empleados = {e.pk: e for e in _instancias(EmpleadoNomina, tablas['empleados'])}
+    cuentas = {c.pk: c for c in _instancias(CuentaActiveDirectory, tablas['cuentas'])}
+    
+    conciliaciones = _instancias(Conciliacion, tablas['conciliaciones'])
+    for conc in conciliaciones:
+        if conc.empleado_nomina_id in empleados:
+            conc.empleado_nomina = empleados[conc.empleado_nomina_id]
+        if conc.cuenta_ad_id in cuentas:
+            conc.cuenta_ad = cuentas[conc.cuenta_ad_id]
+    
+    conciliaciones.sort(key=lambda c: c.fecha_deteccion, reverse=True)
+    conciliaciones.sort(key=lambda c: c.prioridad)
+    return conciliaciones
@@ -0,0 +1,75 @@
+# conciliacion_app/historial.py
+"""
+Índice de la historia de cada RUT entre procesos (modelo HistorialRut).
+
+Cada proceso completado agrega una fila por RUT con la categoría que tuvo
+(pipeline.guardar_resultados); `manage.py indexar_historial_ruts` llena el
+índice para los procesos anteriores, incluidos los archivados. La línea de
+tiempo de un RUT sale de una sola consulta por rut_numero, resuelta con el
+índice historial_rut_linea_tiempo sin leer la tabla.
+"""
+from collections import Counter
+
+from .models import HistorialRut
+from .utils.rut import separar_rut
+
+CATEGORIAS_OK = ('OK_ACTIVO', 'OK_INACTIVO')
+
+
+def entradas_historial(proceso, filas):
+    """
+    Filas de HistorialRut de un proceso a partir de (rut, categoria, dominio).
+    Se omiten los RUTs sin formato numero-dv (no tienen clave entera).
+    """
+    for rut, categoria, dominio in filas:
+        partes = separar_rut(rut)
+        if partes:
+            yield HistorialRut(
+                rut_numero=partes[0],
+                fecha=proceso.fecha_inicio,
+                categoria=categoria,
+                dominio=dominio or '',
+                proceso_id=proceso.id
+            )
+
+
+def linea_de_tiempo(rut_numero):
+    """
+    Todas las apariciones de un RUT en orden cronológico y un resumen: primera
+    y última aparición, primera vez que se marcó (categoría distinta de OK) y,
+    si en el último proceso es fantasma, desde cuándo lo es sin interrupción.
+    """
+    filas = HistorialRut.objects.filter(rut_numero=rut_numero).order_by('fecha').values_list(
+        'fecha', 'categoria', 'dominio', 'proceso_id'
+    )
+    entradas = [
+        {'fecha': fecha, 'categoria': categoria, 'dominio': dominio, 'proceso': proceso_id}
+        for fecha, categoria, dominio, proceso_id in filas
+    ]
+    
+    # Por proceso (con varios dominios un RUT puede aparecer más de una vez)
+    procesos = []
+    for entrada in entradas:
+        if not procesos or procesos[-1]['proceso'] != entrada['proceso']:
+            procesos.append({'proceso': entrada['proceso'], 'fecha': entrada['fecha'], 'categorias': set()})
+        procesos[-1]['categorias'].add(entrada['categoria'])
+    
+    fantasma_desde = None
+    for proceso in reversed(procesos):
+        if 'FANTASMA_TOTAL' not in proceso['categorias']:
+            break
+        fantasma_desde = proceso['fecha']
+    
+    marcadas = [e['fecha'] for e in entradas if e['categoria'] not in CATEGORIAS_OK]
+    ultima = entradas[-1]['fecha'] if entradas else None
+    return {
+        'rut_numero': rut_numero,
+        'procesos': len(procesos),
+        'primera_aparicion': entradas[0]['fecha'] if entradas else None,
+        'ultima_aparicion': ultima,
+        'primera_deteccion': marcadas[0] if marcadas else None,
+        'fantasma_desde': fantasma_desde,
+        'dias_como_fantasma': (ultima - fantasma_desde).days if fantasma_desde else None,
+        'por_categoria': dict(Counter(e['categoria'] for e in entradas)),
+        'entradas': entradas,
+    }
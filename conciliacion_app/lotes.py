@@ -0,0 +1,33 @@
+# conciliacion_app/lotes.py
+"""
+Trabajo de los procesos hijos de `manage.py conciliar` y de la lectura en
+paralelo de los exports AD de una conciliación con varios dominios.
+
+Este módulo no importa modelos al cargarse: con los métodos de inicio spawn
+y forkserver cada hijo lo importa antes de tener Django configurado, y la
+configuración la hace `iniciar_trabajador`.
+"""
+import os
+import sys
+
+import django
+
+
+def iniciar_trabajador(silenciar=True):
+    """Inicializador del pool: configura Django y descarta la salida de los procesadores"""
+    django.setup()
+    if silenciar:
+        sys.stdout = open(os.devnull, 'w')
+
+
+def procesar_par(ruta_nomina, ruta_ad, medir_memoria=False):
+    """Lee y concilia un par de archivos (sin base de datos); ver pipeline.procesar_y_conciliar"""
+    from .pipeline import procesar_y_conciliar
+    return procesar_y_conciliar(ruta_nomina, ruta_ad, medir_memoria)
+
+
+def leer_export_ad(ruta):
+    """Lee un export AD en un proceso hijo (ver pipeline.leer_exports_ad); no usa la base"""
+    from .utils.procesadores import ProcesadorTXTAD
+    sys.stdout = open(os.devnull, 'w')
+    return ProcesadorTXTAD().procesar(ruta)
@@ -0,0 +1,54 @@
+# conciliacion_app/management/commands/archivar_procesos.py
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from conciliacion_app.archivado import archivar_proceso, procesos_archivables, ruta_archivo
+
+
+class Command(BaseCommand):
+    help = (
+        'Archiva en un archivo comprimido por proceso los procesos completados, '
+        'sin pendientes y con más de RETENCION_MESES de antigüedad, y elimina sus filas'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--meses', type=int, help=f'Antigüedad mínima (por defecto {settings.RETENCION_MESES})')
+        parser.add_argument('--simular', action='store_true', help='Solo lista los procesos que se archivarían')
+        parser.add_argument('--compactar', action='store_true',
+                            help='Ejecuta VACUUM al terminar para devolver el espacio liberado al disco')
+    
+    def handle(self, *args, **opciones):
+        procesos = list(procesos_archivables(opciones['meses']))
+        if not procesos:
+            self.stdout.write('No hay procesos para archivar')
+            return
+        
+        total_filas = 0
+        for proceso in procesos:
+            if opciones['simular']:
+                self.stdout.write(f"{proceso.id}  {proceso.fecha_inicio:%Y-%m-%d}  "
+                                  f"{proceso.conciliaciones_generadas} conciliaciones")
+                continue
+            
+            inicio = time.perf_counter()
+            filas = archivar_proceso(proceso)
+            total_filas += filas
+            tamano_kb = os.path.getsize(ruta_archivo(proceso.archivo_historico)) / 1024
+            self.stdout.write(f"{proceso.id}  {proceso.fecha_inicio:%Y-%m-%d}  {filas:>8} filas  "
+                              f"{tamano_kb:>9.1f} KB  {time.perf_counter() - inicio:.2f} s")
+        
+        if opciones['simular']:
+            self.stdout.write(f"{len(procesos)} procesos se archivarían")
+            return
+        
+        self.stdout.write(self.style.SUCCESS(f"{len(procesos)} procesos archivados ({total_filas} filas)"))
+        
+        if opciones['compactar'] and connection.vendor == 'sqlite':
+            inicio = time.perf_counter()
+            with connection.cursor() as cursor:
+                cursor.execute('VACUUM')
+            self.stdout.write(f"VACUUM: {time.perf_counter() - inicio:.2f} s")
@@ -0,0 +1,77 @@
+# conciliacion_app/management/commands/benchmark_arranque.py
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+# Lo que hace un worker WSGI al arrancar: cargar la aplicación y la URLconf
+# (que importa las vistas). Informa qué dependencias pesadas quedaron cargadas.
+_ARRANQUE_WORKER = """
+import json, sys
+from ad_conciliacion.wsgi import application
+from django.urls import get_resolver
+get_resolver().url_patterns
+print(json.dumps({m: m in sys.modules for m in ('pandas', 'numpy', 'openpyxl')}))
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide el tiempo de arranque en frío de `manage.py check` y de un worker '
+        '(aplicación WSGI + URLconf), cada uno en un proceso nuevo'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--repeticiones', type=int, default=5)
+        parser.add_argument('--salida', help='Archivo JSON donde guardar los resultados')
+    
+    def handle(self, *args, **opciones):
+        repeticiones = max(opciones['repeticiones'], 1)
+        base = str(settings.BASE_DIR)
+        comandos = {
+            'manage_check': [sys.executable, os.path.join(base, 'manage.py'), 'check'],
+            'arranque_worker': [sys.executable, '-c', _ARRANQUE_WORKER],
+        }
+        
+        resultados = []
+        modulos_cargados = None
+        for nombre, comando in comandos.items():
+            tiempos = []
+            for _ in range(repeticiones):
+                inicio = time.perf_counter()
+                proceso = subprocess.run(comando, cwd=base, capture_output=True, text=True)
+                tiempos.append(time.perf_counter() - inicio)
+                if proceso.returncode != 0:
+                    raise CommandError(f"{nombre} falló:\n{proceso.stderr}")
+                if nombre == 'arranque_worker':
+                    modulos_cargados = json.loads(proceso.stdout.strip().splitlines()[-1])
+            
+            resultados.append({
+                'etapa': nombre,
+                'repeticiones': repeticiones,
+                'mediana_segundos': round(statistics.median(tiempos), 4),
+                'minimo_segundos': round(min(tiempos), 4),
+            })
+            self.stdout.write(
+                f"{nombre:<18} mediana {statistics.median(tiempos):.3f}s  mínimo {min(tiempos):.3f}s"
+            )
+        
+        self.stdout.write(f"Módulos pesados cargados al arrancar un worker: {modulos_cargados}")
+        
+        if opciones['salida']:
+            with open(opciones['salida'], 'w', encoding='utf-8') as f:
+                json.dump({
+                    'version': 1,
+                    'fecha': timezone.now().isoformat(),
+                    'python': platform.python_version(),
+                    'resultados': resultados,
+                    'modulos_cargados': modulos_cargados,
+                }, f, indent=2, ensure_ascii=False)
+            self.stdout.write(self.style.SUCCESS(f"Resultados guardados en {opciones['salida']}"))
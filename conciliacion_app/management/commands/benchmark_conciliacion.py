@@ -0,0 +1,164 @@
+# conciliacion_app/management/commands/benchmark_conciliacion.py
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from conciliacion_app.models import ArchivoCargado, ProcesoConciliacion
+from conciliacion_app.pipeline import guardar_empleados, guardar_cuentas, guardar_resultados, reglas_conciliacion
+from conciliacion_app.utils.datos_sinteticos import GeneradorDatosSinteticos
+from conciliacion_app.utils.generadores import GeneradorScriptsPowershell, construir_indice_cuentas
+from conciliacion_app.utils.procesadores import ProcesadorExcelNomina, ProcesadorTXTAD, Conciliador
+from conciliacion_app.utils.rut import clave_rut
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide cada etapa del pipeline de conciliación sobre datos sintéticos '
+        'deterministas y guarda los tiempos en JSON para comparar entre commits'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--tamanos', nargs='+', type=int, default=[1000, 100000],
+                            help='Filas por archivo a generar (ej. 1000 100000 1000000)')
+        parser.add_argument('--semilla', type=int, default=2025)
+        parser.add_argument('--directorio', default=os.path.join(tempfile.gettempdir(), 'bench_conciliacion'),
+                            help='Dónde generar (y reutilizar) los archivos sintéticos')
+        parser.add_argument('--salida', default='bench_conciliacion.json',
+                            help='Archivo JSON de resultados')
+        parser.add_argument('--comparar', help='JSON de una ejecución anterior para mostrar diferencias')
+        parser.add_argument('--sin-persistencia', action='store_true',
+                            help='No medir la escritura en base de datos')
+    
+    def handle(self, *args, **opciones):
+        generador_datos = GeneradorDatosSinteticos(semilla=opciones['semilla'])
+        mediciones = []
+        
+        base_anterior = None
+        if not opciones['sin_persistencia']:
+            # La persistencia se mide en una base de pruebas, nunca en la real
+            base_anterior = connection.settings_dict['NAME']
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        
+        try:
+            for tamano in opciones['tamanos']:
+                self.stdout.write(f'Generando datos sintéticos de {tamano} filas...')
+                ruta_nomina, ruta_ad = generador_datos.generar_par(opciones['directorio'], tamano)
+                mediciones.extend(self._medir_tamano(tamano, ruta_nomina, ruta_ad, opciones))
+        finally:
+            if base_anterior is not None:
+                connection.creation.destroy_test_db(base_anterior, verbosity=0)
+        
+        reporte = {
+            'version': 1,
+            'commit': self._commit_actual(),
+            'fecha': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'semilla': opciones['semilla'],
+            'resultados': mediciones,
+        }
+        with open(opciones['salida'], 'w', encoding='utf-8') as f:
+            json.dump(reporte, f, indent=2, ensure_ascii=False)
+        
+        self._imprimir(mediciones, opciones.get('comparar'))
+        self.stdout.write(self.style.SUCCESS(f"Resultados guardados en {opciones['salida']}"))
+    
+    def _medir_tamano(self, tamano, ruta_nomina, ruta_ad, opciones):
+        """Mide cada etapa por separado para un tamaño de archivo"""
+        mediciones = []
+        
+        def medir(etapa, funcion, filas=None):
+            # Los procesadores imprimen mucho; se descarta para no medir la consola
+            with open(os.devnull, 'w') as nulo, contextlib.redirect_stdout(nulo):
+                inicio = time.perf_counter()
+                resultado = funcion()
+                segundos = time.perf_counter() - inicio
+            if filas is None:
+                filas = len(resultado) if hasattr(resultado, '__len__') else 0
+            mediciones.append({
+                'tamano': tamano,
+                'etapa': etapa,
+                'segundos': round(segundos, 6),
+                'filas': filas,
+                'filas_por_segundo': round(filas / segundos, 1) if segundos > 0 else None,
+            })
+            self.stdout.write(f'  {tamano:>9} {etapa:<22} {segundos:10.3f}s  {filas} filas')
+            return resultado
+        
+        empleados = medir('procesar_nomina', lambda: ProcesadorExcelNomina().procesar(ruta_nomina))
+        cuentas = medir('procesar_ad', lambda: ProcesadorTXTAD().procesar(ruta_ad))
+        
+        resultados = medir('conciliar', lambda: Conciliador(reglas_conciliacion()).conciliar(empleados, cuentas))
+        
+        if not opciones['sin_persistencia']:
+            self._medir_persistencia(medir, tamano, empleados, cuentas, resultados)
+        
+        indice = construir_indice_cuentas(
+            (('', clave_rut(c.rut_numero, c.rut_normalizado)), c.nombre_usuario) for c in cuentas
+        )
+        generador = GeneradorScriptsPowershell(indice)
+        for etapa, compacto in (('script_bloqueo', False), ('script_bloqueo_compacto', True)):
+            medir(etapa, lambda: sum(len(t) for t in generador.generar_script_stream(
+                resultados, 'BLOQUEO_MASIVO', compacto=compacto
+            )), filas=len(resultados))
+        
+        return mediciones
+    
+    def _medir_persistencia(self, medir, tamano, empleados, cuentas, resultados):
+        """Escritura de entradas y resultados en la base de pruebas"""
+        usuario, _ = User.objects.get_or_create(username='benchmark')
+        archivo_nomina = ArchivoCargado.objects.create(
+            nombre_original=f'nomina_{tamano}.xlsx', tipo_archivo='NOMINA',
+            archivo=f'benchmark/nomina_{tamano}.xlsx', usuario=usuario
+        )
+        archivo_ad = ArchivoCargado.objects.create(
+            nombre_original=f'ad_{tamano}.csv', tipo_archivo='AD',
+            archivo=f'benchmark/ad_{tamano}.csv', usuario=usuario
+        )
+        
+        def guardar_entradas():
+            guardar_empleados(empleados, archivo_nomina)
+            guardar_cuentas(cuentas, archivo_ad)
+        
+        medir('persistir_entradas', guardar_entradas, filas=len(empleados) + len(cuentas))
+        
+        proceso = ProcesoConciliacion.objects.create(
+            usuario=usuario, archivo_nomina=archivo_nomina, archivo_ad=archivo_ad, estado='PROCESANDO'
+        )
+        medir('persistir_resultados', lambda: guardar_resultados(
+            proceso, resultados, usuario, len(empleados), len(cuentas)
+        ), filas=len(resultados))
+    
+    def _commit_actual(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+    
+    def _imprimir(self, mediciones, ruta_comparar):
+        """Resumen en consola; con --comparar agrega la variación respecto a otra ejecución"""
+        anteriores = {}
+        if ruta_comparar:
+            with open(ruta_comparar, encoding='utf-8') as f:
+                for m in json.load(f)['resultados']:
+                    anteriores[(m['tamano'], m['etapa'])] = m['segundos']
+        
+        self.stdout.write('')
+        self.stdout.write(f"{'tamaño':>9} {'etapa':<24} {'segundos':>10} {'filas/s':>12}" +
+                          (f" {'variación':>10}" if anteriores else ''))
+        for m in mediciones:
+            linea = f"{m['tamano']:>9} {m['etapa']:<24} {m['segundos']:>10.3f} {m['filas_por_segundo'] or 0:>12.0f}"
+            anterior = anteriores.get((m['tamano'], m['etapa']))
+            if anterior:
+                linea += f" {(m['segundos'] - anterior) / anterior * 100:>+9.1f}%"
+            self.stdout.write(linea)
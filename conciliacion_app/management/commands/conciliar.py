@@ -0,0 +1,147 @@
+# conciliacion_app/management/commands/conciliar.py
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from conciliacion_app.lotes import iniciar_trabajador, procesar_par
+from conciliacion_app.pipeline import persistir_conciliacion, registrar_archivo
+
+EXTENSIONES_NOMINA = ('.xlsx', '.xls')
+EXTENSIONES_AD = ('.txt', '.csv')
+
+
+class Command(BaseCommand):
+    help = (
+        'Concilia muchos pares (nómina, AD) sin pasar por la web. La lectura y el '
+        'cruce corren en paralelo en un pool de procesos; la escritura en la base '
+        'la hace este proceso, un par a la vez'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--par', nargs=2, action='append', default=[], metavar=('NOMINA', 'AD'),
+                            help='Un par de archivos; se puede repetir')
+        parser.add_argument('--manifiesto',
+                            help='CSV con columnas nomina,ad (rutas relativas al manifiesto)')
+        parser.add_argument('--procesos', type=int, default=os.cpu_count() or 1,
+                            help='Procesos en paralelo (por defecto, uno por CPU)')
+        parser.add_argument('--usuario', default='conciliacion_lote',
+                            help='Usuario dueño de los procesos creados (se crea si no existe)')
+        parser.add_argument('--salida', help='Archivo JSON donde guardar el resumen')
+        parser.add_argument('--medir-memoria', action='store_true',
+                            help='Medir la memoria de cada etapa con tracemalloc (bastante más lento)')
+    
+    def handle(self, *args, **opciones):
+        pares = [tuple(par) for par in opciones['par']]
+        if opciones['manifiesto']:
+            pares.extend(self._leer_manifiesto(opciones['manifiesto']))
+        if not pares:
+            raise CommandError('Indica al menos un --par NOMINA AD o un --manifiesto')
+        pares = [self._validar_par(*par) for par in pares]
+        
+        procesos = max(1, min(opciones['procesos'], len(pares)))
+        usuario, _ = User.objects.get_or_create(username=opciones['usuario'])
+        self.stdout.write(f"Conciliando {len(pares)} pares con {procesos} procesos...")
+        
+        # Los hijos no deben heredar conexiones abiertas a la base
+        connections.close_all()
+        
+        resumen = []
+        inicio = time.perf_counter()
+        with ProcessPoolExecutor(
+            max_workers=procesos,
+            initializer=iniciar_trabajador,
+            initargs=(opciones['verbosity'] < 2,)
+        ) as pool:
+            futuros = {
+                pool.submit(procesar_par, nomina, ad, opciones['medir_memoria']): (nomina, ad)
+                for nomina, ad in pares
+            }
+            for futuro in as_completed(futuros):
+                nomina, ad = futuros[futuro]
+                resumen.append(self._persistir(futuro, nomina, ad, usuario, opciones['medir_memoria']))
+        segundos = time.perf_counter() - inicio
+        
+        self._imprimir_resumen(resumen, segundos, procesos)
+        if opciones['salida']:
+            with open(opciones['salida'], 'w', encoding='utf-8') as f:
+                json.dump({'segundos': round(segundos, 3), 'procesos': procesos, 'pares': resumen},
+                          f, indent=2, ensure_ascii=False)
+        
+        if any(r['error'] for r in resumen):
+            raise CommandError(f"{sum(1 for r in resumen if r['error'])} pares con error")
+    
+    def _leer_manifiesto(self, ruta):
+        base = os.path.dirname(os.path.abspath(ruta))
+        try:
+            with open(ruta, newline='', encoding='utf-8-sig') as f:
+                filas = list(csv.DictReader(f))
+        except OSError as e:
+            raise CommandError(f"No se pudo leer el manifiesto: {e}")
+        if filas and not {'nomina', 'ad'} <= set(filas[0]):
+            raise CommandError('El manifiesto debe tener las columnas nomina y ad')
+        return [(os.path.join(base, fila['nomina']), os.path.join(base, fila['ad'])) for fila in filas]
+    
+    def _validar_par(self, nomina, ad):
+        for ruta, extensiones in ((nomina, EXTENSIONES_NOMINA), (ad, EXTENSIONES_AD)):
+            if not os.path.isfile(ruta):
+                raise CommandError(f"No existe el archivo {ruta}")
+            if not ruta.lower().endswith(extensiones):
+                raise CommandError(f"{ruta}: se esperaba {' o '.join(extensiones)}")
+        return os.path.abspath(nomina), os.path.abspath(ad)
+    
+    def _persistir(self, futuro, nomina, ad, usuario, medir_memoria):
+        """Guarda en la base el resultado de un par ya procesado por el pool"""
+        registro = {'nomina': nomina, 'ad': ad, 'proceso': None, 'error': None}
+        archivos = []
+        try:
+            empleados, cuentas, resultados, etapas = futuro.result()
+            inicio = time.perf_counter()
+            archivos.append(registrar_archivo(nomina, 'NOMINA', usuario))
+            archivos.append(registrar_archivo(ad, 'AD', usuario))
+            proceso = persistir_conciliacion(
+                archivos[0], {'': archivos[1]}, usuario, empleados, {'': cuentas}, resultados, etapas,
+                medir_memoria=medir_memoria
+            )
+        except Exception as e:
+            registro['error'] = str(e)
+            self.stderr.write(f"ERROR {os.path.basename(nomina)} + {os.path.basename(ad)}: {e}")
+            # Igual que la carga web: se descartan los archivos (y sus filas, en cascada)
+            for archivo in archivos:
+                archivo.archivo.delete(save=False)
+                archivo.delete()
+            return registro
+        
+        registro.update({
+            'proceso': str(proceso.id),
+            'filas': len(empleados) + len(cuentas),
+            'resultados': len(resultados),
+            'segundos_pool': round(sum(m['segundos'] for m in etapas), 3),
+            'segundos_persistencia': round(time.perf_counter() - inicio, 3),
+        })
+        self.stdout.write(
+            f"  {os.path.basename(nomina):<40} {os.path.basename(ad):<30} {registro['filas']:>9} filas "
+            f"{registro['resultados']:>8} resultados  {registro['segundos_pool']:>7.2f}s + "
+            f"{registro['segundos_persistencia']:.2f}s"
+        )
+        return registro
+    
+    def _imprimir_resumen(self, resumen, segundos, procesos):
+        correctos = [r for r in resumen if not r['error']]
+        filas = sum(r['filas'] for r in correctos)
+        segundos_pool = sum(r['segundos_pool'] for r in correctos)
+        
+        self.stdout.write('')
+        self.stdout.write(f"Pares: {len(correctos)} conciliados, {len(resumen) - len(correctos)} con error")
+        self.stdout.write(f"Tiempo total: {segundos:.2f} s con {procesos} procesos")
+        if segundos > 0:
+            self.stdout.write(f"Rendimiento: {filas / segundos:,.0f} filas/s, "
+                              f"{len(correctos) / segundos * 60:.1f} pares/min")
+            # Tiempo de lectura y cruce sumado de todos los hijos frente al tiempo real
+            self.stdout.write(f"Paralelismo efectivo: {segundos_pool / segundos:.2f}x")
+        self.stdout.write(self.style.SUCCESS(f"{filas} filas procesadas"))
@@ -0,0 +1,45 @@
+# conciliacion_app/management/commands/indexar_historial_ruts.py
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef
+
+from conciliacion_app.archivado import conciliaciones_archivadas
+from conciliacion_app.historial import entradas_historial
+from conciliacion_app.models import HistorialRut, ProcesoConciliacion
+from conciliacion_app.pipeline import insertar_por_bloques
+
+
+class Command(BaseCommand):
+    help = (
+        'Llena el índice de historia por RUT con los procesos completados que aún '
+        'no están en él (los nuevos se indexan solos al terminar), incluidos los archivados'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--reconstruir', action='store_true',
+                            help='Borra el índice completo y lo vuelve a generar')
+    
+    def handle(self, *args, **opciones):
+        if opciones['reconstruir']:
+            borradas, _ = HistorialRut.objects.all().delete()
+            self.stdout.write(f"{borradas} entradas eliminadas")
+        
+        pendientes = ProcesoConciliacion.objects.filter(estado='COMPLETADO').exclude(
+            Exists(HistorialRut.objects.filter(proceso=OuterRef('pk')))
+        ).order_by('fecha_inicio')
+        
+        inicio = time.perf_counter()
+        total_procesos = 0
+        total_filas = 0
+        for proceso in pendientes.iterator():
+            if proceso.archivado:
+                filas = ((c.rut, c.categoria, c.dominio) for c in conciliaciones_archivadas(proceso))
+            else:
+                filas = proceso.conciliaciones().values_list('rut', 'categoria', 'dominio').iterator(chunk_size=2000)
+            total_filas += insertar_por_bloques(HistorialRut, entradas_historial(proceso, filas))
+            total_procesos += 1
+        
+        self.stdout.write(self.style.SUCCESS(
+            f"{total_procesos} procesos indexados ({total_filas} entradas) en {time.perf_counter() - inicio:.2f}s"
+        ))
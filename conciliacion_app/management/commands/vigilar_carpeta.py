@@ -0,0 +1,171 @@
+# conciliacion_app/management/commands/vigilar_carpeta.py
+import hashlib
+import os
+import socket
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+from django.utils import timezone
+
+from conciliacion_app.models import EntradaCarpeta
+from conciliacion_app.pipeline import ejecutar_conciliacion, registrar_archivo
+from conciliacion_app.utils.carpeta import DetectorEstabilidad, emparejar
+
+
+def firma_par(nomina, ad):
+    """Identifica un par por nombre, tamaño y mtime de ambos archivos (sin leerlos)"""
+    texto = '|'.join(f'{a.nombre}:{a.tamano}:{a.mtime_ns}' for a in (nomina, ad))
+    return hashlib.sha256(texto.encode('utf-8')).hexdigest()
+
+
+class Command(BaseCommand):
+    help = (
+        'Vigila CARPETA_ENTRADA y concilia automáticamente cada par nómina/AD nuevo '
+        'o modificado una vez que sus archivos dejan de cambiar'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--directorio', default=settings.CARPETA_ENTRADA,
+                            help='Carpeta a vigilar (por defecto CARPETA_ENTRADA)')
+        parser.add_argument('--intervalo', type=float, default=settings.CARPETA_INTERVALO,
+                            help='Segundos entre recorridos de la carpeta')
+        parser.add_argument('--estable', type=float, default=settings.CARPETA_SEGUNDOS_ESTABLE,
+                            help='Segundos sin cambios de tamaño ni mtime para considerar listo un archivo')
+        parser.add_argument('--abandonada', type=float, default=settings.CARPETA_SEGUNDOS_PROCESANDO,
+                            help='Segundos tras los que una entrada tomada por un vigilante de otro equipo '
+                                 'y sin terminar vuelve a la cola')
+        parser.add_argument('--usuario', default='conciliacion_carpeta',
+                            help='Usuario dueño de los procesos creados (se crea si no existe)')
+        parser.add_argument('--una-vez', action='store_true',
+                            help='Hace un solo recorrido y termina (para cron o pruebas)')
+        parser.add_argument('--nice', type=int, default=10,
+                            help='Baja la prioridad del proceso para no competir con la web (0 = sin cambio)')
+    
+    def handle(self, *args, **opciones):
+        directorio = opciones['directorio']
+        if not os.path.isdir(directorio):
+            raise CommandError(f"No existe la carpeta {directorio}")
+        if opciones['nice'] and hasattr(os, 'nice'):
+            os.nice(opciones['nice'])
+        
+        self.usuario, _ = User.objects.get_or_create(username=opciones['usuario'])
+        self.detector = DetectorEstabilidad(directorio, opciones['estable'])
+        self.firmas_conocidas = set()
+        self.segundos_abandonada = opciones['abandonada']
+        
+        self.stdout.write(f"Vigilando {directorio} cada {opciones['intervalo']:g}s "
+                          f"(estable tras {opciones['estable']:g}s)")
+        try:
+            while True:
+                self._recorrer()
+                self._procesar_pendientes()
+                if opciones['una_vez']:
+                    break
+                time.sleep(opciones['intervalo'])
+        except KeyboardInterrupt:
+            self.stdout.write('Vigilancia detenida')
+    
+    def _recorrer(self):
+        """Encola los pares estables que no se habían visto con el mismo tamaño y mtime"""
+        pares = emparejar(self.detector.recorrer(), settings.CARPETA_PATRON_NOMINA, settings.CARPETA_PATRON_AD)
+        for periodo, (nomina, ad) in pares.items():
+            firma = firma_par(nomina, ad)
+            if firma in self.firmas_conocidas:
+                continue
+            try:
+                _, creada = EntradaCarpeta.objects.get_or_create(
+                    firma=firma,
+                    defaults={'periodo': periodo, 'ruta_nomina': nomina.ruta, 'ruta_ad': ad.ruta}
+                )
+            except IntegrityError:
+                creada = False  # Otro vigilante la encoló al mismo tiempo
+            self.firmas_conocidas.add(firma)
+            if creada:
+                self.stdout.write(f"Encolado {periodo}: {nomina.nombre} + {ad.nombre}")
+    
+    def _reencolar_abandonadas(self):
+        """
+        Devuelve a PENDIENTE las entradas tomadas por un vigilante que no
+        terminó y descarta los archivos (con sus filas y procesos) que ese
+        intento alcanzó a registrar
+        """
+        limite = timezone.now() - timedelta(seconds=self.segundos_abandonada)
+        reencoladas = 0
+        for entrada in EntradaCarpeta.objects.filter(estado='PROCESANDO').select_related('archivo_nomina', 'archivo_ad'):
+            if not self._abandonada(entrada, limite):
+                continue
+            # Condicional sobre la misma toma: si otro vigilante ya la reencoló
+            # (o la volvió a tomar) no se actualiza ninguna fila
+            if not EntradaCarpeta.objects.filter(
+                pk=entrada.pk, estado='PROCESANDO', fecha_toma=entrada.fecha_toma, tomada_por=entrada.tomada_por
+            ).update(estado='PENDIENTE', fecha_toma=None, tomada_por='', archivo_nomina=None, archivo_ad=None):
+                continue
+            for archivo in (entrada.archivo_nomina, entrada.archivo_ad):
+                if archivo is not None:
+                    archivo.archivo.delete(save=False)
+                    archivo.eliminar_con_procesos()
+            reencoladas += 1
+        if reencoladas:
+            self.stdout.write(f"Reencoladas {reencoladas} entradas abandonadas")
+    
+    def _abandonada(self, entrada, limite):
+        """
+        Si el dueño corría en este equipo, la entrada está abandonada cuando su
+        proceso ya no existe; si no, cuando la toma supera el límite
+        """
+        equipo, _, pid = entrada.tomada_por.rpartition(':')
+        if equipo == socket.gethostname() and pid.isdigit() and os.name == 'posix':
+            try:
+                os.kill(int(pid), 0)  # Señal 0: solo comprueba que el proceso exista
+            except ProcessLookupError:
+                return True
+            except PermissionError:
+                pass  # Existe, de otro usuario
+            return False
+        return entrada.fecha_toma is None or entrada.fecha_toma < limite
+    
+    def _procesar_pendientes(self):
+        self._reencolar_abandonadas()
+        for entrada in EntradaCarpeta.objects.filter(estado='PENDIENTE').order_by('fecha_deteccion'):
+            # Tomar la entrada con un UPDATE condicional: si otro vigilante ya
+            # la tomó no se actualiza ninguna fila
+            tomada = EntradaCarpeta.objects.filter(pk=entrada.pk, estado='PENDIENTE').update(
+                estado='PROCESANDO', fecha_toma=timezone.now(), tomada_por=f'{socket.gethostname()}:{os.getpid()}'
+            )
+            if tomada:
+                self._procesar(entrada)
+    
+    def _procesar(self, entrada):
+        inicio = time.perf_counter()
+        archivos = []
+        try:
+            archivos.append(registrar_archivo(entrada.ruta_nomina, 'NOMINA', self.usuario))
+            archivos.append(registrar_archivo(entrada.ruta_ad, 'AD', self.usuario))
+            # Si este vigilante cae, quien reencole la entrada descarta estos archivos
+            entrada.archivo_nomina, entrada.archivo_ad = archivos
+            entrada.save(update_fields=['archivo_nomina', 'archivo_ad'])
+            proceso = ejecutar_conciliacion(archivos[0], archivos[1], self.usuario)
+        except Exception as e:
+            # Igual que la carga web: se descartan los archivos (con sus filas y el proceso fallido)
+            for archivo in archivos:
+                archivo.archivo.delete(save=False)
+                archivo.eliminar_con_procesos()
+            entrada.estado = 'ERROR'
+            entrada.errores = str(e)
+            entrada.fecha_fin = timezone.now()
+            entrada.save(update_fields=['estado', 'errores', 'fecha_fin'])
+            self.stderr.write(f"ERROR {entrada.periodo}: {e}")
+            return
+        
+        entrada.estado = 'COMPLETADO'
+        entrada.proceso = proceso
+        entrada.fecha_fin = timezone.now()
+        entrada.save(update_fields=['estado', 'proceso', 'fecha_fin'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Conciliado {entrada.periodo}: proceso {proceso.id}, "
+            f"{proceso.conciliaciones_generadas} conciliaciones en {time.perf_counter() - inicio:.2f}s"
+        ))
@@ -0,0 +1,227 @@
+# conciliacion_app/metricas.py
+"""
+Métricas operacionales en formato de texto de Prometheus, sin dependencias.
+
+Los valores viven en memoria del proceso (cada worker expone los suyos) y se
+actualizan una vez por etapa, archivo o solicitud, nunca por fila, para que
+se puedan dejar activas bajo carga. Las colas (carpeta de entrada, cargas
+fragmentadas) se cuentan en la base al leer las métricas, así que valen lo
+mismo en cualquier worker y ven también a vigilar_carpeta y conciliar.
+"""
+import bisect
+import threading
+from collections import Counter
+
+_BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+_BUCKETS_BYTES = tuple(1024 * 4 ** i for i in range(10))  # 1 KB .. 256 MB
+_BUCKETS_FILAS_POR_SEGUNDO = tuple(10 ** i for i in range(1, 8))
+
+
+def _etiquetas_texto(nombres, valores, extra=''):
+    partes = []
+    for nombre, valor in zip(nombres, valores):
+        valor = str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        partes.append(f'{nombre}="{valor}"')
+    if extra:
+        partes.append(extra)
+    return '{' + ','.join(partes) + '}' if partes else ''
+
+
+def _numero(valor):
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class _Metrica:
+    tipo = ''
+    
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._valores = {}
+        self._lock = threading.Lock()
+    
+    def _clave(self, etiquetas):
+        return tuple(str(etiquetas[n]) for n in self.etiquetas)
+    
+    def exponer(self):
+        lineas = [f'# HELP {self.nombre} {self.ayuda}', f'# TYPE {self.nombre} {self.tipo}']
+        with self._lock:
+            valores = sorted(self._valores.items())
+        for clave, valor in valores:
+            lineas.extend(self._lineas(clave, valor))
+        return lineas
+
+
+class Contador(_Metrica):
+    tipo = 'counter'
+    
+    def inc(self, cantidad=1, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + cantidad
+    
+    def _lineas(self, clave, valor):
+        return [f'{self.nombre}{_etiquetas_texto(self.etiquetas, clave)} {_numero(valor)}']
+
+
+class Medidor(_Metrica):
+    """Valor que sube y baja (gauge)"""
+    tipo = 'gauge'
+    
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        super().__init__(nombre, ayuda, etiquetas)
+        if not self.etiquetas:
+            self._valores[()] = 0  # Se expone en 0 desde el inicio
+    
+    def inc(self, cantidad=1, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + cantidad
+    
+    def dec(self, cantidad=1, **etiquetas):
+        self.inc(-cantidad, **etiquetas)
+    
+    def _lineas(self, clave, valor):
+        return [f'{self.nombre}{_etiquetas_texto(self.etiquetas, clave)} {_numero(valor)}']
+
+
+class MedidorCalculado(_Metrica):
+    """Gauge que se calcula al exponerse: `funcion` retorna {valores de etiquetas: valor}"""
+    tipo = 'gauge'
+    
+    def __init__(self, nombre, ayuda, funcion, etiquetas=()):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.funcion = funcion
+    
+    def exponer(self):
+        with self._lock:
+            self._valores = {tuple(map(str, clave)): valor for clave, valor in self.funcion().items()}
+        return super().exponer()
+    
+    def _lineas(self, clave, valor):
+        return [f'{self.nombre}{_etiquetas_texto(self.etiquetas, clave)} {_numero(valor)}']
+
+
+class Histograma(_Metrica):
+    tipo = 'histogram'
+    
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=_BUCKETS_SEGUNDOS):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.buckets = tuple(buckets)
+    
+    def observar(self, valor, **etiquetas):
+        clave = self._clave(etiquetas)
+        indice = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            estado = self._valores.get(clave)
+            if estado is None:
+                # [conteo por bucket (el último es +Inf), suma, total]
+                estado = self._valores[clave] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            estado[0][indice] += 1
+            estado[1] += valor
+            estado[2] += 1
+    
+    def _lineas(self, clave, estado):
+        conteos, suma, total = estado
+        lineas = []
+        acumulado = 0
+        for limite, conteo in zip(self.buckets + ('+Inf',), conteos):
+            acumulado += conteo
+            le = 'le="+Inf"' if limite == '+Inf' else f'le="{_numero(limite)}"'
+            lineas.append(f'{self.nombre}_bucket{_etiquetas_texto(self.etiquetas, clave, le)} {acumulado}')
+        etiquetas = _etiquetas_texto(self.etiquetas, clave)
+        lineas.append(f'{self.nombre}_sum{etiquetas} {_numero(suma)}')
+        lineas.append(f'{self.nombre}_count{etiquetas} {total}')
+        return lineas
+
+
+class Registro:
+    def __init__(self):
+        self._metricas = []
+    
+    def registrar(self, metrica):
+        self._metricas.append(metrica)
+        return metrica
+    
+    def exponer(self):
+        lineas = []
+        for metrica in self._metricas:
+            lineas.extend(metrica.exponer())
+        return '\n'.join(lineas) + '\n'
+
+
+def _cola_carpeta():
+    from django.db.models import Count
+    from .models import EntradaCarpeta
+    conteos = {('PENDIENTE',): 0, ('PROCESANDO',): 0}
+    for fila in EntradaCarpeta.objects.filter(
+        estado__in=['PENDIENTE', 'PROCESANDO']
+    ).order_by().values('estado').annotate(total=Count('id')):
+        conteos[(fila['estado'],)] = fila['total']
+    return conteos
+
+
+def _cargas_en_curso():
+    from .models import CargaFragmentada
+    return {(): CargaFragmentada.objects.filter(estado='EN_CURSO').count()}
+
+
+REGISTRO = Registro()
+
+ARCHIVO_BYTES = REGISTRO.registrar(Histograma(
+    'conciliacion_archivo_subido_bytes', 'Tamaño de los archivos subidos',
+    etiquetas=('tipo',), buckets=_BUCKETS_BYTES
+))
+ETAPA_DURACION = REGISTRO.registrar(Histograma(
+    'conciliacion_etapa_duracion_segundos', 'Duración de cada etapa del pipeline',
+    etiquetas=('etapa',)
+))
+ETAPA_FILAS = REGISTRO.registrar(Contador(
+    'conciliacion_etapa_filas_total', 'Filas procesadas por etapa del pipeline',
+    etiquetas=('etapa',)
+))
+ETAPA_FILAS_POR_SEGUNDO = REGISTRO.registrar(Histograma(
+    'conciliacion_etapa_filas_por_segundo', 'Filas por segundo de cada ejecución de una etapa',
+    etiquetas=('etapa',), buckets=_BUCKETS_FILAS_POR_SEGUNDO
+))
+PROCESOS_EN_CURSO = REGISTRO.registrar(Medidor(
+    'conciliacion_procesos_en_curso', 'Conciliaciones en procesamiento en este proceso'
+))
+COLA_CARPETA = REGISTRO.registrar(MedidorCalculado(
+    'conciliacion_cola_carpeta', 'Pares de la carpeta de entrada por conciliar (PENDIENTE) o en curso (PROCESANDO)',
+    _cola_carpeta, etiquetas=('estado',)
+))
+CARGAS_EN_CURSO = REGISTRO.registrar(MedidorCalculado(
+    'conciliacion_cargas_en_curso', 'Cargas fragmentadas iniciadas y aún no finalizadas',
+    _cargas_en_curso
+))
+PROCESOS = REGISTRO.registrar(Contador(
+    'conciliacion_procesos_total', 'Conciliaciones ejecutadas por estado final',
+    etiquetas=('estado',)
+))
+RESULTADOS = REGISTRO.registrar(Contador(
+    'conciliacion_resultados_total', 'Resultados de conciliación por categoría',
+    etiquetas=('categoria',)
+))
+VISTA_LATENCIA = REGISTRO.registrar(Histograma(
+    'conciliacion_vista_latencia_segundos', 'Latencia de las vistas',
+    etiquetas=('vista', 'metodo')
+))
+
+
+def observar_etapa(etapa, segundos, filas):
+    """Registra una etapa terminada del pipeline (ver MedidorEtapas)"""
+    ETAPA_DURACION.observar(segundos, etapa=etapa)
+    ETAPA_FILAS.inc(filas, etapa=etapa)
+    if segundos > 0:
+        ETAPA_FILAS_POR_SEGUNDO.observar(filas / segundos, etapa=etapa)
+
+
+def observar_proceso(proceso, resultados=()):
+    """Registra el estado final de un proceso y sus resultados por categoría"""
+    PROCESOS.inc(estado=proceso.estado)
+    if proceso.estado != 'COMPLETADO':
+        return
+    for categoria, cantidad in Counter(r['categoria'] for r in resultados).items():
+        RESULTADOS.inc(cantidad, categoria=categoria)
@@ -0,0 +1,150 @@
+# conciliacion_app/middleware.py
+import cProfile
+import os
+import random
+import time
+import sys
+import traceback
+import uuid
+
+from django.conf import settings
+
+from . import metricas
+from .models import PerfilSolicitud
+from .utils.perfilador import MuestreadorPilas
+
+
+class PerfilamientoMiddleware:
+    """
+    Perfila solicitudes a pedido y deja el resultado enlazado desde el admin.
+    
+    Se activa:
+      - por solicitud, solo para usuarios staff, con la cabecera
+        `X-Perfilar` o el parámetro `?perfilar=`; el valor `muestreo`
+        usa el perfilador por muestreo y cualquier otro cProfile
+      - por tasa (PERFILAMIENTO_TASA_MUESTREO), para cualquier usuario,
+        siempre con el perfilador por muestreo (bajo costo)
+    
+    El archivo (.pstats o .collapsed) se guarda en PERFILAMIENTO_DIRECTORIO
+    con el id de la solicitud, que también se devuelve en `X-Perfil-Id`.
+    En respuestas streaming (descarga de scripts, ZIP de fragmentos) el
+    cuerpo se genera después de que la vista retorna: el perfilador sigue
+    activo hasta que se agota el contenido y recién ahí se guarda el perfil.
+    Debe ir después de AuthenticationMiddleware.
+    """
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
+    
+    def __call__(self, request):
+        activacion = self._activacion(request)
+        if activacion is None:
+            return self.get_response(request)
+        
+        origen, modo = activacion
+        perfil_id = uuid.uuid4()
+        inicio = time.perf_counter()
+        
+        if modo == 'CPROFILE':
+            perfilador = cProfile.Profile()
+            try:
+                perfilador.enable()
+            except ValueError:
+                # Ya hay otro perfilador activo en el proceso (ej. depurador)
+                return self.get_response(request)
+            detener = perfilador.disable
+        else:
+            perfilador = MuestreadorPilas(settings.PERFILAMIENTO_INTERVALO_MUESTREO)
+            perfilador.iniciar()
+            detener = perfilador.detener
+        
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            detener()
+            raise
+        
+        def finalizar():
+            detener()
+            self._guardar_seguro(request, response, perfil_id, origen, modo, perfilador,
+                                 time.perf_counter() - inicio)
+        
+        response['X-Perfil-Id'] = str(perfil_id)
+        if response.streaming and not response.is_async:
+            response.streaming_content = self._contenido_perfilado(response.streaming_content, finalizar)
+        else:
+            # Un stream asíncrono se consume en otro contexto: se perfila solo la vista
+            finalizar()
+        return response
+    
+    def _contenido_perfilado(self, contenido, finalizar):
+        """Entrega el contenido y guarda el perfil al agotarlo (o al cerrarse la respuesta)"""
+        try:
+            yield from contenido
+        finally:
+            finalizar()
+    
+    def _guardar_seguro(self, request, response, perfil_id, origen, modo, perfilador, duracion):
+        try:
+            self._guardar(request, response, perfil_id, origen, modo, perfilador, duracion)
+        except Exception as e:
+            # Un perfil que no se pudo guardar nunca debe romper la respuesta
+            print(f"[PERFIL] No se pudo guardar el perfil {perfil_id}: {e}", file=sys.stderr)
+            traceback.print_exc(file=sys.stderr)
+    
+    def _activacion(self, request):
+        """Retorna (origen, modo) si hay que perfilar la solicitud, si no None"""
+        usuario = getattr(request, 'user', None)
+        pedido = request.headers.get('X-Perfilar') or request.GET.get('perfilar')
+        
+        if pedido and usuario is not None and usuario.is_staff:
+            modo = 'MUESTREO' if pedido.lower() == 'muestreo' else 'CPROFILE'
+            return 'SOLICITADO', modo
+        
+        tasa = settings.PERFILAMIENTO_TASA_MUESTREO
+        if tasa > 0 and random.random() < tasa:
+            return 'MUESTREO', 'MUESTREO'
+        
+        return None
+    
+    def _guardar(self, request, response, perfil_id, origen, modo, perfilador, duracion):
+        directorio = settings.PERFILAMIENTO_DIRECTORIO
+        os.makedirs(directorio, exist_ok=True)
+        
+        if modo == 'CPROFILE':
+            nombre = f"{perfil_id}.pstats"
+            perfilador.dump_stats(os.path.join(directorio, nombre))
+        else:
+            nombre = f"{perfil_id}.collapsed"
+            perfilador.escribir_collapsed(os.path.join(directorio, nombre))
+        
+        usuario = getattr(request, 'user', None)
+        PerfilSolicitud.objects.create(
+            id=perfil_id,
+            usuario=usuario if usuario is not None and usuario.is_authenticated else None,
+            metodo=request.method,
+            ruta=request.get_full_path()[:500],
+            codigo_respuesta=response.status_code,
+            duracion_segundos=duracion,
+            modo=modo,
+            origen=origen,
+            archivo=nombre,
+        )
+
+
+class MetricasMiddleware:
+    """Registra la latencia de cada vista en conciliacion_vista_latencia_segundos"""
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
+    
+    def __call__(self, request):
+        inicio = time.perf_counter()
+        response = self.get_response(request)
+        coincidencia = getattr(request, 'resolver_match', None)
+        metricas.VISTA_LATENCIA.observar(
+            time.perf_counter() - inicio,
+            vista=coincidencia.view_name if coincidencia else 'sin_ruta',
+            metodo=request.method,
+        )
+        return response
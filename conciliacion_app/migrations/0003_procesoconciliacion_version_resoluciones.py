@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-19 10:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conciliacion_app', '0002_alter_empleadonomina_rut'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='procesoconciliacion',
+            name='version_resoluciones',
+            field=models.IntegerField(default=0),
+        ),
+    ]
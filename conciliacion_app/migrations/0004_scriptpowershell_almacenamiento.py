@@ -0,0 +1,42 @@
+# Generated by Django 6.0 on 2026-10-19 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conciliacion_app', '0003_procesoconciliacion_version_resoluciones'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scriptpowershell',
+            name='compacto',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='scriptpowershell',
+            name='contenido_comprimido',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='scriptpowershell',
+            name='hash_contenido',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='scriptpowershell',
+            name='version_resoluciones',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='scriptpowershell',
+            name='contenido',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddConstraint(
+            model_name='scriptpowershell',
+            constraint=models.UniqueConstraint(fields=('proceso', 'tipo_script', 'modo_seguro', 'compacto', 'version_resoluciones'), name='script_unico_por_version'),
+        ),
+    ]
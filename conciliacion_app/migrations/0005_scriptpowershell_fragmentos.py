@@ -0,0 +1,26 @@
+# Generated by Django 6.0 on 2026-10-19 12:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conciliacion_app', '0004_scriptpowershell_almacenamiento'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='scriptpowershell',
+            name='script_unico_por_version',
+        ),
+        migrations.AddField(
+            model_name='scriptpowershell',
+            name='fragmentos',
+            field=models.IntegerField(default=1),
+        ),
+        migrations.AddConstraint(
+            model_name='scriptpowershell',
+            constraint=models.UniqueConstraint(fields=('proceso', 'tipo_script', 'modo_seguro', 'compacto', 'fragmentos', 'version_resoluciones'), name='script_unico_por_version'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-19 14:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conciliacion_app', '0005_scriptpowershell_fragmentos'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='procesoconciliacion',
+            name='metricas_etapas',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
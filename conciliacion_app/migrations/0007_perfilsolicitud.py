@@ -0,0 +1,37 @@
+# Generated by Django 6.0 on 2026-10-19 15:02
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conciliacion_app', '0006_procesoconciliacion_metricas_etapas'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PerfilSolicitud',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('fecha', models.DateTimeField(auto_now_add=True)),
+                ('metodo', models.CharField(max_length=10)),
+                ('ruta', models.CharField(max_length=500)),
+                ('codigo_respuesta', models.IntegerField(default=0)),
+                ('duracion_segundos', models.FloatField(default=0)),
+                ('modo', models.CharField(choices=[('CPROFILE', 'cProfile (pstats)'), ('MUESTREO', 'Muestreo de pilas (collapsed)')], max_length=20)),
+                ('origen', models.CharField(choices=[('SOLICITADO', 'Solicitado (cabecera o parámetro)'), ('MUESTREO', 'Tasa de muestreo')], max_length=20)),
+                ('archivo', models.CharField(max_length=255)),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Perfil de Solicitud',
+                'verbose_name_plural': 'Perfiles de Solicitudes',
+                'ordering': ['-fecha'],
+            },
+        ),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 6.0 on 2026-10-19 16:20
+
+from django.db import migrations, models
+
+
+def separar(rut):
+    numero, _, dv = (rut or '').rpartition('-')
+    if not numero.isdigit() or len(dv) != 1 or len(numero) > 9:
+        return None, ''
+    return int(numero), dv.upper()
+
+
+def poblar_rut_numero(apps, schema_editor):
+    for nombre_modelo in ('EmpleadoNomina', 'CuentaActiveDirectory', 'Conciliacion'):
+        modelo = apps.get_model('conciliacion_app', nombre_modelo)
+        lote = []
+        for obj in modelo.objects.only('pk', 'rut').iterator(chunk_size=2000):
+            obj.rut_numero, obj.rut_dv = separar(obj.rut)
+            lote.append(obj)
+            if len(lote) >= 2000:
+                modelo.objects.bulk_update(lote, ['rut_numero', 'rut_dv'])
+                lote = []
+        if lote:
+            modelo.objects.bulk_update(lote, ['rut_numero', 'rut_dv'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conciliacion_app', '0007_perfilsolicitud'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='empleadonomina',
+            name='rut_numero',
+            field=models.PositiveIntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='empleadonomina',
+            name='rut_dv',
+            field=models.CharField(blank=True, max_length=1),
+        ),
+        migrations.AddField(
+            model_name='cuentaactivedirectory',
+            name='rut_numero',
+            field=models.PositiveIntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='cuentaactivedirectory',
+            name='rut_dv',
+            field=models.CharField(blank=True, max_length=1),
+        ),
+        migrations.AddField(
+            model_name='conciliacion',
+            name='rut_numero',
+            field=models.PositiveIntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='conciliacion',
+            name='rut_dv',
+            field=models.CharField(blank=True, max_length=1),
+        ),
+        migrations.RunPython(poblar_rut_numero, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='empleadonomina',
+            name='rut',
+            field=models.CharField(max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='cuentaactivedirectory',
+            name='rut',
+            field=models.CharField(max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='conciliacion',
+            name='rut',
+            field=models.CharField(max_length=20),
+        ),
+    ]
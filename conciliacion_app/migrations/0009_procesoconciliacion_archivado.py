@@ -0,0 +1,28 @@
+# Generated by Django 6.0 on 2026-10-19 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conciliacion_app', '0008_rut_numero'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='procesoconciliacion',
+            name='archivado',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='procesoconciliacion',
+            name='fecha_archivado',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='procesoconciliacion',
+            name='archivo_historico',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
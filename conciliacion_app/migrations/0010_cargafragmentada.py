@@ -0,0 +1,53 @@
+# Generated by Django 6.0 on 2026-10-19 17:20
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conciliacion_app', '0009_procesoconciliacion_archivado'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CargaFragmentada',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('tipo_archivo', models.CharField(choices=[('NOMINA', 'Nómina RRHH (Excel)'), ('AD', 'Active Directory (TXT)')], max_length=20)),
+                ('nombre_original', models.CharField(max_length=255)),
+                ('tamano_total', models.BigIntegerField()),
+                ('tamano_fragmento', models.IntegerField()),
+                ('estado', models.CharField(choices=[('EN_CURSO', 'En curso'), ('COMPLETADA', 'Completada')], default='EN_CURSO', max_length=20)),
+                ('hash_contenido', models.CharField(blank=True, max_length=80)),
+                ('fecha_inicio', models.DateTimeField(auto_now_add=True)),
+                ('fecha_actualizacion', models.DateTimeField(auto_now=True)),
+                ('archivo', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='conciliacion_app.archivocargado')),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Carga Fragmentada',
+                'verbose_name_plural': 'Cargas Fragmentadas',
+                'ordering': ['-fecha_inicio'],
+            },
+        ),
+        migrations.CreateModel(
+            name='FragmentoCarga',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('numero', models.IntegerField()),
+                ('tamano', models.IntegerField()),
+                ('sha256', models.CharField(max_length=64)),
+                ('fecha_recepcion', models.DateTimeField(auto_now=True)),
+                ('carga', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fragmentos', to='conciliacion_app.cargafragmentada')),
+            ],
+            options={
+                'ordering': ['numero'],
+                'constraints': [models.UniqueConstraint(fields=('carga', 'numero'), name='fragmento_unico_por_carga')],
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 6.0 on 2026-10-19 17:40
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conciliacion_app', '0010_cargafragmentada'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EntradaCarpeta',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('firma', models.CharField(max_length=64, unique=True)),
+                ('periodo', models.CharField(max_length=7)),
+                ('ruta_nomina', models.CharField(max_length=500)),
+                ('ruta_ad', models.CharField(max_length=500)),
+                ('estado', models.CharField(choices=[('PENDIENTE', 'Pendiente'), ('PROCESANDO', 'Procesando'), ('COMPLETADO', 'Completado'), ('ERROR', 'Error')], default='PENDIENTE', max_length=20)),
+                ('errores', models.TextField(blank=True)),
+                ('fecha_deteccion', models.DateTimeField(auto_now_add=True)),
+                ('fecha_fin', models.DateTimeField(blank=True, null=True)),
+                ('proceso', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='conciliacion_app.procesoconciliacion')),
+            ],
+            options={
+                'verbose_name': 'Entrada de Carpeta',
+                'verbose_name_plural': 'Entradas de Carpeta',
+                'ordering': ['-fecha_deteccion'],
+            },
+        ),
+    ]
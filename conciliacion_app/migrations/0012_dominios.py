@@ -0,0 +1,34 @@
+# Generated by Django 6.0 on 2026-10-19 18:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conciliacion_app', '0011_entradacarpeta'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivocargado',
+            name='dominio',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='archivocargado',
+            name='proceso_dominios',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archivos_dominios', to='conciliacion_app.procesoconciliacion'),
+        ),
+        migrations.AddField(
+            model_name='conciliacion',
+            name='dominio',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='procesoconciliacion',
+            name='resumen_dominios',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 6.0 on 2026-10-19 19:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conciliacion_app', '0012_dominios'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HistorialRut',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('rut_numero', models.PositiveIntegerField()),
+                ('fecha', models.DateTimeField()),
+                ('categoria', models.CharField(choices=[('FANTASMA_TOTAL', 'Fantasma Total - No existe en RRHH'), ('INACTIVO_CON_CUENTA', 'Inactivo con cuenta AD activa'), ('CONFLICTO_REVISION', 'Conflicto - Requiere revisión manual'), ('OK_ACTIVO', 'OK - Activo con cuenta'), ('OK_INACTIVO', 'OK - Inactivo sin cuenta')], max_length=30)),
+                ('dominio', models.CharField(blank=True, max_length=100)),
+                ('proceso', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='historial_ruts', to='conciliacion_app.procesoconciliacion')),
+            ],
+            options={
+                'verbose_name': 'Historial de RUT',
+                'verbose_name_plural': 'Historial de RUTs',
+                'ordering': ['rut_numero', 'fecha'],
+                'indexes': [models.Index(fields=['rut_numero', 'fecha', 'categoria', 'dominio', 'proceso'], name='historial_rut_linea_tiempo')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-19 19:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conciliacion_app', '0013_historialrut'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='entradacarpeta',
+            name='fecha_toma',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
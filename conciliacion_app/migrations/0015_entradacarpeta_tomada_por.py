@@ -0,0 +1,29 @@
+# Generated by Django 6.0 on 2026-10-19 20:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conciliacion_app', '0014_entradacarpeta_fecha_toma'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='entradacarpeta',
+            name='archivo_ad',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='conciliacion_app.archivocargado'),
+        ),
+        migrations.AddField(
+            model_name='entradacarpeta',
+            name='archivo_nomina',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='conciliacion_app.archivocargado'),
+        ),
+        migrations.AddField(
+            model_name='entradacarpeta',
+            name='tomada_por',
+            field=models.CharField(blank=True, max_length=150),
+        ),
+    ]
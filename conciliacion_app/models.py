@@ -3,10 +3,13 @@ from django.db import models
 #los modelos para la aplicacion muestran la estructura de datos; son las tablas que se crean en la base de datos
 # Create your models here.
 from django.db import models
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.utils import timezone
+from datetime import timedelta
 import uuid
 import os
+import zlib
 
 
 #esta es la función para guardar los archivos cargados
@@ -40,6 +43,17 @@ class ArchivoCargado(models.Model):
     registros_procesados = models.IntegerField(default=0)
     errores = models.TextField(blank=True, null=True)
     
+    # Exports AD de una conciliación con varios dominios (ver
+    # pipeline.persistir_conciliacion): nombre del dominio y proceso
+    dominio = models.CharField(max_length=100, blank=True)
+    proceso_dominios = models.ForeignKey(
+        'ProcesoConciliacion',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='archivos_dominios'
+    )
+    
     class Meta:
         ordering = ['-fecha_carga']
         verbose_name = 'Archivo Cargado'
@@ -48,11 +62,93 @@ class ArchivoCargado(models.Model):
     def __str__(self):
         return f"{self.nombre_original} ({self.get_tipo_archivo_display()})"
     
+    def eliminar_con_procesos(self):
+        """
+        Elimina el registro de un intento fallido con sus filas (en cascada) y
+        los procesos que alcanzó a crear: los FK del proceso a sus archivos
+        son SET_NULL, así que esos procesos no caen en cascada. El archivo en
+        disco queda a cargo de quien llama
+        """
+        ProcesoConciliacion.objects.filter(
+            models.Q(archivo_nomina=self) | models.Q(archivo_ad=self) | models.Q(archivos_dominios=self)
+        ).delete()
+        self.delete()
+    
     def nombre_archivo(self):
         """Retorna solo el nombre del archivo sin ruta"""
         return os.path.basename(self.archivo.name)
 
 
+class CargaFragmentada(models.Model):
+    """
+    Carga reanudable de un archivo grande en fragmentos numerados. El archivo
+    se arma directamente en disco (`ruta_parcial`) escribiendo cada fragmento
+    en su posición, así que un fragmento se puede reintentar o llegar fuera
+    de orden. Al finalizar se mueve a archivos/ y se crea el ArchivoCargado.
+    """
+    ESTADO_CARGA = [
+        ('EN_CURSO', 'En curso'),
+        ('COMPLETADA', 'Completada'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE)
+    tipo_archivo = models.CharField(max_length=20, choices=ArchivoCargado.TIPO_ARCHIVO)
+    nombre_original = models.CharField(max_length=255)
+    tamano_total = models.BigIntegerField()
+    tamano_fragmento = models.IntegerField()
+    estado = models.CharField(max_length=20, choices=ESTADO_CARGA, default='EN_CURSO')
+    # SHA-256 de los SHA-256 de cada fragmento en orden, con sufijo -<fragmentos>
+    hash_contenido = models.CharField(max_length=80, blank=True)
+    archivo = models.OneToOneField(ArchivoCargado, on_delete=models.SET_NULL, null=True, blank=True)
+    fecha_inicio = models.DateTimeField(auto_now_add=True)
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-fecha_inicio']
+        verbose_name = 'Carga Fragmentada'
+        verbose_name_plural = 'Cargas Fragmentadas'
+    
+    def __str__(self):
+        return f"{self.nombre_original} ({self.get_estado_display()})"
+    
+    def total_fragmentos(self):
+        return max(1, -(-self.tamano_total // self.tamano_fragmento))
+    
+    def tamano_esperado(self, numero):
+        """Bytes que debe traer el fragmento `numero` (el último puede ser menor)"""
+        return min(self.tamano_fragmento, self.tamano_total - numero * self.tamano_fragmento)
+    
+    def ruta_parcial(self):
+        return os.path.join(settings.MEDIA_ROOT, 'cargas', f'{self.id}.part')
+    
+    @classmethod
+    def descartar_vencidas(cls):
+        """Elimina las cargas sin finalizar y sin actividad por más de CARGAS_VIGENCIA_HORAS"""
+        limite = timezone.now() - timedelta(hours=settings.CARGAS_VIGENCIA_HORAS)
+        vencidas = cls.objects.filter(estado='EN_CURSO', fecha_actualizacion__lt=limite)
+        for carga in vencidas:
+            if os.path.exists(carga.ruta_parcial()):
+                os.remove(carga.ruta_parcial())
+        return vencidas.delete()
+
+
+class FragmentoCarga(models.Model):
+    """Fragmento recibido de una CargaFragmentada (reintentarlo lo reemplaza)"""
+    id = models.BigAutoField(primary_key=True)
+    carga = models.ForeignKey(CargaFragmentada, on_delete=models.CASCADE, related_name='fragmentos')
+    numero = models.IntegerField()
+    tamano = models.IntegerField()
+    sha256 = models.CharField(max_length=64)
+    fecha_recepcion = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['numero']
+        constraints = [
+            models.UniqueConstraint(fields=['carga', 'numero'], name='fragmento_unico_por_carga'),
+        ]
+
+
 class EmpleadoNomina(models.Model):
     """
     Empleados extraídos del archivo Excel de RRHH
@@ -64,7 +160,10 @@ class EmpleadoNomina(models.Model):
         ('CONFLICTO', 'Conflicto de estados'),
     ]
     
-    rut = models.CharField(max_length=20, db_index=True)
+    rut = models.CharField(max_length=20)
+    # Clave entera del RUT (cuerpo sin DV): los cruces y búsquedas se hacen por aquí
+    rut_numero = models.PositiveIntegerField(null=True, blank=True, db_index=True)
+    rut_dv = models.CharField(max_length=1, blank=True)
     nombre = models.CharField(max_length=200)
     estado_final = models.CharField(max_length=20, choices=ESTADO_CHOICES)
     registros_originales = models.IntegerField(default=1)  # Cuántas veces aparecía en Excel
@@ -104,7 +203,9 @@ class CuentaActiveDirectory(models.Model):
     ]
     
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    rut = models.CharField(max_length=20, db_index=True)
+    rut = models.CharField(max_length=20)
+    rut_numero = models.PositiveIntegerField(null=True, blank=True, db_index=True)  # Cuerpo del RUT
+    rut_dv = models.CharField(max_length=1, blank=True)
     nombre_usuario = models.CharField(max_length=100)
     nombre_completo = models.CharField(max_length=200, blank=True, null=True)
     email = models.EmailField(blank=True, null=True)
@@ -173,7 +274,10 @@ class Conciliacion(models.Model):
         blank=True,
         related_name='conciliaciones'
     )
-    rut = models.CharField(max_length=20, db_index=True)  # RUT común para ambos
+    rut = models.CharField(max_length=20)  # RUT común para ambos
+    rut_numero = models.PositiveIntegerField(null=True, blank=True, db_index=True)  # Cuerpo del RUT
+    rut_dv = models.CharField(max_length=1, blank=True)
+    dominio = models.CharField(max_length=100, blank=True)  # Dominio AD en procesos con varios dominios
     categoria = models.CharField(max_length=30, choices=CATEGORIA_CHOICES)
     prioridad = models.CharField(max_length=20, choices=PRIORIDAD_CHOICES)
     accion_recomendada = models.CharField(max_length=30, choices=ACCION_RECOMENDADA)
@@ -258,6 +362,24 @@ class ProcesoConciliacion(models.Model):
     estado = models.CharField(max_length=20, choices=ESTADO_PROCESO, default='INICIADO')
     errores = models.TextField(blank=True, null=True)
     
+    # Se incrementa cada vez que se marca algo como resuelto (invalida caché de resultados)
+    version_resoluciones = models.IntegerField(default=0)
+    
+    # Métricas por etapa del pipeline: lista de
+    # {etapa, segundos, cpu_segundos, filas, filas_por_segundo, memoria_pico_kb}
+    metricas_etapas = models.JSONField(default=list, blank=True)
+    
+    # Archivado (ver conciliacion_app.archivado): las filas del proceso se
+    # movieron a un archivo comprimido dentro de ARCHIVO_HISTORICO_DIRECTORIO
+    archivado = models.BooleanField(default=False)
+    fecha_archivado = models.DateTimeField(blank=True, null=True)
+    archivo_historico = models.CharField(max_length=255, blank=True)
+    
+    # Una nómina contra varios exports AD: {'dominios': [{dominio, archivo_id,
+    # cuentas, fantasmas, inactivos_con_cuenta}, ...], 'hallazgos': {...}}.
+    # Vacío en los procesos de un solo export
+    resumen_dominios = models.JSONField(default=dict, blank=True)
+    
     class Meta:
         ordering = ['-fecha_inicio']
         verbose_name = 'Proceso de Conciliación'
@@ -274,6 +396,50 @@ class ProcesoConciliacion(models.Model):
             return 0
         # Podrías implementar lógica específica aquí
         return 50
+    
+    def duracion_etapas(self):
+        """Suma del tiempo real de todas las etapas medidas (segundos)"""
+        return round(sum(m['segundos'] for m in self.metricas_etapas), 3)
+    
+    def etapa_mas_lenta(self):
+        """Métrica de la etapa que más tiempo tomó, o None si no hay métricas"""
+        if not self.metricas_etapas:
+            return None
+        return max(self.metricas_etapas, key=lambda m: m['segundos'])
+    
+    def admite_acciones(self):
+        """True si tiene cuentas a bloquear y sigue en la base (no archivado)"""
+        return not self.archivado and (self.fantasmas_totales > 0 or self.inactivos_con_cuenta > 0)
+    
+    def es_multidominio(self):
+        return bool(self.resumen_dominios.get('dominios'))
+    
+    def ids_archivos_ad(self):
+        """Ids de los exports AD del proceso (varios si es multidominio), sin consultar la base"""
+        if self.es_multidominio():
+            return [d['archivo_id'] for d in self.resumen_dominios['dominios']]
+        return [self.archivo_ad_id]
+    
+    def conciliaciones(self):
+        """Retorna queryset de las conciliaciones generadas por este proceso"""
+        return Conciliacion.objects.filter(
+            models.Q(empleado_nomina__archivo_origen=self.archivo_nomina) |
+            models.Q(cuenta_ad__archivo_origen__in=self.ids_archivos_ad())
+        )
+    
+    def clave_cache_resultados(self):
+        """Clave de caché para la tabla de resultados (cambia al resolver o archivar)"""
+        sufijo = ':archivado' if self.archivado else ''
+        return f"resultados:{self.id}:v{self.version_resoluciones}{sufijo}"
+    
+    def incrementar_version_resoluciones(self):
+        """
+        Incrementa la versión de resoluciones del proceso (invalida la tabla
+        cacheada tras una resolución simple o masiva) con un único UPDATE
+        """
+        return ProcesoConciliacion.objects.filter(pk=self.pk).update(
+            version_resoluciones=models.F('version_resoluciones') + 1
+        )
 
 
 class ScriptPowershell(models.Model):
@@ -293,8 +459,13 @@ class ScriptPowershell(models.Model):
         related_name='scripts'
     )
     tipo_script = models.CharField(max_length=30, choices=TIPO_SCRIPT)
-    contenido = models.TextField()  # Código PowerShell
+    contenido = models.TextField(blank=True)  # Código PowerShell (vacío si está comprimido)
+    contenido_comprimido = models.BinaryField(blank=True, null=True)  # Código PowerShell en gzip
+    hash_contenido = models.CharField(max_length=64, blank=True)  # SHA-256, se usa como ETag
     modo_seguro = models.BooleanField(default=True)  # Si incluye -WhatIf
+    compacto = models.BooleanField(default=False)  # Formato CSV por lotes
+    fragmentos = models.IntegerField(default=1)  # Grupos ejecutados en paralelo
+    version_resoluciones = models.IntegerField(default=0)  # Versión del proceso al generar
     fecha_generacion = models.DateTimeField(auto_now_add=True)
     usuario_generacion = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
     ejecutado = models.BooleanField(default=False)
@@ -305,6 +476,13 @@ class ScriptPowershell(models.Model):
         ordering = ['-fecha_generacion']
         verbose_name = 'Script PowerShell'
         verbose_name_plural = 'Scripts PowerShell'
+        constraints = [
+            # Un script por combinación; se regenera solo si cambian las resoluciones
+            models.UniqueConstraint(
+                fields=['proceso', 'tipo_script', 'modo_seguro', 'compacto', 'fragmentos', 'version_resoluciones'],
+                name='script_unico_por_version',
+            ),
+        ]
     
     def __str__(self):
         return f"Script {self.get_tipo_script_display()} - {self.fecha_generacion.strftime('%d/%m/%Y')}"
@@ -313,3 +491,133 @@ class ScriptPowershell(models.Model):
         """Genera nombre para el archivo .ps1"""
         fecha = self.fecha_generacion.strftime('%Y%m%d_%H%M%S')
         return f"script_{self.tipo_script.lower()}_{fecha}.ps1"
+    
+    def esta_comprimido(self):
+        """Retorna True si el contenido se guardó comprimido"""
+        return self.contenido_comprimido is not None
+    
+    def iter_contenido(self, tamano: int = 64 * 1024):
+        """Entrega el script en bytes UTF-8 por bloques, descomprimiendo de a poco"""
+        if not self.esta_comprimido():
+            datos = self.contenido.encode('utf-8')
+            for i in range(0, len(datos), tamano):
+                yield datos[i:i + tamano]
+            return
+        
+        comprimido = bytes(self.contenido_comprimido)
+        descompresor = zlib.decompressobj(wbits=31)  # formato gzip
+        for i in range(0, len(comprimido), tamano):
+            bloque = descompresor.decompress(comprimido[i:i + tamano])
+            if bloque:
+                yield bloque
+        resto = descompresor.flush()
+        if resto:
+            yield resto
+
+
+class PerfilSolicitud(models.Model):
+    """
+    Perfil de rendimiento de una solicitud HTTP capturado por
+    PerfilamientoMiddleware (el archivo queda en PERFILAMIENTO_DIRECTORIO)
+    """
+    MODO_PERFIL = [
+        ('CPROFILE', 'cProfile (pstats)'),
+        ('MUESTREO', 'Muestreo de pilas (collapsed)'),
+    ]
+    
+    ORIGEN_PERFIL = [
+        ('SOLICITADO', 'Solicitado (cabecera o parámetro)'),
+        ('MUESTREO', 'Tasa de muestreo'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    fecha = models.DateTimeField(auto_now_add=True)
+    usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    metodo = models.CharField(max_length=10)
+    ruta = models.CharField(max_length=500)
+    codigo_respuesta = models.IntegerField(default=0)
+    duracion_segundos = models.FloatField(default=0)
+    modo = models.CharField(max_length=20, choices=MODO_PERFIL)
+    origen = models.CharField(max_length=20, choices=ORIGEN_PERFIL)
+    archivo = models.CharField(max_length=255)  # Nombre dentro de PERFILAMIENTO_DIRECTORIO
+    
+    class Meta:
+        ordering = ['-fecha']
+        verbose_name = 'Perfil de Solicitud'
+        verbose_name_plural = 'Perfiles de Solicitudes'
+    
+    def __str__(self):
+        return f"{self.metodo} {self.ruta} - {self.duracion_segundos:.2f}s"
+
+
+class EntradaCarpeta(models.Model):
+    """
+    Par nómina/AD detectado en CARPETA_ENTRADA por `manage.py vigilar_carpeta`.
+    La firma (nombre, tamaño y mtime de ambos archivos) es única: un par que
+    no cambió nunca se vuelve a encolar, y si hay más de un vigilante solo uno
+    logra tomar cada entrada. Una entrada PROCESANDO se considera abandonada
+    (vigilante detenido o caído) si su dueño (tomada_por, equipo:pid) corría
+    en el mismo equipo y ya no existe o, si corría en otro equipo, cuando su
+    toma (fecha_toma) supera CARPETA_SEGUNDOS_PROCESANDO. Vuelve a PENDIENTE
+    y se eliminan los archivos (con sus filas y procesos) de ese intento.
+    """
+    ESTADO_ENTRADA = [
+        ('PENDIENTE', 'Pendiente'),
+        ('PROCESANDO', 'Procesando'),
+        ('COMPLETADO', 'Completado'),
+        ('ERROR', 'Error'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    firma = models.CharField(max_length=64, unique=True)
+    periodo = models.CharField(max_length=7)
+    ruta_nomina = models.CharField(max_length=500)
+    ruta_ad = models.CharField(max_length=500)
+    estado = models.CharField(max_length=20, choices=ESTADO_ENTRADA, default='PENDIENTE')
+    proceso = models.ForeignKey(ProcesoConciliacion, on_delete=models.SET_NULL, null=True, blank=True)
+    errores = models.TextField(blank=True)
+    fecha_deteccion = models.DateTimeField(auto_now_add=True)
+    fecha_toma = models.DateTimeField(blank=True, null=True)  # Cuándo la tomó un vigilante
+    tomada_por = models.CharField(max_length=150, blank=True)  # equipo:pid del vigilante
+    # Archivos registrados por el intento en curso (para descartarlo si se abandona)
+    archivo_nomina = models.ForeignKey(ArchivoCargado, on_delete=models.SET_NULL, null=True, blank=True,
+                                       related_name='+')
+    archivo_ad = models.ForeignKey(ArchivoCargado, on_delete=models.SET_NULL, null=True, blank=True,
+                                   related_name='+')
+    fecha_fin = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        ordering = ['-fecha_deteccion']
+        verbose_name = 'Entrada de Carpeta'
+        verbose_name_plural = 'Entradas de Carpeta'
+    
+    def __str__(self):
+        return f"{self.periodo}: {os.path.basename(self.ruta_nomina)} + {os.path.basename(self.ruta_ad)}"
+
+
+class HistorialRut(models.Model):
+    """
+    Historia de cada RUT entre procesos: una fila por RUT (cuerpo entero) y
+    proceso completado con la categoría que tuvo. Se escribe al guardar los
+    resultados y se conserva cuando el proceso se archiva. El índice cubre la
+    consulta de la línea de tiempo (ver conciliacion_app.historial), que se
+    responde recorriendo solo el índice.
+    """
+    id = models.BigAutoField(primary_key=True)
+    rut_numero = models.PositiveIntegerField()
+    fecha = models.DateTimeField()  # fecha_inicio del proceso
+    categoria = models.CharField(max_length=30, choices=Conciliacion.CATEGORIA_CHOICES)
+    dominio = models.CharField(max_length=100, blank=True)
+    proceso = models.ForeignKey(ProcesoConciliacion, on_delete=models.CASCADE, related_name='historial_ruts')
+    
+    class Meta:
+        ordering = ['rut_numero', 'fecha']
+        verbose_name = 'Historial de RUT'
+        verbose_name_plural = 'Historial de RUTs'
+        indexes = [
+            models.Index(fields=['rut_numero', 'fecha', 'categoria', 'dominio', 'proceso'],
+                         name='historial_rut_linea_tiempo'),
+        ]
+    
+    def __str__(self):
+        return f"{self.rut_numero} - {self.get_categoria_display()} ({self.fecha:%d/%m/%Y})"
@@ -0,0 +1,409 @@
+# conciliacion_app/pipeline.py
+"""
+Etapas del proceso de conciliación (persistencia y cruce), separadas de las
+vistas para poder reutilizarlas y medirlas por separado.
+"""
+import os
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import islice
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+
+from . import metricas
+from .historial import entradas_historial
+from .models import (
+    ArchivoCargado, EmpleadoNomina, CuentaActiveDirectory,
+    Conciliacion, HistorialRut, ProcesoConciliacion
+)
+from .utils.procesadores import Conciliador, ProcesadorExcelNomina, ProcesadorTXTAD
+from .utils.reglas import ReglasCompiladas, leer_reglas
+from .utils.rut import clave_rut, separar_rut
+
+# Filas por INSERT en las cargas masivas (Django lo reduce si el motor lo exige)
+TAMANO_LOTE = 1000
+
+# Filas por transacción de escritura. Cada bloque confirma por separado para
+# no retener el bloqueo de escritura de SQLite durante toda la carga
+FILAS_POR_TRANSACCION = 5000
+
+
+class MedidorEtapas:
+    """
+    Registra por etapa el tiempo real, el tiempo de CPU, las filas procesadas
+    y la memoria máxima asignada durante la etapa.
+    
+        medidor = MedidorEtapas()
+        with medidor.etapa('procesar_nomina') as etapa:
+            empleados = procesador.procesar(ruta)
+            etapa['filas'] = len(empleados)
+    
+    Las métricas quedan en `medidor.etapas` (se guardan en
+    ProcesoConciliacion.metricas_etapas).
+    """
+    
+    def __init__(self, medir_memoria=None):
+        if medir_memoria is None:
+            medir_memoria = settings.PIPELINE_MEDIR_MEMORIA
+        self.medir_memoria = medir_memoria
+        self.etapas = []
+    
+    @contextmanager
+    def etapa(self, nombre):
+        registro = {'etapa': nombre, 'filas': 0}
+        
+        iniciado_aqui = False
+        memoria_base = 0
+        if self.medir_memoria:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                iniciado_aqui = True
+            tracemalloc.reset_peak()
+            memoria_base = tracemalloc.get_traced_memory()[0]
+        
+        inicio = time.perf_counter()
+        inicio_cpu = time.process_time()
+        try:
+            yield registro
+        finally:
+            segundos = time.perf_counter() - inicio
+            registro['segundos'] = round(segundos, 4)
+            registro['cpu_segundos'] = round(time.process_time() - inicio_cpu, 4)
+            registro['filas_por_segundo'] = round(registro['filas'] / segundos, 1) if segundos > 0 else None
+            
+            if self.medir_memoria:
+                pico = tracemalloc.get_traced_memory()[1]
+                registro['memoria_pico_kb'] = max(0, pico - memoria_base) // 1024
+                if iniciado_aqui:
+                    tracemalloc.stop()
+            else:
+                registro['memoria_pico_kb'] = None
+            
+            self.etapas.append(registro)
+            metricas.observar_etapa(nombre, segundos, registro['filas'])
+
+
+def registrar_archivo(ruta, tipo_archivo, usuario):
+    """Copia un archivo local a archivos/ y crea su ArchivoCargado, igual que la carga web"""
+    with open(ruta, 'rb') as f:
+        return ArchivoCargado.objects.create(
+            nombre_original=os.path.basename(ruta),
+            tipo_archivo=tipo_archivo,
+            archivo=File(f, name=os.path.basename(ruta)),
+            usuario=usuario,
+            estado='PENDIENTE'
+        )
+
+
+def resumen_ruts_invalidos(ruts, maximo=20):
+    """Texto para ArchivoCargado.errores con los RUTs de DV inválido (None si no hay)"""
+    ruts = list(ruts)
+    if not ruts:
+        return None
+    detalle = ', '.join(ruts[:maximo]) + (' ...' if len(ruts) > maximo else '')
+    return f"{len(ruts)} RUT con dígito verificador inválido: {detalle}"
+
+
+def insertar_por_bloques(modelo, objetos):
+    """
+    bulk_create en transacciones cortas de FILAS_POR_TRANSACCION filas, para
+    que otras cargas y lecturas avancen entre bloque y bloque. Si algo falla
+    quedan los bloques ya confirmados; cuelgan del archivo de origen y se
+    eliminan en cascada al borrarlo. Retorna las filas insertadas.
+    """
+    objetos = iter(objetos)
+    filas = 0
+    while bloque := list(islice(objetos, FILAS_POR_TRANSACCION)):
+        with transaction.atomic():
+            modelo.objects.bulk_create(bloque, batch_size=TAMANO_LOTE)
+        filas += len(bloque)
+    return filas
+
+
+def guardar_empleados(empleados, archivo_nomina):
+    """Guarda los empleados procesados de la nómina y marca el archivo como completado"""
+    insertar_por_bloques(EmpleadoNomina, (
+        EmpleadoNomina(
+            rut=emp.rut_normalizado,
+            rut_numero=emp.rut_numero,
+            rut_dv=emp.rut_dv,
+            nombre=emp.nombre,
+            estado_final=emp.estado_final,
+            tiene_conflicto=emp.tiene_conflicto,
+            archivo_origen=archivo_nomina
+        )
+        for emp in empleados
+    ))
+    
+    archivo_nomina.registros_procesados = len(empleados)
+    archivo_nomina.errores = resumen_ruts_invalidos(emp.rut_normalizado for emp in empleados if not emp.rut_valido)
+    archivo_nomina.estado = 'COMPLETADO'
+    archivo_nomina.save()
+
+
+def guardar_cuentas(cuentas, archivo_ad):
+    """Guarda las cuentas AD procesadas y marca el archivo como completado"""
+    insertar_por_bloques(CuentaActiveDirectory, (
+        CuentaActiveDirectory(
+            rut=cuenta.rut_normalizado,
+            rut_numero=cuenta.rut_numero,
+            rut_dv=cuenta.rut_dv,
+            nombre_usuario=cuenta.nombre_usuario,
+            estado_cuenta=cuenta.estado_cuenta,
+            archivo_origen=archivo_ad
+        )
+        for cuenta in cuentas
+    ))
+    
+    archivo_ad.registros_procesados = len(cuentas)
+    archivo_ad.errores = resumen_ruts_invalidos(c.rut_normalizado for c in cuentas if not c.rut_valido)
+    archivo_ad.estado = 'COMPLETADO'
+    archivo_ad.save()
+
+
+@lru_cache(maxsize=2)
+def _reglas_compiladas(ruta, _mtime_ns):
+    return ReglasCompiladas(leer_reglas(ruta), permitidos={
+        'categoria': {valor for valor, _ in Conciliacion.CATEGORIA_CHOICES},
+        'prioridad': {valor for valor, _ in Conciliacion.PRIORIDAD_CHOICES},
+        'accion': {valor for valor, _ in Conciliacion.ACCION_RECOMENDADA},
+    })
+
+
+def reglas_conciliacion():
+    """Reglas de REGLAS_CONCILIACION_ARCHIVO ya compiladas (se recompilan si el archivo cambia)"""
+    ruta = str(settings.REGLAS_CONCILIACION_ARCHIVO)
+    return _reglas_compiladas(ruta, os.stat(ruta).st_mtime_ns)
+
+
+def guardar_resultados(proceso, resultados, usuario, total_empleados, total_cuentas):
+    """Guarda las conciliaciones, actualiza estadísticas y completa el proceso"""
+    # Primer empleado/cuenta de cada RUT (mismo orden que .first()), una consulta por tabla
+    # (cruce por la clave entera del RUT, igual que el Conciliador)
+    empleado_por_rut = {}
+    for pk, rut_numero, rut in EmpleadoNomina.objects.filter(
+        archivo_origen=proceso.archivo_nomina
+    ).values_list('pk', 'rut_numero', 'rut').iterator(chunk_size=TAMANO_LOTE):
+        empleado_por_rut.setdefault(clave_rut(rut_numero, rut), pk)
+    
+    # Con varios dominios el mismo RUT puede tener una cuenta en cada uno
+    cuenta_por_rut = {}
+    for pk, rut_numero, rut, dominio in CuentaActiveDirectory.objects.filter(
+        archivo_origen__in=proceso.ids_archivos_ad()
+    ).values_list('pk', 'rut_numero', 'rut', 'archivo_origen__dominio').iterator(chunk_size=TAMANO_LOTE):
+        cuenta_por_rut.setdefault((dominio, clave_rut(rut_numero, rut)), pk)
+    
+    def nueva_conciliacion(resultado):
+        clave = clave_rut(resultado.get('rut_numero'), resultado['rut'])
+        rut_numero, rut_dv = separar_rut(resultado['rut']) or (None, '')
+        dominio = resultado.get('dominio', '')
+        return Conciliacion(
+            empleado_nomina_id=empleado_por_rut.get(clave),
+            cuenta_ad_id=cuenta_por_rut.get((dominio, clave)),
+            rut=resultado['rut'],
+            rut_numero=rut_numero,
+            rut_dv=rut_dv,
+            dominio=dominio,
+            categoria=resultado['categoria'],
+            prioridad=resultado['prioridad'],
+            accion_recomendada=resultado['accion_recomendada'],
+            descripcion=resultado['descripcion'],
+            usuario_deteccion=usuario
+        )
+    
+    insertar_por_bloques(Conciliacion, (nueva_conciliacion(resultado) for resultado in resultados))
+    
+    # Actualizar estadísticas del proceso
+    proceso.total_empleados = total_empleados
+    proceso.total_cuentas_ad = total_cuentas
+    proceso.conciliaciones_generadas = len(resultados)
+    
+    # Contar por categoría
+    for r in resultados:
+        if r['categoria'] == 'FANTASMA_TOTAL':
+            proceso.fantasmas_totales += 1
+        elif r['categoria'] == 'INACTIVO_CON_CUENTA':
+            proceso.inactivos_con_cuenta += 1
+        elif r['categoria'] == 'CONFLICTO_REVISION':
+            proceso.conflictos_revision += 1
+        elif r['categoria'] in ['OK_ACTIVO', 'OK_INACTIVO']:
+            proceso.ok_activos += 1
+    
+    # El índice de historia por RUT (ver conciliacion_app.historial) se escribe
+    # en la misma transacción que completa el proceso: solo los procesos
+    # COMPLETADOS aparecen en la línea de tiempo, y siempre con todas sus filas
+    with transaction.atomic():
+        HistorialRut.objects.bulk_create(entradas_historial(
+            proceso, ((r['rut'], r['categoria'], r.get('dominio', '')) for r in resultados)
+        ), batch_size=TAMANO_LOTE)
+        proceso.estado = 'COMPLETADO'
+        proceso.fecha_fin = timezone.now()
+        proceso.save()
+
+
+def procesar_y_conciliar(ruta_nomina, ruta_ad, medir_memoria=None):
+    """
+    Lee los dos archivos y concilia en memoria, sin tocar la base de datos,
+    de modo que puede correr en otro proceso (ver conciliacion_app.lotes).
+    Retorna (empleados, cuentas, resultados, etapas medidas)
+    """
+    medidor = MedidorEtapas(medir_memoria)
+    with medidor.etapa('procesar_nomina') as etapa:
+        empleados = ProcesadorExcelNomina().procesar(ruta_nomina)
+        etapa['filas'] = len(empleados)
+    
+    with medidor.etapa('procesar_ad') as etapa:
+        cuentas = ProcesadorTXTAD().procesar(ruta_ad)
+        etapa['filas'] = len(cuentas)
+    
+    with medidor.etapa('conciliar') as etapa:
+        resultados = Conciliador(reglas_conciliacion()).conciliar(empleados, cuentas)
+        etapa['filas'] = len(empleados) + len(cuentas)
+    
+    return empleados, cuentas, resultados, medidor.etapas
+
+
+def persistir_conciliacion(archivo_nomina, archivos_ad, usuario, empleados, cuentas_por_dominio, resultados,
+                           etapas=(), medir_memoria=None):
+    """
+    Guarda empleados, cuentas y resultados ya calculados y crea el proceso
+    completado. `archivos_ad` es {dominio: ArchivoCargado} y
+    `cuentas_por_dominio` {dominio: [CuentaProcesada]}; con un solo export
+    AD el dominio es ''. Con varios, el primero queda como archivo_ad del
+    proceso y todos quedan enlazados en archivos_dominios. `etapas` son las
+    métricas de las etapas previas.
+    """
+    medidor = MedidorEtapas(medir_memoria)
+    medidor.etapas.extend(etapas)
+    with medidor.etapa('guardar_empleados') as etapa:
+        guardar_empleados(empleados, archivo_nomina)
+        etapa['filas'] = len(empleados)
+    
+    total_cuentas = sum(len(cuentas) for cuentas in cuentas_por_dominio.values())
+    with medidor.etapa('guardar_cuentas') as etapa:
+        for dominio, archivo in archivos_ad.items():
+            archivo.dominio = dominio
+            guardar_cuentas(cuentas_por_dominio[dominio], archivo)
+        etapa['filas'] = total_cuentas
+    
+    multidominio = len(archivos_ad) > 1
+    proceso = ProcesoConciliacion.objects.create(
+        usuario=usuario,
+        archivo_nomina=archivo_nomina,
+        archivo_ad=next(iter(archivos_ad.values())),
+        estado='PROCESANDO',
+        resumen_dominios=resumen_dominios(archivos_ad, cuentas_por_dominio, resultados) if multidominio else {}
+    )
+    if multidominio:
+        ArchivoCargado.objects.filter(pk__in=[a.pk for a in archivos_ad.values()]).update(proceso_dominios=proceso)
+    
+    with medidor.etapa('guardar_resultados') as etapa:
+        guardar_resultados(proceso, resultados, usuario, len(empleados), total_cuentas)
+        etapa['filas'] = len(resultados)
+    
+    proceso.metricas_etapas = medidor.etapas
+    proceso.save(update_fields=['metricas_etapas'])
+    metricas.observar_proceso(proceso, resultados)
+    return proceso
+
+
+def ejecutar_conciliacion(archivo_nomina, archivo_ad, usuario):
+    """
+    Procesa los dos archivos ya cargados, concilia y guarda todo midiendo
+    cada etapa. Retorna el ProcesoConciliacion completado.
+    """
+    empleados, cuentas, resultados, etapas = procesar_y_conciliar(
+        archivo_nomina.archivo.path, archivo_ad.archivo.path
+    )
+    return persistir_conciliacion(archivo_nomina, {'': archivo_ad}, usuario, empleados, {'': cuentas}, resultados, etapas)
+
+
+def leer_exports_ad(rutas, procesos=1):
+    """
+    {dominio: ruta} -> {dominio: [CuentaProcesada]}. Con `procesos` > 1 los
+    exports se leen en paralelo, cada uno en un proceso hijo
+    """
+    if procesos <= 1 or len(rutas) == 1:
+        return {dominio: ProcesadorTXTAD().procesar(ruta) for dominio, ruta in rutas.items()}
+    
+    from .lotes import leer_export_ad
+    with ProcessPoolExecutor(max_workers=min(procesos, len(rutas))) as pool:
+        futuros = {dominio: pool.submit(leer_export_ad, ruta) for dominio, ruta in rutas.items()}
+        return {dominio: futuro.result() for dominio, futuro in futuros.items()}
+
+
+def resumen_dominios(archivos_ad, cuentas_por_dominio, resultados, maximo=20):
+    """
+    Conteos por dominio y hallazgos entre dominios: RUTs fantasma en más de
+    un dominio y RUTs con cuenta en más de un dominio (hasta `maximo` de ejemplo)
+    """
+    por_dominio = {
+        dominio: {'dominio': dominio, 'archivo_id': str(archivo.id), 'cuentas': len(cuentas_por_dominio[dominio]),
+                  'fantasmas': 0, 'inactivos_con_cuenta': 0}
+        for dominio, archivo in archivos_ad.items()
+    }
+    fantasmas = {}
+    en_varios = set()
+    for r in resultados:
+        if not r.get('dominio'):
+            continue
+        if r['categoria'] == 'FANTASMA_TOTAL':
+            por_dominio[r['dominio']]['fantasmas'] += 1
+            fantasmas.setdefault(r['rut'], []).append(r['dominio'])
+        elif r['categoria'] == 'INACTIVO_CON_CUENTA':
+            por_dominio[r['dominio']]['inactivos_con_cuenta'] += 1
+        if r.get('otros_dominios'):
+            en_varios.add(r['rut'])
+    
+    fantasmas_varios = sorted(rut for rut, dominios in fantasmas.items() if len(dominios) > 1)
+    return {
+        'dominios': list(por_dominio.values()),
+        'hallazgos': {
+            'fantasmas_en_varios_dominios': len(fantasmas_varios),
+            'ejemplos_fantasmas': [{'rut': rut, 'dominios': fantasmas[rut]} for rut in fantasmas_varios[:maximo]],
+            'ruts_con_cuenta_en_varios_dominios': len(en_varios),
+            'ejemplos_cuentas': sorted(en_varios)[:maximo],
+        },
+    }
+
+
+def procesar_y_conciliar_dominios(ruta_nomina, rutas_ad, procesos=1, medir_memoria=None):
+    """
+    Como procesar_y_conciliar, para una nómina contra varios exports AD
+    ({dominio: ruta}). La nómina se lee una vez. Retorna (empleados,
+    cuentas_por_dominio, resultados, etapas)
+    """
+    medidor = MedidorEtapas(medir_memoria)
+    with medidor.etapa('procesar_nomina') as etapa:
+        empleados = ProcesadorExcelNomina().procesar(ruta_nomina)
+        etapa['filas'] = len(empleados)
+    
+    with medidor.etapa('procesar_ad') as etapa:
+        cuentas_por_dominio = leer_exports_ad(rutas_ad, procesos)
+        etapa['filas'] = sum(len(cuentas) for cuentas in cuentas_por_dominio.values())
+    
+    with medidor.etapa('conciliar') as etapa:
+        resultados = Conciliador(reglas_conciliacion()).conciliar_dominios(empleados, cuentas_por_dominio)
+        etapa['filas'] = len(empleados) + sum(len(cuentas) for cuentas in cuentas_por_dominio.values())
+    
+    return empleados, cuentas_por_dominio, resultados, medidor.etapas
+
+
+def ejecutar_conciliacion_dominios(archivo_nomina, archivos_ad, usuario, procesos=None):
+    """
+    Concilia una nómina contra los exports AD de varios dominios en un solo
+    proceso. `archivos_ad` es {dominio: ArchivoCargado} (ver persistir_conciliacion).
+    """
+    procesos = settings.DOMINIOS_PROCESOS if procesos is None else procesos
+    empleados, cuentas_por_dominio, resultados, etapas = procesar_y_conciliar_dominios(
+        archivo_nomina.archivo.path,
+        {dominio: archivo.archivo.path for dominio, archivo in archivos_ad.items()},
+        procesos
+    )
+    return persistir_conciliacion(archivo_nomina, archivos_ad, usuario, empleados, cuentas_por_dominio, resultados, etapas)
@@ -1,3 +1,1132 @@
-from django.test import TestCase
+import contextlib
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+import pstats
+import shutil
+import sqlite3
+import socket
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+import zipfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from dateutil.relativedelta import relativedelta
+from django.contrib.auth.models import User
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.conf import settings
+from django.db import IntegrityError, connection, connections, transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.db.models import Count
+from django.template.loader import render_to_string
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import metricas
+from .archivado import archivar_proceso, procesos_archivables
+from .models import (
+    ArchivoCargado, EmpleadoNomina, CuentaActiveDirectory, CargaFragmentada,
+    Conciliacion, ProcesoConciliacion, EntradaCarpeta, HistorialRut, PerfilSolicitud,
+    ScriptPowershell
+)
+from .pipeline import insertar_por_bloques, leer_exports_ad, reglas_conciliacion
+from .utils.carpeta import periodo_desde_nombre
+from .utils.datos_sinteticos import GeneradorDatosSinteticos
+from .utils.procesadores import Conciliador, CuentaProcesada, EmpleadoProcesado
+from .utils.reglas import ReglasCompiladas
+from .utils.rut import calcular_dv_lote, digito_verificador, rut_valido, separar_rut, validar_ruts_lote
+from .views import obtener_o_generar_script
+
+# Filas de nómina de los dos tamaños de datos sembrados
+TAMANOS = (40, 400)
+
+# Memoria máxima (bytes, tracemalloc) que puede asignar cada vista con el tamaño mayor
+PRESUPUESTO_MEMORIA = {
+    'subir_archivos': 6 * 1024 * 1024,
+    'ver_resultados': 12 * 1024 * 1024,
+    'historial_procesos': 2 * 1024 * 1024,
+    'generar_script_powershell': 2 * 1024 * 1024,
+}
+
+# Las cargas masivas se dividen en lotes (SQLite limita los parámetros por
+# consulta): se tolera una consulta extra por cada tantas filas insertadas de más
+FILAS_POR_LOTE_MINIMO = 50
+
+_MEDIA_ROOT = tempfile.mkdtemp(prefix='media_tests_')
+
+
+def tearDownModule():
+    shutil.rmtree(_MEDIA_ROOT, ignore_errors=True)
+
+
+@contextlib.contextmanager
+def silenciado():
+    """Descarta lo que imprimen los procesadores y comandos (sin acumularlo en memoria)"""
+    with open(os.devnull, 'w') as nulo, contextlib.redirect_stdout(nulo), contextlib.redirect_stderr(nulo):
+        yield nulo
+
+
+def objetivos_script(texto):
+    """Filas (dominio, SamAccountName, RUT) de la tabla de cuentas embebida en un script compacto"""
+    datos = texto.split('"SamAccountName","Rut","Motivo","Dominio"\n')[1].split("'@")[0]
+    return [(fila['Dominio'], fila['SamAccountName'], fila['Rut']) for fila in csv.DictReader(
+        io.StringIO(datos), fieldnames=['SamAccountName', 'Rut', 'Motivo', 'Dominio'])]
+
+
+# El medidor de etapas reinicia el pico de tracemalloc; las pruebas que miden
+# memoria lo hacen sobre la vista completa
+@override_settings(MEDIA_ROOT=_MEDIA_ROOT, PIPELINE_MEDIR_MEMORIA=False)
+class PruebaConArchivos(TestCase):
+    """
+    Base de las pruebas que cargan archivos: un par nómina/AD sintético por
+    clase en un directorio temporal (`archivos`) y un usuario con sesión.
+    """
+    filas_sinteticas = 60
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directorio_datos = tempfile.mkdtemp(prefix='datos_tests_')
+        cls.addClassCleanup(shutil.rmtree, cls.directorio_datos, ignore_errors=True)
+        cls.archivos = GeneradorDatosSinteticos().generar_par(cls.directorio_datos, cls.filas_sinteticas)
+
+    def setUp(self):
+        self.usuario = self.iniciar_sesion()
+
+    def iniciar_sesion(self, nombre='analista', **campos):
+        usuario = User.objects.create_user(nombre, password='clave', **campos)
+        self.client.force_login(usuario)
+        return usuario
+
+    def subir(self, ruta_nomina, *rutas_ad):
+        """Carga una nómina y uno o más exports AD por el formulario web"""
+        with contextlib.ExitStack() as pila:
+            nomina = pila.enter_context(open(ruta_nomina, 'rb'))
+            ads = [pila.enter_context(open(ruta, 'rb')) for ruta in rutas_ad]
+            return self.client.post(reverse('subir_archivos'), {'nomina_file': nomina, 'ad_file': ads})
+
+    def sembrar_proceso(self, ruta_nomina, *rutas_ad):
+        with silenciado():
+            self.subir(ruta_nomina, *rutas_ad)
+        return ProcesoConciliacion.objects.filter(usuario=self.usuario).latest('fecha_inicio')
+
+
+class PresupuestoVistasTests(PruebaConArchivos):
+    """
+    Las vistas más usadas deben hacer la misma cantidad de consultas sin
+    importar el volumen de datos (sin N+1) y mantenerse bajo un presupuesto
+    de memoria (sin materializar todo el proceso).
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        generador = GeneradorDatosSinteticos()
+        cls.archivos = {n: generador.generar_par(cls.directorio_datos, n) for n in TAMANOS}
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def medir(self, funcion):
+        """Ejecuta `funcion` y retorna (respuesta, consultas, pico de memoria)"""
+        cache.clear()
+        tracemalloc.start()
+        try:
+            with silenciado(), CaptureQueriesContext(connection) as consultas:
+                respuesta = funcion()
+            pico = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        return respuesta, len(consultas), pico
+
+    def comprobar(self, vista, mediciones, filas_insertadas_extra=0):
+        """
+        Misma cantidad de consultas en ambos tamaños (salvo los lotes extra de
+        las cargas masivas) y memoria bajo presupuesto con el tamaño mayor
+        """
+        (consultas_menor, _), (consultas_mayor, pico_mayor) = mediciones
+        lotes_extra = -(-filas_insertadas_extra // FILAS_POR_LOTE_MINIMO)
+        self.assertLessEqual(
+            consultas_mayor, consultas_menor + lotes_extra,
+            f'{vista}: las consultas crecen con los datos ({consultas_menor} -> {consultas_mayor})'
+        )
+        self.assertLess(
+            pico_mayor, PRESUPUESTO_MEMORIA[vista],
+            f'{vista}: {pico_mayor // 1024} KB supera el presupuesto de memoria'
+        )
+
+    def filas_guardadas(self):
+        return (EmpleadoNomina.objects.count() + CuentaActiveDirectory.objects.count()
+                + Conciliacion.objects.count())
+
+    def test_subir_archivos(self):
+        mediciones = []
+        insertadas = []
+        for filas in TAMANOS:
+            antes = self.filas_guardadas()
+            respuesta, consultas, pico = self.medir(lambda: self.subir(*self.archivos[filas]))
+            self.assertEqual(respuesta.status_code, 302)
+            self.assertIn('/resultados/', respuesta.url)
+            mediciones.append((consultas, pico))
+            insertadas.append(self.filas_guardadas() - antes)
+        self.comprobar('subir_archivos', mediciones, filas_insertadas_extra=insertadas[1] - insertadas[0])
+
+    def test_ver_resultados(self):
+        mediciones = []
+        for filas in TAMANOS:
+            proceso = self.sembrar_proceso(*self.archivos[filas])
+            self.assertGreater(proceso.conciliaciones_generadas, 0)
+            respuesta, consultas, pico = self.medir(
+                lambda: self.client.get(reverse('ver_resultados', args=[proceso.id]))
+            )
+            self.assertEqual(respuesta.status_code, 200)
+            mediciones.append((consultas, pico))
+        self.comprobar('ver_resultados', mediciones)
+
+    def test_historial_procesos(self):
+        mediciones = []
+        for cantidad in (3, 30):
+            ProcesoConciliacion.objects.all().delete()
+            for i in range(cantidad):
+                archivos = [
+                    ArchivoCargado.objects.create(
+                        nombre_original=f'{tipo.lower()}_{i}.txt', tipo_archivo=tipo,
+                        archivo=f'pruebas/{tipo.lower()}_{i}.txt', usuario=self.usuario
+                    )
+                    for tipo in ('NOMINA', 'AD')
+                ]
+                ProcesoConciliacion.objects.create(
+                    usuario=self.usuario, archivo_nomina=archivos[0], archivo_ad=archivos[1],
+                    estado='COMPLETADO', fantasmas_totales=i,
+                    metricas_etapas=[{'etapa': 'conciliar', 'segundos': 0.1, 'filas': 10}]
+                )
+            respuesta, consultas, pico = self.medir(lambda: self.client.get(reverse('historial_procesos')))
+            self.assertEqual(respuesta.status_code, 200)
+            self.assertContains(respuesta, 'nomina_0.txt')
+            mediciones.append((consultas, pico))
+        self.comprobar('historial_procesos', mediciones)
+
+    def test_generar_script_powershell(self):
+        mediciones = []
+        for filas in TAMANOS:
+            proceso = self.sembrar_proceso(*self.archivos[filas])
+            self.assertGreater(proceso.fantasmas_totales, 0)
+            respuesta, consultas, pico = self.medir(lambda: self.client.post(
+                reverse('generar_script', args=[proceso.id]),
+                {'tipo_script': 'BLOQUEO_MASIVO', 'modo_seguro': 'true'}
+            ))
+            self.assertEqual(respuesta.status_code, 302)
+            mediciones.append((consultas, pico))
+        self.comprobar('generar_script_powershell', mediciones)
+
+
+class ArchivadoTests(PruebaConArchivos):
+    """
+    Un proceso antiguo y resuelto se archiva: sus filas salen de la base y
+    ver_resultados muestra lo mismo leyendo el archivo comprimido.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directorio_archivo = tempfile.mkdtemp(prefix='archivo_tests_')
+        cls.addClassCleanup(shutil.rmtree, cls.directorio_archivo, ignore_errors=True)
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.proceso = self.sembrar_proceso(*self.archivos)
+
+    def envejecer(self, meses):
+        ProcesoConciliacion.objects.filter(pk=self.proceso.pk).update(
+            fecha_inicio=timezone.now() - relativedelta(months=meses)
+        )
+
+    def test_solo_procesos_antiguos_y_resueltos(self):
+        self.envejecer(13)
+        self.assertFalse(procesos_archivables(12).exists())  # Tiene pendientes
+        self.proceso.conciliaciones().update(resuelto=True)
+        self.assertTrue(procesos_archivables(12).exists())
+        self.assertFalse(procesos_archivables(14).exists())
+
+    def test_archivar_y_ver_resultados(self):
+        self.proceso.conciliaciones().update(resuelto=True)
+        self.envejecer(13)
+        url = reverse('ver_resultados', args=[self.proceso.id])
+        tabla_antes = self.client.get(url).context['tabla_resultados']
+
+        with self.settings(ARCHIVO_HISTORICO_DIRECTORIO=self.directorio_archivo):
+            filas = archivar_proceso(procesos_archivables(12).get())
+            self.assertEqual(filas, self.proceso.total_empleados + self.proceso.total_cuentas_ad
+                             + self.proceso.conciliaciones_generadas)
+            self.assertFalse(Conciliacion.objects.exists())
+            self.assertFalse(EmpleadoNomina.objects.exists())
+            self.assertFalse(CuentaActiveDirectory.objects.exists())
+
+            respuesta = self.client.get(url)
+            self.assertEqual(respuesta.status_code, 200)
+            self.assertTrue(respuesta.context['proceso'].archivado)
+            # Mismo contenido (el orden de los empates puede variar)
+            self.assertEqual(
+                sorted(respuesta.context['tabla_resultados'].splitlines()),
+                sorted(tabla_antes.splitlines())
+            )
+
+
+@override_settings(CARGAS_TAMANO_FRAGMENTO_MINIMO=1024)
+class CargaFragmentadaTests(PruebaConArchivos):
+    """Carga reanudable: fragmentos en desorden, reintentos y finalización con conciliación"""
+
+    def iniciar(self, ruta, tipo, tamano_fragmento=4096):
+        respuesta = self.client.post(reverse('iniciar_carga'), {
+            'nombre': os.path.basename(ruta), 'tipo_archivo': tipo,
+            'tamano_total': os.path.getsize(ruta), 'tamano_fragmento': tamano_fragmento,
+        })
+        self.assertEqual(respuesta.status_code, 201)
+        return respuesta.json()
+
+    def enviar(self, carga, numero, datos, cabeceras=None):
+        return self.client.put(
+            reverse('subir_fragmento', args=[carga['id'], numero]), datos,
+            content_type='application/octet-stream', headers=cabeceras
+        )
+
+    def cargar(self, ruta, tipo):
+        """Envía todos los fragmentos en orden inverso"""
+        carga = self.iniciar(ruta, tipo)
+        with open(ruta, 'rb') as archivo:
+            contenido = archivo.read()
+        tamano = carga['tamano_fragmento']
+        for numero in reversed(range(carga['total_fragmentos'])):
+            respuesta = self.enviar(carga, numero, contenido[numero * tamano:(numero + 1) * tamano])
+            self.assertEqual(respuesta.status_code, 200)
+        return carga, contenido
+
+    def test_fragmentos_invalidos_y_reintento(self):
+        ruta = self.archivos[1]
+        carga = self.iniciar(ruta, 'AD')
+        with open(ruta, 'rb') as archivo:
+            primero = archivo.read(carga['tamano_fragmento'])
+
+        self.assertEqual(self.enviar(carga, 0, primero[:-1]).status_code, 400)
+        self.assertEqual(self.enviar(carga, 0, primero + b'x').status_code, 400)
+        self.assertEqual(self.enviar(carga, 0, primero, {'X-Fragmento-SHA256': '0' * 64}).status_code, 400)
+        self.assertEqual(self.enviar(carga, carga['total_fragmentos'], primero).status_code, 400)
+
+        estado = self.client.get(reverse('estado_carga', args=[carga['id']])).json()
+        self.assertEqual(estado['recibidos'], 0)
+
+        for _ in range(2):  # Reintentar un fragmento válido lo reemplaza
+            self.assertEqual(self.enviar(carga, 0, primero).status_code, 200)
+        estado = self.client.get(reverse('estado_carga', args=[carga['id']])).json()
+        self.assertEqual(estado['recibidos'], 1)
+        self.assertEqual(estado['faltantes'], list(range(1, carga['total_fragmentos'])))
+
+    def test_finalizar_concilia(self):
+        carga_nomina, contenido_nomina = self.cargar(self.archivos[0], 'NOMINA')
+        carga_ad, contenido_ad = self.cargar(self.archivos[1], 'AD')
+
+        with silenciado():
+            respuesta = self.client.post(reverse('finalizar_cargas'), {'nomina': carga_nomina['id'], 'ad': carga_ad['id']})
+        self.assertEqual(respuesta.status_code, 200)
+        datos = respuesta.json()
+
+        proceso = ProcesoConciliacion.objects.get(id=datos['proceso_id'])
+        self.assertEqual(proceso.estado, 'COMPLETADO')
+        self.assertGreater(proceso.conciliaciones_generadas, 0)
+        with open(proceso.archivo_nomina.archivo.path, 'rb') as archivo:
+            self.assertEqual(archivo.read(), contenido_nomina)
+        with open(proceso.archivo_ad.archivo.path, 'rb') as archivo:
+            self.assertEqual(archivo.read(), contenido_ad)
+        self.assertTrue(datos['hash_ad'].endswith(f"-{carga_ad['total_fragmentos']}"))
+
+        # Una carga finalizada no admite más fragmentos
+        self.assertEqual(self.enviar(carga_ad, 0, contenido_ad[:4096]).status_code, 409)
+
+    def test_error_al_conciliar_reabre_las_cargas(self):
+        carga_nomina, contenido_nomina = self.cargar(self.archivos[0], 'NOMINA')
+        carga_ad, _ = self.cargar(self.archivos[1], 'AD')
+        datos = {'nomina': carga_nomina['id'], 'ad': carga_ad['id']}
+
+        # Falla después de crear el proceso: no debe quedar huérfano
+        with silenciado(), mock.patch('conciliacion_app.pipeline.guardar_resultados', side_effect=RuntimeError('falla')):
+            respuesta = self.client.post(reverse('finalizar_cargas'), datos)
+        self.assertEqual(respuesta.status_code, 500)
+        self.assertEqual([c['estado'] for c in respuesta.json()['cargas']], ['EN_CURSO', 'EN_CURSO'])
+        self.assertFalse(ArchivoCargado.objects.exists())
+        self.assertFalse(ProcesoConciliacion.objects.exists())
+        with open(CargaFragmentada.objects.get(id=carga_nomina['id']).ruta_parcial(), 'rb') as archivo:
+            self.assertEqual(archivo.read(), contenido_nomina)
+
+        # Se finaliza de nuevo sin reenviar fragmentos
+        with silenciado():
+            respuesta = self.client.post(reverse('finalizar_cargas'), datos)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(ProcesoConciliacion.objects.get().estado, 'COMPLETADO')
+
+
+class VigilarCarpetaTests(PruebaConArchivos):
+    """La carpeta de entrada: emparejamiento por período y sin reprocesar archivos sin cambios"""
+
+    def setUp(self):
+        self.entrada = tempfile.mkdtemp(prefix='entrada_tests_')
+        self.addCleanup(shutil.rmtree, self.entrada, ignore_errors=True)
+        self.ruta_ad = os.path.join(self.entrada, 'export_ad_2025-11.csv')
+        shutil.copy(self.archivos[0], os.path.join(self.entrada, 'ALTAS_Y_BAJAS_-_NOVIEMBRE_2025.xlsx'))
+        shutil.copy(self.archivos[1], self.ruta_ad)
+        shutil.copy(self.archivos[1], os.path.join(self.entrada, 'export_ad_2025-12.csv'))  # Sin nómina
+
+    def vigilar(self):
+        with silenciado() as nulo:
+            call_command('vigilar_carpeta', directorio=self.entrada, estable=0, una_vez=True, nice=0,
+                         stdout=nulo, stderr=nulo)
+
+    def test_periodo_desde_nombre(self):
+        self.assertEqual(periodo_desde_nombre('ALTAS_Y_BAJAS_-_NOVIEMBRE_2025.xlsx'), '2025-11')
+        self.assertEqual(periodo_desde_nombre('ad_dic-2025.txt'), '2025-12')
+        self.assertEqual(periodo_desde_nombre('export_202503.csv'), '2025-03')
+        self.assertEqual(periodo_desde_nombre('usuarios 07-2025.txt'), '2025-07')
+        self.assertIsNone(periodo_desde_nombre('indicadores_2025.xlsx'))
+
+    def test_concilia_pares_nuevos_una_sola_vez(self):
+        self.vigilar()
+        entrada = EntradaCarpeta.objects.get()
+        self.assertEqual(entrada.periodo, '2025-11')
+        self.assertEqual(entrada.estado, 'COMPLETADO')
+        self.assertEqual(entrada.proceso.estado, 'COMPLETADO')
+
+        self.vigilar()
+        self.assertEqual(ProcesoConciliacion.objects.count(), 1)
+
+        # Un export reemplazado (otro mtime) se vuelve a conciliar
+        stat = os.stat(self.ruta_ad)
+        os.utime(self.ruta_ad, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.vigilar()
+        self.assertEqual(ProcesoConciliacion.objects.count(), 2)
+        self.assertEqual(EntradaCarpeta.objects.filter(estado='COMPLETADO').count(), 2)
+
+    def test_reencola_entradas_abandonadas(self):
+        # Un vigilante que cae a mitad de la conciliación deja su entrada PROCESANDO
+        with mock.patch('conciliacion_app.management.commands.vigilar_carpeta.ejecutar_conciliacion', side_effect=KeyboardInterrupt):
+            self.vigilar()
+        entrada = EntradaCarpeta.objects.get()
+        self.assertEqual(entrada.estado, 'PROCESANDO')
+        self.assertEqual(entrada.tomada_por, f'{socket.gethostname()}:{os.getpid()}')
+        abandonados = {entrada.archivo_nomina_id, entrada.archivo_ad_id}
+        self.assertEqual(set(ArchivoCargado.objects.values_list('id', flat=True)), abandonados)
+
+        # Su dueño sigue vivo en este equipo: no importa cuándo la tomó
+        EntradaCarpeta.objects.update(fecha_toma=timezone.now() - timedelta(hours=3))
+        self.vigilar()
+        self.assertEqual(EntradaCarpeta.objects.get().estado, 'PROCESANDO')
+
+        # Dueño en otro equipo: se espera CARPETA_SEGUNDOS_PROCESANDO desde la toma
+        EntradaCarpeta.objects.update(tomada_por='otro-servidor:1', fecha_toma=timezone.now())
+        self.vigilar()
+        self.assertEqual(EntradaCarpeta.objects.get().estado, 'PROCESANDO')
+
+        # Dueño de este equipo que ya terminó: se reencola y se descarta su intento
+        muerto = subprocess.Popen([sys.executable, '-c', 'pass'])
+        muerto.wait()
+        EntradaCarpeta.objects.update(tomada_por=f'{socket.gethostname()}:{muerto.pid}')
+        self.vigilar()
+        entrada = EntradaCarpeta.objects.get()
+        self.assertEqual(entrada.estado, 'COMPLETADO')
+        self.assertEqual(entrada.proceso.estado, 'COMPLETADO')
+        self.assertFalse(ArchivoCargado.objects.filter(id__in=abandonados).exists())
+        self.assertEqual(ProcesoConciliacion.objects.count(), 1)
+
+
+class EscrituraSQLiteTests(TestCase):
+    """Perfil de SQLite (pragmas, BEGIN IMMEDIATE) y escritura masiva en transacciones cortas"""
+
+    def test_perfil_de_conexion(self):
+        # La base de pruebas está en memoria: se abre una en disco con las mismas opciones
+        directorio = tempfile.mkdtemp(prefix='sqlite_tests_')
+        self.addCleanup(shutil.rmtree, directorio, ignore_errors=True)
+        ruta = os.path.join(directorio, 'perfil.sqlite3')
+        connections['perfil'] = DatabaseWrapper({**connection.settings_dict, 'NAME': ruta}, alias='perfil')
+        self.addCleanup(connections.__delitem__, 'perfil')
+        self.addCleanup(connections['perfil'].close)
+
+        with connections['perfil'].cursor() as cursor:
+            valores = {nombre: cursor.execute(f'PRAGMA {nombre}').fetchone()[0] for nombre in settings.SQLITE_PRAGMAS}
+        self.assertEqual(valores, {**settings.SQLITE_PRAGMAS, 'journal_mode': 'wal', 'synchronous': 1, 'temp_store': 2})
+
+        # IMMEDIATE: el bloqueo de escritura se toma al abrir la transacción, antes de escribir
+        otra = sqlite3.connect(ruta, timeout=0)
+        self.addCleanup(otra.close)
+        with transaction.atomic(using='perfil'):
+            with self.assertRaisesMessage(sqlite3.OperationalError, 'locked'):
+                otra.execute('BEGIN IMMEDIATE')
+        otra.execute('BEGIN IMMEDIATE')
+        otra.rollback()
+
+    def entradas(self, cantidad, desde=0):
+        return [EntradaCarpeta(firma=f'firma-{i}', periodo='2025-11', ruta_nomina='n', ruta_ad='a')
+                for i in range(desde, desde + cantidad)]
+
+    @mock.patch('conciliacion_app.pipeline.FILAS_POR_TRANSACCION', 3)
+    def test_insertar_por_bloques(self):
+        # Una transacción (aquí, un savepoint) por cada FILAS_POR_TRANSACCION filas, sin bloque vacío al final
+        for cantidad, bloques in ((6, 2), (7, 3), (0, 0)):
+            EntradaCarpeta.objects.all().delete()
+            with CaptureQueriesContext(connection) as consultas:
+                self.assertEqual(insertar_por_bloques(EntradaCarpeta, iter(self.entradas(cantidad))), cantidad)
+            self.assertEqual(sum(c['sql'].startswith('SAVEPOINT') for c in consultas.captured_queries), bloques)
+            self.assertEqual(EntradaCarpeta.objects.count(), cantidad)
+
+        # Si falla un bloque quedan confirmados los anteriores y ninguna fila del que falló
+        EntradaCarpeta.objects.all().delete()
+        repetida = self.entradas(1, desde=4)
+        with self.assertRaises(IntegrityError):
+            insertar_por_bloques(EntradaCarpeta, self.entradas(5) + repetida)
+        self.assertEqual(sorted(EntradaCarpeta.objects.values_list('firma', flat=True)),
+                         [f'firma-{i}' for i in range(3)])
+
+
+class DigitoVerificadorTests(TestCase):
+    """Dígito verificador por tablas: valores conocidos y misma respuesta en la versión escalar y por lotes"""
+
+    def test_valores_conocidos(self):
+        casos = {12345678: '5', 11111111: '1', 6: 'K', 10000013: 'K', 14: '0', 10000004: '0', 76086428: '5'}
+        for numero, dv in casos.items():
+            self.assertEqual(digito_verificador(numero), dv, numero)
+        self.assertEqual(list(calcular_dv_lote(list(casos))), list(casos.values()))
+
+    def test_validacion(self):
+        self.assertTrue(rut_valido('12345678-5'))
+        self.assertTrue(rut_valido('10000013-k'))
+        self.assertFalse(rut_valido('12345678-4'))
+        self.assertFalse(rut_valido('12345678'))
+        # Ceros a la izquierda
+        self.assertEqual(separar_rut('0012345678-5'), (12345678, '5'))
+        self.assertTrue(rut_valido('000000014-0'))
+        self.assertEqual(
+            validar_ruts_lote(['12345678-5', '12345678-4', '0012345678-5', 'abc', None]).tolist(),
+            [True, False, True, False, False]
+        )
+
+    def test_escalar_y_lote_coinciden(self):
+        numeros = list(range(1, 200001, 7)) + list(range(99990000, 100010000, 13))
+        self.assertEqual(list(calcular_dv_lote(numeros)), [digito_verificador(n) for n in numeros])
+        ruts = [f'{n}-{digito_verificador(n) if n % 3 else "0"}' for n in numeros]
+        ruts += ['', '-5', '1--9', '12.345.678-5', '1234567890-2', '0000000000014-0', '10000013-kk', '１-9']
+        self.assertEqual(validar_ruts_lote(ruts).tolist(), [rut_valido(r) for r in ruts])
+
+
+class ReglasConciliacionTests(TestCase):
+    """Categorización con las reglas por defecto y validación de reglas nuevas"""
+
+    def test_reglas_por_defecto(self):
+        empleados = [
+            EmpleadoProcesado('1-9', 'x', None, None, 'ACTIVO', False),
+            EmpleadoProcesado('2-7', 'x', None, None, 'INACTIVO', False),
+            EmpleadoProcesado('3-5', 'x', None, None, 'ACTIVO', True),
+            EmpleadoProcesado('4-3', 'x', None, None, 'INACTIVO', False),
+            EmpleadoProcesado('5-1', 'x', None, None, 'INACTIVO', False),
+            EmpleadoProcesado('8-6', 'x', None, None, 'ACTIVO', False),
+        ]
+        cuentas = [
+            CuentaProcesada('1-9', 'u1', None, None, 'ACTIVA'),
+            CuentaProcesada('2-7', 'u2', None, None, 'ACTIVA'),
+            CuentaProcesada('3-5', 'u3', None, None, 'ACTIVA'),
+            CuentaProcesada('4-3', 'u4', None, None, 'INACTIVA'),
+            CuentaProcesada('6-K', 'u6', None, None, 'ACTIVA'),
+            CuentaProcesada('7-8', 'u7', None, None, 'INACTIVA'),
+            CuentaProcesada('8-4', 'u8', None, None, 'ACTIVA'),  # DV mal digitado en AD
+        ]
+        with silenciado():
+            resultados = Conciliador(reglas_conciliacion()).conciliar(empleados, cuentas)
+
+        por_rut = {r['rut']: (r['categoria'], r['prioridad']) for r in resultados}
+        self.assertEqual(por_rut, {
+            '1-9': ('OK_ACTIVO', 'NINGUNA'),
+            '2-7': ('INACTIVO_CON_CUENTA', 'MEDIA'),
+            '3-5': ('CONFLICTO_REVISION', 'MEDIA'),
+            '4-3': ('OK_INACTIVO', 'NINGUNA'),
+            '6-K': ('FANTASMA_TOTAL', 'ALTA'),
+            '7-8': ('FANTASMA_TOTAL', 'BAJA'),
+            '8-4': ('CONFLICTO_REVISION', 'MEDIA'),
+            '5-1': ('OK_INACTIVO', 'NINGUNA'),
+        })
+        # Primero las cuentas AD y después los empleados sin cuenta
+        self.assertEqual(resultados[-1]['rut'], '5-1')
+        self.assertFalse(resultados[-1]['tiene_cuenta_ad'])
+
+    def test_reglas_invalidas(self):
+        regla = {'categoria': 'OK_ACTIVO', 'prioridad': 'NINGUNA', 'accion': 'MANTENER', 'descripcion': 'x'}
+        with self.assertRaises(ValueError):
+            ReglasCompiladas([{**regla, 'si': {'departamento': 'TI'}}])
+        with self.assertRaises(ValueError):
+            ReglasCompiladas([{**regla, 'si': {'existe_en_nomina': 'si'}}])
+        with self.assertRaises(ValueError):
+            ReglasCompiladas([{**regla, 'categoria': 'OTRA'}], permitidos={'categoria': {'OK_ACTIVO'}})
+
+        # Una regla que no cubre todas las filas deja RUTs sin categoría
+        solo_fantasmas = ReglasCompiladas([{**regla, 'si': {'existe_en_nomina': False}}])
+        with silenciado(), self.assertRaises(ValueError):
+            Conciliador(solo_fantasmas).conciliar(
+                [EmpleadoProcesado('1-9', 'x', None, None, 'ACTIVO')], []
+            )
+
+
+class MultidominioTests(PruebaConArchivos):
+    """Una nómina contra dos exports AD: la nómina se guarda una vez y los resultados quedan por dominio"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.ruta_nomina, ruta_ad = cls.archivos
+        cls.rutas_ad = {'corp': os.path.join(cls.directorio_datos, 'corp.csv'),
+                        'filial': os.path.join(cls.directorio_datos, 'filial.csv')}
+        for ruta in cls.rutas_ad.values():
+            shutil.copy(ruta_ad, ruta)
+
+    def test_nomina_contra_varios_dominios(self):
+        proceso = self.sembrar_proceso(self.ruta_nomina, self.rutas_ad['corp'], self.rutas_ad['filial'])
+        self.assertTrue(proceso.es_multidominio())
+        self.assertEqual(ArchivoCargado.objects.filter(tipo_archivo='NOMINA').count(), 1)
+        self.assertEqual(EmpleadoNomina.objects.count(), proceso.total_empleados)
+        self.assertEqual(set(proceso.archivos_dominios.values_list('dominio', flat=True)), {'corp', 'filial'})
+
+        resumen = {d['dominio']: d for d in proceso.resumen_dominios['dominios']}
+        self.assertEqual(resumen['corp']['fantasmas'], resumen['filial']['fantasmas'])
+        self.assertGreater(resumen['corp']['fantasmas'], 0)
+        # Mismo export en ambos dominios: cada fantasma aparece en los dos
+        hallazgos = proceso.resumen_dominios['hallazgos']
+        self.assertEqual(hallazgos['fantasmas_en_varios_dominios'], resumen['corp']['fantasmas'])
+        self.assertEqual(proceso.fantasmas_totales, 2 * resumen['corp']['fantasmas'])
+
+        conciliaciones = proceso.conciliaciones().select_related('cuenta_ad__archivo_origen')
+        for conc in conciliaciones:
+            if conc.cuenta_ad_id:
+                self.assertEqual(conc.cuenta_ad.archivo_origen.dominio, conc.dominio)
+            else:
+                self.assertEqual(conc.dominio, '')
+        self.assertEqual(conciliaciones.count(), proceso.conciliaciones_generadas)
+
+        with silenciado():
+            respuesta = self.client.get(reverse('ver_resultados', args=[proceso.id]))
+        self.assertContains(respuesta, 'filial')
+
+    def test_script_por_dominio(self):
+        proceso = self.sembrar_proceso(self.ruta_nomina, self.rutas_ad['corp'], self.rutas_ad['filial'])
+        with silenciado():
+            script = obtener_o_generar_script(proceso, 'BLOQUEO_MASIVO', True, True, self.usuario)
+        texto = b''.join(script.iter_contenido()).decode('utf-8')
+        self.assertIn('"corp" = "corp"', texto)
+        self.assertIn('Get-ADUser -LDAPFilter $filtro -Properties Description @servidor', texto)
+
+        # Cada conciliación bloquea solo la cuenta de su dominio, contra el -Server de ese dominio
+        filas = [(dominio, usuario) for dominio, usuario, _ in objetivos_script(texto)]
+        accion = set(proceso.conciliaciones().filter(
+            categoria__in=['FANTASMA_TOTAL', 'INACTIVO_CON_CUENTA']
+        ).values_list('dominio', 'rut_numero'))
+        esperadas = {
+            (dominio, usuario) for dominio, rut_numero, usuario in CuentaActiveDirectory.objects.filter(
+                archivo_origen__in=proceso.ids_archivos_ad()
+            ).values_list('archivo_origen__dominio', 'rut_numero', 'nombre_usuario')
+            if (dominio, rut_numero) in accion
+        }
+        self.assertEqual(set(filas), esperadas)
+        self.assertEqual({dominio for dominio, _ in filas}, {'corp', 'filial'})
+
+    def test_lectura_paralela_de_exports(self):
+        with silenciado():
+            secuencial = leer_exports_ad(self.rutas_ad, procesos=1)
+            paralelo = leer_exports_ad(self.rutas_ad, procesos=2)
+        self.assertEqual(
+            {d: [c.rut_normalizado for c in cuentas] for d, cuentas in paralelo.items()},
+            {d: [c.rut_normalizado for c in cuentas] for d, cuentas in secuencial.items()}
+        )
+
+
+class HistorialRutTests(PruebaConArchivos):
+    """Índice de historia por RUT: se llena en cada proceso y responde la línea de tiempo sin abrir procesos"""
+
+    def setUp(self):
+        self.usuario = self.iniciar_sesion('seguridad', is_staff=True)
+        self.procesos = [self.sembrar_proceso(*self.archivos) for _ in range(2)]
+
+    def test_linea_de_tiempo(self):
+        fantasma = Conciliacion.objects.filter(categoria='FANTASMA_TOTAL', rut_numero__isnull=False).first()
+        respuesta = self.client.get(reverse('historial_rut', args=[fantasma.rut]))
+        self.assertEqual(respuesta.status_code, 200)
+        datos = respuesta.json()
+        self.assertEqual(datos['procesos'], 2)
+        self.assertEqual([e['proceso'] for e in datos['entradas']], [str(p.id) for p in self.procesos])
+        self.assertEqual(datos['por_categoria'], {'FANTASMA_TOTAL': 2})
+        self.assertEqual(datos['fantasma_desde'], datos['primera_deteccion'])
+
+        self.assertEqual(self.client.get(reverse('historial_rut', args=['abc'])).status_code, 400)
+
+        # La consulta se resuelve solo con el índice
+        with connection.cursor() as cursor:
+            consulta = HistorialRut.objects.filter(rut_numero=fantasma.rut_numero).order_by('fecha').values_list(
+                'fecha', 'categoria', 'dominio', 'proceso_id'
+            )
+            sql, parametros = consulta.query.sql_with_params()
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', parametros)
+            plan = ' '.join(str(fila) for fila in cursor.fetchall())
+        self.assertIn('COVERING INDEX historial_rut_linea_tiempo', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_sin_historia_si_el_proceso_no_termina(self):
+        guardar = ProcesoConciliacion.save
+
+        def fallar_al_completar(proceso, *args, **kwargs):
+            if proceso.estado == 'COMPLETADO':
+                raise RuntimeError('falla')
+            return guardar(proceso, *args, **kwargs)
+
+        total = HistorialRut.objects.count()
+        with mock.patch.object(ProcesoConciliacion, 'save', fallar_al_completar):
+            self.sembrar_proceso(*self.archivos)
+        self.assertEqual(HistorialRut.objects.count(), total)
+        self.assertFalse(HistorialRut.objects.exclude(proceso__estado='COMPLETADO').exists())
+
+    def test_reindexar_incluye_archivados(self):
+        total = HistorialRut.objects.count()
+        self.assertEqual(total, sum(p.conciliaciones_generadas for p in self.procesos))
+
+        directorio_archivo = tempfile.mkdtemp(prefix='archivo_tests_')
+        self.addCleanup(shutil.rmtree, directorio_archivo, ignore_errors=True)
+        with override_settings(ARCHIVO_HISTORICO_DIRECTORIO=directorio_archivo):
+            archivar_proceso(self.procesos[0])
+            self.assertEqual(HistorialRut.objects.count(), total)
+
+            with silenciado() as nulo:
+                call_command('indexar_historial_ruts', reconstruir=True, stdout=nulo)
+            self.assertEqual(HistorialRut.objects.count(), total)
+
+
+@override_settings(SCRIPTS_COMPRIMIR=True)
+class DescargaScriptTests(PruebaConArchivos):
+    """Scripts guardados: representaciones gzip e identidad con ETag distintos"""
+
+    def setUp(self):
+        super().setUp()
+        self.proceso = self.sembrar_proceso(*self.archivos)
+
+    def generar(self, **datos):
+        with silenciado():
+            respuesta = self.client.post(reverse('generar_script', args=[self.proceso.id]),
+                                         {'tipo_script': 'BLOQUEO_MASIVO', 'modo_seguro': 'true', **datos})
+        self.assertEqual(respuesta.status_code, 302)
+        return respuesta.url
+
+    def test_etag_por_codificacion(self):
+        url = self.generar()
+        with silenciado():
+            gzip = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+            identidad = self.client.get(url)
+        self.assertEqual(gzip['Content-Encoding'], 'gzip')
+        self.assertFalse(identidad.has_header('Content-Encoding'))
+        self.assertEqual(gzip['ETag'], identidad['ETag'][:-1] + '-gzip"')
+
+        with silenciado():
+            no_modificado = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=gzip['ETag'])
+            otra_codificacion = self.client.get(url, HTTP_IF_NONE_MATCH=gzip['ETag'])
+        self.assertEqual(no_modificado.status_code, 304)
+        self.assertEqual(otra_codificacion.status_code, 200)
+
+    def test_gzip_guardado_y_304(self):
+        url = self.generar()
+        script = ScriptPowershell.objects.get()
+        self.assertTrue(script.esta_comprimido())
+        self.assertEqual(script.contenido, '')
+
+        with silenciado():
+            comprimida = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+            identidad = self.client.get(url)
+            texto = b''.join(identidad.streaming_content)
+        # Se envían los bytes guardados, sin recomprimir en cada descarga
+        self.assertEqual(comprimida.content, bytes(script.contenido_comprimido))
+        self.assertEqual(gzip.decompress(comprimida.content), texto)
+        self.assertEqual(hashlib.sha256(texto).hexdigest(), script.hash_contenido)
+        for respuesta in (comprimida, identidad):
+            self.assertIn('Accept-Encoding', respuesta['Vary'])
+            self.assertTrue(respuesta['Content-Disposition'].endswith('.ps1"'))
+
+        with silenciado():
+            no_modificado = self.client.get(url, HTTP_IF_NONE_MATCH=identidad['ETag'])
+        self.assertEqual(no_modificado.status_code, 304)
+        self.assertFalse(no_modificado.content)
+
+    @override_settings(SCRIPTS_COMPRIMIR=False)
+    def test_sin_compresion(self):
+        url = self.generar()
+        self.assertFalse(ScriptPowershell.objects.get().esta_comprimido())
+        with silenciado():
+            respuesta = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(respuesta.has_header('Content-Encoding'))
+
+    def test_rollback_no_depende_del_modo_compacto(self):
+        self.assertEqual(self.generar(tipo_script='ROLLBACK', modo_compacto='true'),
+                         self.generar(tipo_script='ROLLBACK'))
+
+        # El bloqueo por cuenta también registra el estado previo que lee el rollback
+        url = self.generar(modo_seguro='false')
+        with silenciado():
+            contenido = b''.join(self.client.get(url).streaming_content).decode('utf-8')
+        self.assertIn('EnabledAnterior = $Previo.Enabled', contenido)
+        self.assertIn('Registrar-Resultado', contenido.split('# 1. ')[1])
+
+    def test_filtro_ldap_escapado(self):
+        # Un SamAccountName con ( ) * o \ no debe alterar el filtro del lote
+        for tipo in ('BLOQUEO_MASIVO', 'ROLLBACK'):
+            with silenciado():
+                respuesta = self.client.get(self.generar(tipo_script=tipo, modo_compacto='true'))
+                contenido = b''.join(respuesta.streaming_content).decode('utf-8')
+            self.assertIn('"(sAMAccountName=$(Escapar-LDAP $_.SamAccountName))"', contenido)
+            self.assertIn(r"""$Valor.Replace('\', '\5c').Replace('*', '\2a').Replace('(', '\28').Replace(')', '\29')""",
+                          contenido)
+            self.assertNotIn('(sAMAccountName=$($_.SamAccountName))', contenido)
+
+    def objetivos(self, **datos):
+        """Cuentas del script compacto guardado para los datos del formulario"""
+        with silenciado():
+            contenido = self.client.get(self.generar(modo_compacto='true', **datos)).streaming_content
+            return objetivos_script(b''.join(contenido).decode('utf-8'))
+
+    def test_fragmentos_paralelos_en_un_script(self):
+        objetivos = self.objetivos()
+        self.assertTrue(objetivos)
+        # El script paralelo lleva todas las cuentas una vez y las reparte al ejecutarse
+        self.assertEqual(self.objetivos(fragmentos='3'), objetivos)
+        script = ScriptPowershell.objects.get(fragmentos=3)
+        self.assertIn('ForEach-Object -ThrottleLimit $Throttle -Parallel',
+                      b''.join(script.iter_contenido()).decode('utf-8'))
+
+    @override_settings(SCRIPTS_MAX_FRAGMENTOS=4)
+    def test_zip_de_fragmentos(self):
+        objetivos = self.objetivos()
+        with silenciado():
+            respuesta = self.client.post(reverse('generar_script', args=[self.proceso.id]), {
+                'tipo_script': 'BLOQUEO_MASIVO', 'modo_seguro': 'true', 'fragmentos': '50', 'salida_fragmentos': 'zip'
+            })
+            contenido = b''.join(respuesta.streaming_content)
+        with zipfile.ZipFile(io.BytesIO(contenido)) as archivo_zip:
+            self.assertEqual(archivo_zip.namelist(), [f'bloqueo_ad_f{k}de4.ps1' for k in range(1, 5)])
+            fragmentos = [objetivos_script(archivo_zip.read(nombre).decode('utf-8'))
+                          for nombre in archivo_zip.namelist()]
+
+        # Entre todos cubren cada cuenta exactamente una vez, en grupos balanceados
+        self.assertEqual(sorted(sum(fragmentos, [])), sorted(objetivos))
+        tamanos = [len(fragmento) for fragmento in fragmentos]
+        self.assertLessEqual(max(tamanos) - min(tamanos), 1)
+
+
+class LogEjecucionTests(PruebaConArchivos):
+    """Carga del log de un script: resuelve las conciliaciones y rechaza entradas inválidas sin fallar"""
+
+    def setUp(self):
+        super().setUp()
+        self.proceso = self.sembrar_proceso(*self.archivos)
+        self.fantasma = self.proceso.conciliaciones().filter(
+            categoria='FANTASMA_TOTAL', cuenta_ad__isnull=False
+        ).select_related('cuenta_ad').first()
+
+    def cargar(self, contenido, **datos):
+        """Sube el log y retorna los mensajes mostrados al usuario"""
+        log = SimpleUploadedFile('bloqueos.csv', contenido, content_type='text/csv')
+        with silenciado():
+            respuesta = self.client.post(reverse('cargar_log_ejecucion', args=[self.proceso.id]),
+                                         {'log_file': log, **datos})
+        self.assertRedirects(respuesta, reverse('ver_resultados', args=[self.proceso.id]), fetch_redirect_response=False)
+        return ' '.join(str(m) for m in get_messages(respuesta.wsgi_request))
+
+    def test_resuelve_y_versiona(self):
+        fila = f'"SamAccountName","Rut","Resultado"\n"{self.fantasma.cuenta_ad.nombre_usuario}","","OK"\n'
+        self.assertIn('1 conciliaciones marcadas como resueltas', self.cargar(fila.encode('utf-8')))
+        self.fantasma.refresh_from_db()
+        self.assertTrue(self.fantasma.resuelto)
+        self.proceso.refresh_from_db()
+        self.assertEqual(self.proceso.version_resoluciones, 1)
+
+    def test_cache_de_resultados(self):
+        url = reverse('ver_resultados', args=[self.proceso.id])
+
+        def pendientes():
+            """GET de la tabla; retorna (pendientes, veces que se renderizó la tabla)"""
+            with mock.patch('conciliacion_app.views.render_to_string', wraps=render_to_string) as renderizar:
+                with silenciado():
+                    respuesta = self.client.get(url)
+            return respuesta.context['total_pendientes'], renderizar.call_count
+
+        total, renderizadas = pendientes()
+        self.assertEqual(renderizadas, 1)
+        self.assertEqual(pendientes(), (total, 0))
+
+        # Resolución simple: el formulario indica el proceso; uno ajeno se rechaza
+        self.iniciar_sesion('otro_analista')
+        with silenciado():
+            self.client.post(reverse('marcar_resuelto', args=[self.fantasma.id]), {'proceso_id': self.proceso.id})
+        self.fantasma.refresh_from_db()
+        self.assertFalse(self.fantasma.resuelto)
+        self.client.force_login(self.usuario)
+        with silenciado():
+            self.client.post(reverse('marcar_resuelto', args=[self.fantasma.id]), {'proceso_id': self.proceso.id})
+        self.assertEqual(pendientes(), (total - 1, 1))
+        self.assertEqual(pendientes(), (total - 1, 0))
+
+        # Resolución masiva desde el log del script
+        siguiente = self.proceso.conciliaciones().filter(
+            categoria='FANTASMA_TOTAL', cuenta_ad__isnull=False, resuelto=False
+        ).select_related('cuenta_ad').first()
+        fila = f'"SamAccountName","Rut","Resultado"\n"{siguiente.cuenta_ad.nombre_usuario}","","OK"\n'
+        self.cargar(fila.encode('utf-8'))
+        self.assertEqual(pendientes(), (total - 2, 1))
+        self.proceso.refresh_from_db()
+        self.assertEqual(self.proceso.version_resoluciones, 2)
+
+    def test_entradas_invalidas(self):
+        fila = f'"SamAccountName","Rut","Resultado","Error"\n"{self.fantasma.cuenta_ad.nombre_usuario}","","ERROR","Acceso denegado ñ"\n'
+        self.assertIn('UTF-8', self.cargar(fila.encode('cp1252')))
+        self.assertIn('El script indicado no es válido',
+                      self.cargar(b'"SamAccountName","Resultado"\n', script_id='no-es-un-uuid'))
+        self.assertFalse(Conciliacion.objects.filter(resuelto=True).exists())
+
+    def test_sin_resultado_no_resuelve(self):
+        usuario = self.fantasma.cuenta_ad.nombre_usuario
+        # Reporte final del script por cuenta: mismo patrón de nombre, sin columna Resultado
+        reporte = f'"SamAccountName","Name","Description","LastLogonDate"\n"{usuario}","Fantasma","",""\n'
+        self.assertIn('no tiene columna Resultado', self.cargar(reporte.encode('utf-8')))
+        vacio = f'"SamAccountName","Rut","Resultado","Error"\n"{usuario}","","",""\n'
+        self.assertIn('0 conciliaciones marcadas como resueltas', self.cargar(vacio.encode('utf-8')))
+        self.assertFalse(Conciliacion.objects.filter(resuelto=True).exists())
+
+    def test_proceso_multidominio(self):
+        rutas_ad = []
+        for dominio in ('corp', 'filial'):
+            rutas_ad.append(os.path.join(self.directorio_datos, f'{dominio}.csv'))
+            shutil.copy(self.archivos[1], rutas_ad[-1])
+        self.proceso = self.sembrar_proceso(self.archivos[0], *rutas_ad)
+        # Mismo export en ambos dominios: la cuenta y el RUT existen en los dos
+        fantasma = self.proceso.conciliaciones().filter(
+            categoria='FANTASMA_TOTAL', dominio='corp', cuenta_ad__isnull=False
+        ).select_related('cuenta_ad').first()
+        usuario = fantasma.cuenta_ad.nombre_usuario
+
+        sin_dominio = f'"SamAccountName","Rut","Resultado"\n"{usuario}","","OK"\n'
+        self.assertIn('columna Dominio', self.cargar(sin_dominio.encode('utf-8')))
+        self.assertFalse(Conciliacion.objects.filter(resuelto=True).exists())
+
+        con_dominio = f'"SamAccountName","Rut","Dominio","Resultado"\n"{usuario}","","corp","OK"\n'
+        self.assertIn('1 conciliaciones marcadas como resueltas', self.cargar(con_dominio.encode('utf-8')))
+        self.assertEqual(
+            list(self.proceso.conciliaciones().filter(resuelto=True).values_list('dominio', 'rut')),
+            [('corp', fantasma.rut)]
+        )
+
+
+class ConciliarLoteTests(PruebaConArchivos):
+    """`manage.py conciliar`: pares en el pool de procesos y errores por par sin detener el lote"""
+
+    def conciliar(self, *argumentos):
+        with silenciado() as nulo:
+            call_command('conciliar', *argumentos, '--procesos', '1', stdout=nulo, stderr=nulo)
+
+    def test_concilia_pares(self):
+        salida = os.path.join(self.directorio_datos, 'resumen.json')
+        self.conciliar('--par', *self.archivos, '--par', *self.archivos, '--salida', salida)
+
+        procesos = ProcesoConciliacion.objects.filter(usuario__username='conciliacion_lote')
+        self.assertEqual(procesos.count(), 2)
+        self.assertTrue(all(p.estado == 'COMPLETADO' and p.conciliaciones_generadas for p in procesos))
+        with open(salida, encoding='utf-8') as archivo:
+            resumen = json.load(archivo)
+        self.assertEqual({r['proceso'] for r in resumen['pares']}, {str(p.id) for p in procesos})
+
+    def test_par_con_error(self):
+        with self.assertRaisesMessage(CommandError, 'No existe el archivo'):
+            self.conciliar('--par', 'no_existe.xlsx', self.archivos[1])
+        with self.assertRaisesMessage(CommandError, 'se esperaba'):
+            self.conciliar('--par', self.archivos[1], self.archivos[1])
+
+        # Una nómina ilegible falla sola: el otro par se guarda y no quedan archivos del fallido
+        nomina_corrupta = os.path.join(self.directorio_datos, 'corrupta.xlsx')
+        with open(nomina_corrupta, 'w') as archivo:
+            archivo.write('no es un Excel')
+        with self.assertRaisesMessage(CommandError, '1 pares con error'):
+            self.conciliar('--par', nomina_corrupta, self.archivos[1], '--par', *self.archivos)
+        self.assertEqual(ProcesoConciliacion.objects.count(), 1)
+        self.assertEqual(ArchivoCargado.objects.count(), 2)
+
+
+class BenchmarkTests(TestCase):
+    """`manage.py benchmark_conciliacion` sobre un conjunto sintético pequeño, con comparación entre ejecuciones"""
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp(prefix='benchmark_tests_')
+        self.addCleanup(shutil.rmtree, self.directorio, ignore_errors=True)
+
+    def medir(self, nombre, *argumentos):
+        salida = os.path.join(self.directorio, nombre)
+        consola = io.StringIO()
+        with silenciado():
+            call_command('benchmark_conciliacion', '--tamanos', '50', '120', '--sin-persistencia',
+                         '--directorio', self.directorio, '--salida', salida, *argumentos, stdout=consola)
+        with open(salida, encoding='utf-8') as f:
+            return json.load(f), consola.getvalue()
+
+    def test_mide_cada_etapa_y_compara(self):
+        reporte, _ = self.medir('base.json')
+        etapas = ['procesar_nomina', 'procesar_ad', 'conciliar', 'script_bloqueo', 'script_bloqueo_compacto']
+        self.assertEqual([(m['tamano'], m['etapa']) for m in reporte['resultados']],
+                         [(tamano, etapa) for tamano in (50, 120) for etapa in etapas])
+        for medicion in reporte['resultados']:
+            self.assertGreater(medicion['filas'], 0)
+            self.assertGreaterEqual(medicion['segundos'], 0)
+        self.assertEqual(reporte['semilla'], 2025)
+
+        # Misma semilla: mismos archivos y mismas filas; --comparar muestra la variación
+        otro, consola = self.medir('otro.json', '--comparar', os.path.join(self.directorio, 'base.json'))
+        self.assertEqual([m['filas'] for m in otro['resultados']], [m['filas'] for m in reporte['resultados']])
+        self.assertIn('variación', consola)
+
+
+class ArranqueTests(TestCase):
+    """Un worker (aplicación WSGI + URLconf con todas las vistas) arranca sin cargar pandas ni numpy"""
+
+    def test_vistas_sin_pandas(self):
+        directorio = tempfile.mkdtemp(prefix='arranque_tests_')
+        self.addCleanup(shutil.rmtree, directorio, ignore_errors=True)
+        salida = os.path.join(directorio, 'arranque.json')
+        call_command('benchmark_arranque', '--repeticiones', '1', '--salida', salida, stdout=io.StringIO())
+        with open(salida, encoding='utf-8') as f:
+            reporte = json.load(f)
+        self.assertEqual(reporte['modulos_cargados'], {'pandas': False, 'numpy': False, 'openpyxl': False})
+        self.assertEqual([r['etapa'] for r in reporte['resultados']], ['manage_check', 'arranque_worker'])
+
+
+class PerfilamientoTests(PruebaConArchivos):
+    """Middleware de perfilamiento: solo staff a pedido, por tasa para todos y con el cuerpo streaming incluido"""
+
+    def setUp(self):
+        super().setUp()
+        self.directorio = tempfile.mkdtemp(prefix='perfiles_tests_')
+        self.addCleanup(shutil.rmtree, self.directorio, ignore_errors=True)
+        ajustes = override_settings(PERFILAMIENTO_DIRECTORIO=self.directorio, PERFILAMIENTO_TASA_MUESTREO=0.0)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+    def archivo_perfil(self, respuesta):
+        perfil = PerfilSolicitud.objects.get(id=respuesta['X-Perfil-Id'])
+        ruta = os.path.join(self.directorio, perfil.archivo)
+        self.assertTrue(os.path.exists(ruta))  # Una solicitud breve puede no alcanzar a tomar muestras
+        return perfil, ruta
+
+    def test_solo_staff_a_pedido(self):
+        with silenciado():
+            respuesta = self.client.get(reverse('historial_procesos'), {'perfilar': '1'})
+        self.assertFalse(respuesta.has_header('X-Perfil-Id'))
+        self.assertFalse(PerfilSolicitud.objects.exists())
+
+        self.usuario = self.iniciar_sesion('soporte', is_staff=True)
+        with silenciado():
+            sin_pedido = self.client.get(reverse('historial_procesos'))
+            cprofile = self.client.get(reverse('historial_procesos'), {'perfilar': '1'})
+            muestreo = self.client.get(reverse('historial_procesos'), HTTP_X_PERFILAR='muestreo')
+        self.assertFalse(sin_pedido.has_header('X-Perfil-Id'))
+
+        perfil, ruta = self.archivo_perfil(cprofile)
+        self.assertEqual((perfil.modo, perfil.origen, perfil.usuario), ('CPROFILE', 'SOLICITADO', self.usuario))
+        self.assertIn('historial_procesos', {funcion for _, _, funcion in pstats.Stats(ruta).stats})
+        perfil, ruta = self.archivo_perfil(muestreo)
+        self.assertTrue(ruta.endswith('.collapsed'))
+
+    def test_tasa_de_muestreo(self):
+        with override_settings(PERFILAMIENTO_TASA_MUESTREO=1.0), silenciado():
+            respuesta = self.client.get(reverse('historial_procesos'))
+        perfil, _ = self.archivo_perfil(respuesta)
+        self.assertEqual((perfil.modo, perfil.origen), ('MUESTREO', 'MUESTREO'))
+
+    @override_settings(SCRIPTS_COMPRIMIR=False)
+    def test_respuesta_streaming(self):
+        proceso = self.sembrar_proceso(*self.archivos)
+        with silenciado():
+            script = obtener_o_generar_script(proceso, 'BLOQUEO_MASIVO', True, True, self.usuario)
+        self.usuario = self.iniciar_sesion('soporte', is_staff=True, is_superuser=True)
+        ProcesoConciliacion.objects.filter(id=proceso.id).update(usuario=self.usuario)
+
+        with silenciado():
+            respuesta = self.client.get(reverse('descargar_script', args=[script.id]), {'perfilar': '1'})
+            # El perfil se guarda al agotar el cuerpo, que se genera después de la vista
+            self.assertFalse(PerfilSolicitud.objects.exists())
+            b''.join(respuesta.streaming_content)
+        perfil, ruta = self.archivo_perfil(respuesta)
+        self.assertIn('iter_contenido', {funcion for _, _, funcion in pstats.Stats(ruta).stats})
+
+        # El admin enlaza la descarga del archivo
+        with silenciado():
+            listado = self.client.get(reverse('admin:conciliacion_app_perfilsolicitud_changelist'))
+            descarga = self.client.get(reverse('descargar_perfil', args=[perfil.id]))
+        self.assertContains(listado, reverse('descargar_perfil', args=[perfil.id]))
+        self.assertEqual(b''.join(descarga.streaming_content), open(ruta, 'rb').read())
+
+
+class MetricasTests(PruebaConArchivos):
+    """Endpoint /metricas/: formato de texto de Prometheus, colas leídas de la base e IPs permitidas"""
+
+    def exponer(self, **extra):
+        with silenciado():
+            return self.client.get(reverse('metricas'), **extra)
+
+    def test_formato_y_colas(self):
+        for i, estado in enumerate(['PENDIENTE', 'PENDIENTE', 'PROCESANDO', 'COMPLETADO']):
+            EntradaCarpeta.objects.create(firma=str(i), periodo='2025-11', ruta_nomina='n', ruta_ad='a', estado=estado)
+        CargaFragmentada.objects.create(usuario=self.usuario, tipo_archivo='AD', nombre_original='ad.csv',
+                                        tamano_total=10, tamano_fragmento=5)
+
+        respuesta = self.exponer()
+        self.assertEqual(respuesta['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        lineas = respuesta.content.decode('utf-8').splitlines()
+        self.assertIn('# TYPE conciliacion_cola_carpeta gauge', lineas)
+        self.assertIn('conciliacion_cola_carpeta{estado="PENDIENTE"} 2', lineas)
+        self.assertIn('conciliacion_cola_carpeta{estado="PROCESANDO"} 1', lineas)
+        self.assertIn('conciliacion_cargas_en_curso 1', lineas)
+        self.assertIn('# TYPE conciliacion_vista_latencia_segundos histogram', lineas)
+
+        self.assertEqual(self.exponer(REMOTE_ADDR='10.1.2.3').status_code, 403)
+
+    def test_resultados_por_categoria(self):
+        antes = dict(metricas.RESULTADOS._valores)
+        proceso = self.sembrar_proceso(*self.archivos)
+        por_categoria = {
+            (fila['categoria'],): fila['total']
+            for fila in proceso.conciliaciones().order_by().values('categoria').annotate(total=Count('id'))
+        }
+        self.assertIn(('OK_ACTIVO',), por_categoria)  # Cada categoría con su nombre, sin agrupar los OK
+        self.assertEqual(
+            {clave: valor - antes.get(clave, 0) for clave, valor in metricas.RESULTADOS._valores.items()
+             if valor != antes.get(clave, 0)},
+            por_categoria
+        )
+
+    def test_histograma(self):
+        histograma = metricas.Histograma('prueba_segundos', 'Prueba', etiquetas=('vista',), buckets=(0.1, 1))
+        for valor in (0.05, 0.1, 0.5, 3):
+            histograma.observar(valor, vista='a"b')
+        self.assertEqual(histograma.exponer(), [
+            '# HELP prueba_segundos Prueba',
+            '# TYPE prueba_segundos histogram',
+            'prueba_segundos_bucket{vista="a\\"b",le="0.1"} 2',
+            'prueba_segundos_bucket{vista="a\\"b",le="1"} 3',
+            'prueba_segundos_bucket{vista="a\\"b",le="+Inf"} 4',
+            'prueba_segundos_sum{vista="a\\"b"} 3.65',
+            'prueba_segundos_count{vista="a\\"b"} 4',
+        ])
@@ -19,15 +19,30 @@ urlpatterns = [
     # Proceso de carga y procesamiento de archivos
     path('subir/', views.subir_archivos, name='subir_archivos'),
     
+    # Carga fragmentada y reanudable de archivos grandes
+    path('cargas/', views.iniciar_carga, name='iniciar_carga'),
+    path('cargas/finalizar/', views.finalizar_cargas, name='finalizar_cargas'),
+    path('cargas/<uuid:carga_id>/', views.estado_carga, name='estado_carga'),
+    path('cargas/<uuid:carga_id>/fragmentos/<int:numero>/', views.subir_fragmento, name='subir_fragmento'),
+    
     # resultados
     path('resultados/<uuid:proceso_id>/', views.ver_resultados, name='ver_resultados'),
     path('marcar-resuelto/<uuid:conciliacion_id>/', views.marcar_resuelto, name='marcar_resuelto'),
+    path('resultados/<uuid:proceso_id>/cargar-log/', views.cargar_log_ejecucion, name='cargar_log_ejecucion'),
     
     # Generar script PowerShell
     path('generar-script/<uuid:proceso_id>/', views.generar_script_powershell, name='generar_script'),
+    path('scripts/<uuid:script_id>/descargar/', views.descargar_script, name='descargar_script'),
     
     # Historial
     path('historial/', views.historial_procesos, name='historial_procesos'),
+    path('ruts/<str:rut>/historial/', views.historial_rut, name='historial_rut'),
+
+    # Perfiles de rendimiento (staff, enlazados desde el admin)
+    path('perfiles/<uuid:perfil_id>/descargar/', views.descargar_perfil, name='descargar_perfil'),
+
+    # Métricas para Prometheus
+    path('metricas/', views.exponer_metricas, name='metricas'),
 
     # Ruta de prueba para carga de archivos
     path('prueba/', views.prueba_upload, name='prueba_upload'),
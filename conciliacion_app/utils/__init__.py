@@ -3,15 +3,24 @@ from .procesadores import (
     NormalizadorRUT,
     ProcesadorExcelNomina,
     ProcesadorTXTAD,
-    Conciliador
+    ProcesadorLogEjecucion,
+    Conciliador,
+    EmpleadoProcesado,
+    CuentaProcesada
 )
 
-from .generadores import GeneradorScriptsPowershell
+from .generadores import GeneradorScriptsPowershell, construir_indice_cuentas
+from .perfilador import MuestreadorPilas
 
 __all__ = [
     'NormalizadorRUT',
     'ProcesadorExcelNomina', 
     'ProcesadorTXTAD',
+    'ProcesadorLogEjecucion',
     'Conciliador',
-    'GeneradorScriptsPowershell'
+    'EmpleadoProcesado',
+    'CuentaProcesada',
+    'GeneradorScriptsPowershell',
+    'construir_indice_cuentas',
+    'MuestreadorPilas'
 ]
\ No newline at end of file
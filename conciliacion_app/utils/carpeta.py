@@ -0,0 +1,135 @@
+# conciliacion_app/utils/carpeta.py
+"""
+Detección de archivos nuevos en la carpeta de entrada (manage.py vigilar_carpeta).
+
+Los archivos solo se observan con stat(): tamaño y mtime. Un archivo se
+considera listo cuando ambos no cambian durante `segundos_estable`, y recién
+entonces se empareja; nunca se abre un archivo para saber si cambió.
+
+Nómina y export AD se emparejan por el período (mes y año) que aparece en el
+nombre, p. ej. 'ALTAS_Y_BAJAS_-_NOVIEMBRE_2025.xlsx' con 'ad_2025-11.csv'.
+"""
+import os
+import re
+import time
+import unicodedata
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+_MESES = {
+    'enero': 1, 'febrero': 2, 'marzo': 3, 'abril': 4, 'mayo': 5, 'junio': 6,
+    'julio': 7, 'agosto': 8, 'septiembre': 9, 'setiembre': 9, 'octubre': 10,
+    'noviembre': 11, 'diciembre': 12,
+    'ene': 1, 'feb': 2, 'mar': 3, 'abr': 4, 'may': 5, 'jun': 6, 'jul': 7,
+    'ago': 8, 'sep': 9, 'set': 9, 'oct': 10, 'nov': 11, 'dic': 12,
+}
+_NOMBRES_MES = '|'.join(sorted(_MESES, key=len, reverse=True))
+
+# Mes por nombre seguido del año, año-mes numérico y mes-año numérico
+_PATRON_MES_NOMBRE = re.compile(rf'(?<![a-z])({_NOMBRES_MES})(?![a-z])[^a-z0-9]*(20\d{{2}})(?!\d)')
+_PATRON_ANO_MES = re.compile(r'(?<!\d)(20\d{2})[-_. ]?(0[1-9]|1[0-2])(?!\d)')
+_PATRON_MES_ANO = re.compile(r'(?<!\d)(0[1-9]|1[0-2])[-_. ](20\d{2})(?!\d)')
+
+# Temporales de Office, ocultos y archivos que otro proceso aún está copiando
+_PREFIJOS_IGNORADOS = ('.', '~$')
+_SUFIJOS_IGNORADOS = ('.tmp', '.part', '.crdownload', '.partial')
+
+
+class ArchivoObservado(NamedTuple):
+    nombre: str
+    ruta: str
+    tamano: int
+    mtime_ns: int
+
+
+def periodo_desde_nombre(nombre: str) -> Optional[str]:
+    """'ALTAS_Y_BAJAS_-_NOVIEMBRE_2025.xlsx' -> '2025-11'; None si no hay período"""
+    base = unicodedata.normalize('NFKD', os.path.splitext(nombre)[0])
+    base = ''.join(c for c in base if not unicodedata.combining(c)).lower()
+    
+    coincidencia = _PATRON_MES_NOMBRE.search(base)
+    if coincidencia:
+        return f'{coincidencia.group(2)}-{_MESES[coincidencia.group(1)]:02d}'
+    coincidencia = _PATRON_ANO_MES.search(base)
+    if coincidencia:
+        return f'{coincidencia.group(1)}-{coincidencia.group(2)}'
+    coincidencia = _PATRON_MES_ANO.search(base)
+    if coincidencia:
+        return f'{coincidencia.group(2)}-{coincidencia.group(1)}'
+    return None
+
+
+class DetectorEstabilidad:
+    """
+    Recorre un directorio con os.scandir y recuerda (tamaño, mtime) de cada
+    archivo entre recorridos. Solo usa la información de stat, nunca lee el
+    contenido.
+    """
+    
+    def __init__(self, directorio, segundos_estable, reloj=time.monotonic):
+        self.directorio = directorio
+        self.segundos_estable = segundos_estable
+        self.reloj = reloj
+        self._vistos: Dict[str, Tuple[int, int, float]] = {}  # nombre -> (tamaño, mtime_ns, desde)
+    
+    def recorrer(self) -> List[ArchivoObservado]:
+        """
+        Actualiza el estado y retorna los archivos cuyo tamaño y mtime no
+        cambian hace al menos `segundos_estable`
+        """
+        ahora = self.reloj()
+        actuales = {}
+        estables = []
+        with os.scandir(self.directorio) as entradas:
+            for entrada in entradas:
+                nombre = entrada.name
+                if nombre.startswith(_PREFIJOS_IGNORADOS) or nombre.lower().endswith(_SUFIJOS_IGNORADOS):
+                    continue
+                try:
+                    if not entrada.is_file():
+                        continue
+                    stat = entrada.stat()
+                except FileNotFoundError:
+                    continue  # Se movió o eliminó durante el recorrido
+                
+                firma = (stat.st_size, stat.st_mtime_ns)
+                anterior = self._vistos.get(nombre)
+                desde = anterior[2] if anterior and anterior[:2] == firma else ahora
+                actuales[nombre] = (*firma, desde)
+                if stat.st_size > 0 and ahora - desde >= self.segundos_estable:
+                    estables.append(ArchivoObservado(nombre, entrada.path, *firma))
+        
+        self._vistos = actuales
+        return estables
+
+
+def emparejar(archivos, patron_nomina, patron_ad):
+    """
+    Agrupa los archivos por período y retorna {periodo: (nomina, ad)} para
+    los períodos que tienen ambos. Si hay más de un candidato del mismo tipo
+    para un período se usa el de mtime más reciente. Los archivos que no
+    calzan con ningún patrón o sin período en el nombre se omiten.
+    """
+    patron_nomina = re.compile(patron_nomina)
+    patron_ad = re.compile(patron_ad)
+    nominas: Dict[str, ArchivoObservado] = {}
+    cuentas: Dict[str, ArchivoObservado] = {}
+    
+    for archivo in archivos:
+        if patron_nomina.search(archivo.nombre):
+            destino = nominas
+        elif patron_ad.search(archivo.nombre):
+            destino = cuentas
+        else:
+            continue
+        periodo = periodo_desde_nombre(archivo.nombre)
+        if periodo is None:
+            continue
+        actual = destino.get(periodo)
+        if actual is None or archivo.mtime_ns > actual.mtime_ns:
+            destino[periodo] = archivo
+    
+    return {
+        periodo: (nomina, cuentas[periodo])
+        for periodo, nomina in sorted(nominas.items())
+        if periodo in cuentas
+    }
@@ -0,0 +1,128 @@
+# conciliacion_app/utils/datos_sinteticos.py
+import csv
+import os
+import random
+from typing import List, Optional, Tuple
+
+from .rut import digito_verificador
+
+NOMBRES = ['Juan', 'María', 'José', 'Ana', 'Luis', 'Carmen', 'Pedro', 'Rosa', 'Diego', 'Camila',
+           'Jorge', 'Valentina', 'Felipe', 'Francisca', 'Cristián', 'Javiera', 'Matías', 'Daniela']
+APELLIDOS = ['González', 'Muñoz', 'Rojas', 'Díaz', 'Pérez', 'Soto', 'Contreras', 'Silva', 'Martínez',
+             'Sepúlveda', 'Morales', 'Rodríguez', 'López', 'Fuentes', 'Hernández', 'Torres', 'Araya']
+DEPARTAMENTOS = ['Operaciones', 'Finanzas', 'RRHH', 'TI', 'Comercial', 'Logística', 'Gerencia']
+CARGOS = ['Analista', 'Jefe de Área', 'Asistente', 'Técnico', 'Supervisor', 'Operario', 'Ingeniero']
+ESTADOS_ACTIVO = ['ACTIVO', 'Activo', 'activo ', 'ACTIVO']
+ESTADOS_INACTIVO = ['INACTIVO', 'Inactivo', 'inactivo']
+CUENTAS_SERVICIO = ['Administrator', 'Guest', 'krbtgt', 'DefaultAccount', 'svc_backup', 'svc_sql', 'svc_web']
+
+
+class GeneradorDatosSinteticos:
+    """
+    Genera pares nómina (Excel) / exportación AD (Export-Csv) deterministas
+    para benchmarks: misma semilla y tamaño producen los mismos archivos.
+    
+    Incluye el ruido que aparece en los archivos reales: RUTs repetidos con
+    estados distintos, estados con mayúsculas/espacios variables, RUTs con
+    puntos, sin guion o con espacios, cuentas de servicio sin RUT, cuentas
+    con el RUT solo en el nombre de usuario y personas con varias cuentas.
+    """
+    
+    def __init__(self, semilla: int = 2025):
+        self.semilla = semilla
+    
+    def generar_par(self, directorio: str, filas: int) -> Tuple[str, str]:
+        """Genera (o reutiliza) nómina y AD de `filas` registros cada uno"""
+        os.makedirs(directorio, exist_ok=True)
+        ruta_nomina = os.path.join(directorio, f'nomina_{filas}_{self.semilla}.xlsx')
+        ruta_ad = os.path.join(directorio, f'ad_{filas}_{self.semilla}.csv')
+        
+        if not (os.path.exists(ruta_nomina) and os.path.exists(ruta_ad)):
+            rng = random.Random(f'{self.semilla}-{filas}')
+            empleados, fantasmas = self._poblacion(rng, filas)
+            self._escribir_nomina(rng, ruta_nomina, empleados, filas)
+            self._escribir_ad(rng, ruta_ad, empleados, fantasmas, filas)
+        
+        return ruta_nomina, ruta_ad
+    
+    def _poblacion(self, rng: random.Random, filas: int) -> Tuple[List[int], List[int]]:
+        """RUTs de empleados (90% de las filas de nómina) y de fantasmas (sin nómina)"""
+        total_empleados = max(1, int(filas * 0.9))
+        total_fantasmas = max(1, int(filas * 0.2))
+        numeros = rng.sample(range(5_000_000, 26_000_000), total_empleados + total_fantasmas)
+        return numeros[:total_empleados], numeros[total_empleados:]
+    
+    def _rut_con_ruido(self, rng: random.Random, numero: int) -> str:
+        """RUT en alguno de los formatos que aparecen en los archivos"""
+        dv = digito_verificador(numero)
+        formato = rng.random()
+        if formato < 0.4:
+            return f'{numero:,}'.replace(',', '.') + f'-{dv}'
+        if formato < 0.7:
+            return f'{numero}-{dv}'
+        if formato < 0.85:
+            return f'{numero}{dv.lower()}'
+        return f' {numero} - {dv} '
+    
+    def _nombre(self, rng: random.Random) -> str:
+        return f'{rng.choice(NOMBRES)} {rng.choice(APELLIDOS)} {rng.choice(APELLIDOS)}'
+    
+    def _escribir_nomina(self, rng: random.Random, ruta: str, empleados: List[int], filas: int):
+        """Excel de nómina; ~10% de filas repiten un RUT, a veces con otro estado"""
+        from openpyxl import Workbook
+        
+        libro = Workbook(write_only=True)
+        hoja = libro.create_sheet('Nomina')
+        hoja.append(['RUT', 'Nombre Completo', 'Estado', 'Departamento', 'Cargo'])
+        
+        for i in range(filas):
+            numero = empleados[i] if i < len(empleados) else rng.choice(empleados)
+            estados = ESTADOS_ACTIVO if rng.random() < 0.75 else ESTADOS_INACTIVO
+            hoja.append([
+                self._rut_con_ruido(rng, numero),
+                self._nombre(rng),
+                rng.choice(estados),
+                rng.choice(DEPARTAMENTOS),
+                rng.choice(CARGOS),
+            ])
+        
+        libro.save(ruta)
+    
+    def _escribir_ad(self, rng: random.Random, ruta: str, empleados: List[int],
+                     fantasmas: List[int], filas: int):
+        """Exportación AD tipo Export-Csv -NoTypeInformation"""
+        with open(ruta, 'w', encoding='utf-8', newline='') as f:
+            escritor = csv.writer(f, quoting=csv.QUOTE_ALL)
+            escritor.writerow(['Name', 'SamAccountName', 'RUT', 'Enabled', 'mail'])
+            
+            for i in range(filas):
+                tipo = rng.random()
+                numero: Optional[int]
+                if i < len(CUENTAS_SERVICIO) or tipo < 0.05:
+                    # Cuenta de servicio, sin RUT
+                    numero = None
+                    usuario = CUENTAS_SERVICIO[i] if i < len(CUENTAS_SERVICIO) else f'svc_app{i}'
+                elif tipo < 0.25:
+                    numero = rng.choice(fantasmas)
+                    usuario = f'u{numero}'
+                else:
+                    numero = rng.choice(empleados)
+                    # Algunas personas tienen una segunda cuenta administrativa
+                    usuario = f'adm{numero}' if tipo > 0.95 else f'u{numero}'
+                
+                nombre = self._nombre(rng)
+                rut = ''
+                if numero is not None:
+                    if rng.random() < 0.1:
+                        # RUT solo en el nombre de usuario
+                        usuario = f'{nombre.split()[0].lower()}.{numero}'
+                    else:
+                        rut = self._rut_con_ruido(rng, numero)
+                
+                escritor.writerow([
+                    nombre,
+                    usuario,
+                    rut,
+                    'True' if rng.random() < 0.9 else 'False',
+                    f'{usuario}@empresa.local' if numero is not None else '',
+                ])
@@ -1,38 +1,274 @@
 # conciliacion_app/utils/generadores.py
 from datetime import datetime
-from typing import List, Dict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .rut import clave_rut
+
+CATEGORIAS_ACCION = ['FANTASMA_TOTAL', 'INACTIVO_CON_CUENTA']
+
+
+def agrupar_trozos(trozos: Iterable[str], tamano: int = 64 * 1024) -> Iterator[bytes]:
+    """Agrupa trozos pequeños en bloques de ~`tamano` bytes para la respuesta HTTP"""
+    buffer = []
+    acumulado = 0
+    for trozo in trozos:
+        datos = trozo.encode('utf-8')
+        buffer.append(datos)
+        acumulado += len(datos)
+        if acumulado >= tamano:
+            yield b''.join(buffer)
+            buffer = []
+            acumulado = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def construir_indice_cuentas(pares: Iterable[Tuple[Tuple[str, str], str]]) -> Dict[Tuple[str, str], List[str]]:
+    """
+    Construye índice (dominio, RUT) -> [SamAccountName, ...] a partir de pares
+    ((dominio, clave_rut), usuario). Un RUT puede tener varias cuentas en un
+    dominio; se conservan todas, sin repetir. Sin varios dominios, dominio es ''.
+    """
+    indice = {}
+    for rut, usuario in pares:
+        cuentas = indice.setdefault(rut, [])
+        if usuario not in cuentas:
+            cuentas.append(usuario)
+    return indice
+
+
+# Escape RFC 4515 de un valor dentro de un filtro LDAP: un SamAccountName con
+# paréntesis, asteriscos o barras no debe alterar la consulta del lote. La
+# barra va primero para no volver a escapar los escapes. Se define dentro de
+# los bucles porque los fragmentos paralelos no ven las funciones del script.
+_ESCAPAR_LDAP_PS = r"""function Escapar-LDAP([string]$Valor) {
+    $Valor.Replace('\', '\5c').Replace('*', '\2a').Replace('(', '\28').Replace(')', '\29').Replace([string][char]0, '\00')
+}
+
+"""
+
+
+# Bucle por lotes compartido por el modo compacto secuencial y por cada
+# fragmento paralelo. Espera $Objetivos, $Servidores, $ArchivoLog, $ModoSeguro,
+# $TamanoLote y $Descripcion; deja $totalOk y $totalErrores. Las cuentas se
+# identifican por dominio y SamAccountName.
+_BUCLE_LOTES_PS = _ESCAPAR_LDAP_PS + """# Reanudación: se omiten las cuentas ya procesadas con éxito según el log
+if (-not $ModoSeguro -and (Test-Path $ArchivoLog)) {
+    $procesadas = New-Object 'System.Collections.Generic.HashSet[string]'
+    Import-Csv $ArchivoLog | Where-Object { $_.Resultado -eq "OK" } | ForEach-Object { [void]$procesadas.Add("$($_.Dominio)|$($_.SamAccountName)") }
+    $Objetivos = @($Objetivos | Where-Object { -not $procesadas.Contains("$($_.Dominio)|$($_.SamAccountName)") })
+    Write-Host "Reanudando: $($procesadas.Count) cuentas ya procesadas en $ArchivoLog" -ForegroundColor Cyan
+}
+
+$totalOk = 0
+$totalErrores = 0
+for ($inicio = 0; $inicio -lt $Objetivos.Count; $inicio += $TamanoLote) {
+    $fin = [Math]::Min($inicio + $TamanoLote, $Objetivos.Count) - 1
+    $lote = $Objetivos[$inicio..$fin]
+    $registros = New-Object System.Collections.Generic.List[object]
+    
+    # Una sola consulta LDAP por lote y dominio, contra el servidor del dominio
+    $encontrados = @{}
+    $erroresLote = @{}
+    foreach ($grupo in ($lote | Group-Object Dominio)) {
+        $servidor = if ($grupo.Name -and $Servidores[$grupo.Name]) { @{ Server = $Servidores[$grupo.Name] } } else { @{} }
+        $filtro = "(|" + (($grupo.Group | ForEach-Object { "(sAMAccountName=$(Escapar-LDAP $_.SamAccountName))" }) -join "") + ")"
+        try {
+            Get-ADUser -LDAPFilter $filtro -Properties Description @servidor | ForEach-Object { $encontrados["$($grupo.Name)|$($_.SamAccountName)"] = $_ }
+        } catch {
+            $erroresLote[$grupo.Name] = $_.Exception.Message
+        }
+    }
+    
+    foreach ($obj in $lote) {
+        $servidor = if ($obj.Dominio -and $Servidores[$obj.Dominio]) { @{ Server = $Servidores[$obj.Dominio] } } else { @{} }
+        $cuenta = $encontrados["$($obj.Dominio)|$($obj.SamAccountName)"]
+        $errorLote = $erroresLote[$obj.Dominio]
+        $mensaje = ""
+        # Estado previo al cambio, usado por el script ROLLBACK
+        $previo = if ($cuenta) {
+            @{ Enabled = $cuenta.Enabled; Description = $cuenta.Description; OU = ($cuenta.DistinguishedName -replace '^CN=.+?(?<!\\\\),', '') }
+        } else { @{ Enabled = ""; Description = ""; OU = "" } }
+        if ($errorLote) {
+            $mensaje = $errorLote
+        } elseif (-not $cuenta) {
+            $mensaje = "No encontrada en AD"
+        } else {
+            $erroresCuenta = @()
+            $cuenta | Disable-ADAccount @servidor -WhatIf:$ModoSeguro -Confirm:$false -ErrorAction SilentlyContinue -ErrorVariable erroresCuenta
+            $cuenta | Set-ADUser @servidor -Description "$Descripcion - $($obj.Motivo)" -WhatIf:$ModoSeguro -ErrorAction SilentlyContinue -ErrorVariable +erroresCuenta
+            if ($erroresCuenta.Count -gt 0) { $mensaje = $erroresCuenta[0].Exception.Message }
+        }
+        $resultado = if ($mensaje) { "ERROR" } else { "OK" }
+        if ($mensaje) { $totalErrores++ } else { $totalOk++ }
+        $registros.Add([pscustomobject]@{
+            SamAccountName = $obj.SamAccountName; Rut = $obj.Rut; Motivo = $obj.Motivo; Dominio = $obj.Dominio
+            Resultado = $resultado; Error = $mensaje; Fecha = (Get-Date -Format s)
+            EnabledAnterior = $previo.Enabled; DescripcionAnterior = $previo.Description; OUAnterior = $previo.OU
+        })
+    }
+    
+    # Log por lote: permite reanudar si la ejecución se interrumpe
+    if (-not $ModoSeguro) {
+        $registros | Export-Csv -Path $ArchivoLog -Append -NoTypeInformation -Encoding UTF8
+    }
+    $erroresLote = @($registros | Where-Object { $_.Resultado -eq "ERROR" }).Count
+    if ($erroresLote -gt 0) {
+        Write-Host "  ✗ Lote $($inicio + 1)-$($fin + 1): $erroresLote errores" -ForegroundColor Red
+    }
+}"""
+
+
+# Bucle por lotes del script ROLLBACK. Espera $Objetivos, $Servidores,
+# $EstadoPrevio ("dominio|SamAccountName" -> fila del log de bloqueo),
+# $ArchivoLog y $ModoSeguro.
+_BUCLE_ROLLBACK_PS = _ESCAPAR_LDAP_PS + """$totalOk = 0
+$totalErrores = 0
+for ($inicio = 0; $inicio -lt $Objetivos.Count; $inicio += $TamanoLote) {
+    $fin = [Math]::Min($inicio + $TamanoLote, $Objetivos.Count) - 1
+    $lote = $Objetivos[$inicio..$fin]
+    $registros = New-Object System.Collections.Generic.List[object]
+    
+    # Una sola consulta LDAP por lote y dominio, contra el servidor del dominio
+    $encontrados = @{}
+    $erroresLote = @{}
+    foreach ($grupo in ($lote | Group-Object Dominio)) {
+        $servidor = if ($grupo.Name -and $Servidores[$grupo.Name]) { @{ Server = $Servidores[$grupo.Name] } } else { @{} }
+        $filtro = "(|" + (($grupo.Group | ForEach-Object { "(sAMAccountName=$(Escapar-LDAP $_.SamAccountName))" }) -join "") + ")"
+        try {
+            Get-ADUser -LDAPFilter $filtro @servidor | ForEach-Object { $encontrados["$($grupo.Name)|$($_.SamAccountName)"] = $_ }
+        } catch {
+            $erroresLote[$grupo.Name] = $_.Exception.Message
+        }
+    }
+    
+    foreach ($obj in $lote) {
+        $servidor = if ($obj.Dominio -and $Servidores[$obj.Dominio]) { @{ Server = $Servidores[$obj.Dominio] } } else { @{} }
+        $cuenta = $encontrados["$($obj.Dominio)|$($obj.SamAccountName)"]
+        $previo = $EstadoPrevio["$($obj.Dominio)|$($obj.SamAccountName)"]
+        $errorLote = $erroresLote[$obj.Dominio]
+        $mensaje = ""
+        if ($errorLote) {
+            $mensaje = $errorLote
+        } elseif (-not $cuenta) {
+            $mensaje = "No encontrada en AD"
+        } else {
+            $erroresCuenta = @()
+            if ($previo.EnabledAnterior -eq "True") {
+                $cuenta | Enable-ADAccount @servidor -WhatIf:$ModoSeguro -Confirm:$false -ErrorAction SilentlyContinue -ErrorVariable +erroresCuenta
+            }
+            if ($previo.DescripcionAnterior) {
+                $cuenta | Set-ADUser @servidor -Description $previo.DescripcionAnterior -WhatIf:$ModoSeguro -ErrorAction SilentlyContinue -ErrorVariable +erroresCuenta
+            } else {
+                $cuenta | Set-ADUser @servidor -Clear description -WhatIf:$ModoSeguro -ErrorAction SilentlyContinue -ErrorVariable +erroresCuenta
+            }
+            $ouActual = $cuenta.DistinguishedName -replace '^CN=.+?(?<!\\\\),', ''
+            if ($previo.OUAnterior -and $ouActual -ne $previo.OUAnterior) {
+                $cuenta | Move-ADObject @servidor -TargetPath $previo.OUAnterior -WhatIf:$ModoSeguro -Confirm:$false -ErrorAction SilentlyContinue -ErrorVariable +erroresCuenta
+            }
+            if ($erroresCuenta.Count -gt 0) { $mensaje = $erroresCuenta[0].Exception.Message }
+        }
+        $resultado = if ($mensaje) { "ERROR" } else { "OK" }
+        if ($mensaje) { $totalErrores++ } else { $totalOk++ }
+        $registros.Add([pscustomobject]@{
+            SamAccountName = $obj.SamAccountName; Rut = $obj.Rut; Dominio = $obj.Dominio
+            Resultado = $resultado; Error = $mensaje; Fecha = (Get-Date -Format s)
+        })
+    }
+    
+    if (-not $ModoSeguro) {
+        $registros | Export-Csv -Path $ArchivoLog -Append -NoTypeInformation -Encoding UTF8
+    }
+    $erroresLote = @($registros | Where-Object { $_.Resultado -eq "ERROR" }).Count
+    if ($erroresLote -gt 0) {
+        Write-Host "  ✗ Lote $($inicio + 1)-$($fin + 1): $erroresLote errores" -ForegroundColor Red
+    }
+}"""
+
 
 class GeneradorScriptsPowershell:
     """Genera scripts PowerShell para acciones en AD"""
     
+    def __init__(self, cuentas_por_rut: Optional[Dict[Tuple[str, str], List[str]]] = None,
+                 dominios: Iterable[str] = ()):
+        # Índice (dominio, RUT) -> cuentas AD reales del proceso (ver construir_indice_cuentas)
+        self.cuentas_por_rut = cuentas_por_rut or {}
+        # Dominios de un proceso multidominio: cada uno se consulta con su -Server
+        self.dominios = list(dominios)
+    
     def generar_script(self, conciliaciones: List[Dict], tipo_script: str, 
                        modo_seguro: bool = True, usuario: str = 'sistema') -> str:
         """
         Genera script PowerShell basado en conciliaciones
         """
+        return ''.join(self.generar_script_stream(
+            conciliaciones, tipo_script, modo_seguro=modo_seguro, usuario=usuario
+        ))
+    
+    def generar_script_stream(self, conciliaciones: Iterable[Dict], tipo_script: str,
+                              modo_seguro: bool = True, usuario: str = 'sistema',
+                              conteos: Optional[Dict[str, int]] = None,
+                              compacto: bool = False, fragmentos: int = 1) -> Iterator[str]:
+        """
+        Genera el script por trozos, pensado para StreamingHttpResponse.
+        
+        `conciliaciones` puede ser un iterador de un solo uso (queryset.iterator());
+        en ese caso hay que entregar `conteos` (cantidad por categoría) para
+        escribir la cabecera sin recorrer los datos dos veces. Si no se entregan,
+        las conciliaciones se materializan para contarlas.
+        
+        Con `compacto=True` el bloqueo masivo se genera en formato de datos:
+        la lista de cuentas va una sola vez como CSV y se procesa por lotes.
+        Con `fragmentos` > 1 (implica compacto) el script reparte las cuentas
+        en ese número de grupos que se ejecutan en paralelo.
+        """
         fecha = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         
-        if tipo_script == 'BLOQUEO_MASIVO':
-            return self._generar_script_bloqueo(conciliaciones, fecha, modo_seguro, usuario)
+        if conteos is None:
+            conciliaciones = list(conciliaciones)
+            conteos = self._contar_categorias(conciliaciones)
+        
+        if tipo_script == 'BLOQUEO_MASIVO' and (compacto or fragmentos > 1):
+            total = sum(conteos.get(cat, 0) for cat in CATEGORIAS_ACCION)
+            return self._generar_script_bloqueo_compacto(
+                self._objetivos(conciliaciones), total, fecha, modo_seguro, usuario,
+                fragmentos=fragmentos
+            )
+        elif tipo_script == 'BLOQUEO_MASIVO':
+            return self._generar_script_bloqueo(conciliaciones, conteos, fecha, modo_seguro, usuario)
+        elif tipo_script == 'ROLLBACK':
+            total = sum(conteos.get(cat, 0) for cat in CATEGORIAS_ACCION)
+            return self._generar_script_rollback(
+                self._objetivos(conciliaciones), total, fecha, modo_seguro, usuario
+            )
         elif tipo_script == 'REPORTE':
-            return self._generar_script_reporte(conciliaciones, fecha)
+            return self._generar_script_reporte(conciliaciones, conteos, fecha)
         else:
-            return self._generar_script_generico(conciliaciones, fecha, modo_seguro)
+            return self._generar_script_generico(conteos, fecha, modo_seguro)
+    
+    def _contar_categorias(self, conciliaciones: List[Dict]) -> Dict[str, int]:
+        """Cuenta conciliaciones por categoría"""
+        conteos = {}
+        for c in conciliaciones:
+            conteos[c['categoria']] = conteos.get(c['categoria'], 0) + 1
+        return conteos
     
-    def _generar_script_bloqueo(self, conciliaciones: List[Dict], fecha: str, 
-                                modo_seguro: bool, usuario: str) -> str:
+    def _generar_script_bloqueo(self, conciliaciones: Iterable[Dict], conteos: Dict[str, int],
+                                fecha: str, modo_seguro: bool, usuario: str) -> Iterator[str]:
         """Genera script para bloqueo masivo"""
         
         # Filtrar solo conciliaciones que requieren acción
-        conciliaciones_accion = [
+        conciliaciones_accion = (
             c for c in conciliaciones 
-            if c['categoria'] in ['FANTASMA_TOTAL', 'INACTIVO_CON_CUENTA']
-        ]
+            if c['categoria'] in CATEGORIAS_ACCION
+        )
+        total_accion = sum(conteos.get(cat, 0) for cat in CATEGORIAS_ACCION)
+        sello = fecha.replace('-', '').replace(':', '').replace(' ', '_')
         
-        script = f"""# Script generado automáticamente - Sistema Conciliación AD
+        yield f"""# Script generado automáticamente - Sistema Conciliación AD
 # Fecha: {fecha}
 # Usuario: {usuario}
-# Total cuentas a procesar: {len(conciliaciones_accion)}
+# Total cuentas a procesar: {total_accion}
 # Modo seguro: {'SI (comandos con -WhatIf)' if modo_seguro else 'NO (ejecución real)'}
 
 Import-Module ActiveDirectory
@@ -46,59 +282,89 @@ Write-Host ""
 # Configuración
 $OU_Deshabilitados = "OU=Usuarios Deshabilitados,DC=empresa,DC=local"
 $RutaReportes = "C:\\Reportes_AD\\"
+{self._servidores_ps()}
+function Servidor($Dominio) {{
+    if ($Dominio -and $Servidores[$Dominio]) {{ @{{ Server = $Servidores[$Dominio] }} }} else {{ @{{}} }}
+}}
 
 # Crear directorio de reportes si no existe
 if (-not (Test-Path $RutaReportes)) {{
     New-Item -ItemType Directory -Path $RutaReportes -Force | Out-Null
 }}
 
+# Log de resultados con el estado previo de cada cuenta (lo usa el script ROLLBACK)
+$ArchivoLog = Join-Path $RutaReportes "bloqueos_{sello}.csv"
+function Registrar-Resultado($SamAccountName, $Rut, $Motivo, $Dominio, $Resultado, $Mensaje, $Previo) {{
+    [pscustomobject]@{{
+        SamAccountName = $SamAccountName; Rut = $Rut; Motivo = $Motivo; Dominio = $Dominio
+        Resultado = $Resultado; Error = $Mensaje; Fecha = (Get-Date -Format s)
+        EnabledAnterior = $Previo.Enabled; DescripcionAnterior = $Previo.Description; OUAnterior = $Previo.OU
+    }} | Export-Csv -Path $ArchivoLog -Append -NoTypeInformation -Encoding UTF8
+}}
+
 """
 
         # Agregar comandos para cada cuenta
         for i, conc in enumerate(conciliaciones_accion, 1):
             rut = conc.get('rut', 'N/A')
             categoria = conc.get('categoria', '')
-            descripcion = conc.get('descripcion', '')
+            motivo = self._motivo(categoria)
             
-            # Extraer nombre de usuario del RUT o usar uno genérico
-            # En un sistema real, necesitarías mapear RUT a nombre de usuario AD
-            usuario_ad = self._rut_a_usuario_ad(rut)
+            usuarios_ad = self._usuarios_ad(conc)
+            if not usuarios_ad:
+                yield f"""
+# {i}. {rut} - {motivo}
+# Sin cuenta AD asociada a este RUT en la exportación; no se genera comando
+"""
+                continue
             
-            if usuario_ad:
-                motivo = "No existe en nómina RRHH" if categoria == 'FANTASMA_TOTAL' else "Inactivo en RRHH"
-                
-                script += f"""
+            # Un RUT puede tener varias cuentas en el dominio: se bloquean todas
+            rut_ps = self._escapar_ps(rut)
+            dominio_ps = self._escapar_ps(conc.get('dominio', ''))
+            for usuario_ad in map(self._escapar_ps, usuarios_ad):
+                bloque = f"""
 # {i}. {rut} - {motivo}
 Write-Host "Procesando: {usuario_ad} ({rut})" -ForegroundColor Yellow
-try {{
+$servidor = Servidor "{dominio_ps}"
 """
                 
                 if modo_seguro:
-                    script += f"""    # MODO SEGURO - Solo muestra qué haría
-    Disable-ADAccount -Identity "{usuario_ad}" -WhatIf
-    Set-ADUser -Identity "{usuario_ad}" -Description "BLOQUEADO_AUTO_{fecha[:10]} - {motivo}" -WhatIf
+                    bloque += f"""try {{
+    # MODO SEGURO - Solo muestra qué haría
+    Disable-ADAccount -Identity "{usuario_ad}" @servidor -WhatIf
+    Set-ADUser -Identity "{usuario_ad}" @servidor -Description "BLOQUEADO_AUTO_{fecha[:10]} - {motivo}" -WhatIf
     Write-Host "  [MODO SEGURO] Se deshabilitaría: {usuario_ad}" -ForegroundColor Gray
+}} catch {{
+    Write-Host "  ✗ Error: $_" -ForegroundColor Red
+}}
 """
                 else:
-                    script += f"""    # MODO EJECUCIÓN - Realiza cambios reales
-    Disable-ADAccount -Identity "{usuario_ad}" -Confirm:$false
-    Set-ADUser -Identity "{usuario_ad}" -Description "BLOQUEADO_AUTO_{fecha[:10]} - {motivo}"
+                    # Se lee el estado previo antes del cambio y se registra en el log
+                    bloque += f"""$previo = $null
+try {{
+    # MODO EJECUCIÓN - Realiza cambios reales
+    $cuenta = Get-ADUser -Identity "{usuario_ad}" -Properties Description @servidor
+    $previo = @{{ Enabled = $cuenta.Enabled; Description = $cuenta.Description; OU = ($cuenta.DistinguishedName -replace '^CN=.+?(?<!\\\\),', '') }}
+    $cuenta | Disable-ADAccount @servidor -Confirm:$false -ErrorAction Stop
+    $cuenta | Set-ADUser @servidor -Description "BLOQUEADO_AUTO_{fecha[:10]} - {motivo}" -ErrorAction Stop
     Write-Host "  ✓ Cuenta deshabilitada: {usuario_ad}" -ForegroundColor Green
-"""
-                
-                script += f"""}} catch {{
+    Registrar-Resultado "{usuario_ad}" "{rut_ps}" "{motivo}" "{dominio_ps}" "OK" "" $previo
+}} catch {{
     Write-Host "  ✗ Error: $_" -ForegroundColor Red
+    Registrar-Resultado "{usuario_ad}" "{rut_ps}" "{motivo}" "{dominio_ps}" "ERROR" "$_" $previo
 }}
 """
+                
+                yield bloque
         
         # Agregar reporte final
-        script += f"""
+        yield f"""
 # ========================================
 # REPORTE FINAL
 # ========================================
 Write-Host "`n========================================" -ForegroundColor Green
 Write-Host "PROCESO COMPLETADO" -ForegroundColor Green
-Write-Host "Total cuentas procesadas: {len(conciliaciones_accion)}" -ForegroundColor Green
+Write-Host "Total cuentas procesadas: {total_accion}" -ForegroundColor Green
 Write-Host "========================================" -ForegroundColor Green
 
 # Generar reporte
@@ -108,7 +374,9 @@ $archivoReporte = "$RutaReportes\\bloqueos_$fechaReporte.csv"
 if ({'$true' if modo_seguro else '$false'}) {{
     Write-Host "`n[INFORMACIÓN] En modo ejecución real, se generaría reporte en: $archivoReporte" -ForegroundColor Cyan
 }} else {{
-    Get-ADUser -Filter {{Enabled -eq $false}} -Properties Description,LastLogonDate,Created,Modified |
+    # Cuentas deshabilitadas de cada dominio del proceso (o del dominio del equipo)
+    $consultas = if ($Servidores.Count) {{ @($Servidores.Values | ForEach-Object {{ @{{ Server = $_ }} }}) }} else {{ @(@{{}}) }}
+    $consultas | ForEach-Object {{ $servidor = $_; Get-ADUser -Filter {{Enabled -eq $false}} -Properties Description,LastLogonDate,Created,Modified @servidor }} |
         Select-Object SamAccountName,Name,Description,LastLogonDate,Created,Modified |
         Export-Csv -Path $archivoReporte -NoTypeInformation -Encoding UTF8
     
@@ -117,15 +385,244 @@ if ({'$true' if modo_seguro else '$false'}) {{
 
 Write-Host "`nNota: Revise el reporte antes de cualquier acción permanente." -ForegroundColor Magenta
 """
+    
+    def generar_scripts_fragmentados(self, conciliaciones: Iterable[Dict], fragmentos: int,
+                                     modo_seguro: bool = True,
+                                     usuario: str = 'sistema') -> Iterator[Tuple[str, Iterator[str]]]:
+        """
+        Reparte las cuentas objetivo en `fragmentos` grupos balanceados (la
+        diferencia de tamaño es a lo más 1) y entrega (nombre_archivo, trozos)
+        por cada uno. Cada fragmento es un script compacto independiente con
+        su propio log de resultados, para ejecutarlos en paralelo.
+        """
+        fecha = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        objetivos = list(self._objetivos(conciliaciones))
+        fragmentos = max(1, min(fragmentos, len(objetivos) or 1))
+        
+        for k in range(fragmentos):
+            parte = objetivos[k::fragmentos]
+            etiqueta = f"f{k + 1}de{fragmentos}"
+            yield (
+                f"bloqueo_ad_{etiqueta}.ps1",
+                self._generar_script_bloqueo_compacto(
+                    parte, len(parte), fecha, modo_seguro, usuario, etiqueta=etiqueta
+                ),
+            )
+    
+    def _objetivos(self, conciliaciones: Iterable[Dict]) -> Iterator[Tuple[str, str, str, str]]:
+        """Cuentas a bloquear como (SamAccountName, RUT, motivo, dominio); una por cuenta AD"""
+        for conc in conciliaciones:
+            if conc['categoria'] not in CATEGORIAS_ACCION:
+                continue
+            rut = conc.get('rut', 'N/A')
+            motivo = self._motivo(conc['categoria'])
+            dominio = conc.get('dominio', '')
+            for usuario_ad in self._usuarios_ad(conc):
+                yield (usuario_ad, rut, motivo, dominio)
+    
+    def _generar_script_bloqueo_compacto(self, objetivos: Iterable[Tuple[str, str, str, str]], total: int,
+                                         fecha: str, modo_seguro: bool, usuario: str,
+                                         fragmentos: int = 1, etiqueta: str = '',
+                                         tamano_lote: int = 500) -> Iterator[str]:
+        """
+        Genera script de bloqueo masivo en modo compacto.
+        
+        Las cuentas se embeben una sola vez como CSV (here-string) y un único
+        bucle las procesa por lotes: una búsqueda LDAP por lote, los cmdlets
+        reciben los objetos ya resueltos por pipeline y los resultados se
+        agregan al log CSV al cerrar cada lote. Si el log ya existe, las cuentas
+        marcadas OK se omiten, de modo que el script se puede reanudar.
+        
+        Con `fragmentos` > 1 las cuentas se reparten en ese número de grupos que
+        se procesan con ForEach-Object -Parallel (PowerShell 7), cada uno con
+        su propio log; el paralelismo se ajusta con el parámetro -Throttle.
+        """
+        sello = fecha.replace('-', '').replace(':', '').replace(' ', '_')
+        nombre_log = f"bloqueos_{sello}{'_' + etiqueta if etiqueta else ''}"
+        
+        yield f"""# Script generado automáticamente - Sistema Conciliación AD (modo compacto)
+# Fecha: {fecha}
+# Usuario: {usuario}
+# Total cuentas a procesar: {total}
+# Modo seguro: {'SI (comandos con -WhatIf)' if modo_seguro else 'NO (ejecución real)'}
+"""
+        if etiqueta:
+            yield f"# Fragmento: {etiqueta}\n"
+        if fragmentos > 1:
+            yield f"""# Fragmentos en paralelo: {fragmentos} (requiere PowerShell 7)
+
+param([int]$Throttle = {fragmentos})
+"""
+        
+        yield f"""
+Import-Module ActiveDirectory
+
+Write-Host "========================================" -ForegroundColor Cyan
+Write-Host "BLOQUEO MASIVO DE CUENTAS AD (COMPACTO)" -ForegroundColor Cyan
+Write-Host "Sistema de Conciliación RRHH-AD" -ForegroundColor Cyan
+Write-Host "========================================" -ForegroundColor Cyan
+Write-Host ""
+
+# Configuración
+$ModoSeguro = {'$true' if modo_seguro else '$false'}
+$TamanoLote = {tamano_lote}
+$Descripcion = "BLOQUEADO_AUTO_{fecha[:10]}"
+$RutaReportes = "C:\\Reportes_AD\\"
+{self._servidores_ps()}
+if (-not (Test-Path $RutaReportes)) {{
+    New-Item -ItemType Directory -Path $RutaReportes -Force | Out-Null
+}}
+
+# Cuentas objetivo (una fila por cuenta)
+$Objetivos = @(@'
+"SamAccountName","Rut","Motivo","Dominio"
+"""
+        
+        # Filas del CSV, agrupadas para no emitir un trozo por cuenta
+        filas = []
+        for usuario_ad, rut, motivo, dominio in objetivos:
+            filas.append(self._fila_csv(usuario_ad, rut, motivo, dominio))
+            if len(filas) >= tamano_lote:
+                yield ''.join(filas)
+                filas = []
+        if filas:
+            yield ''.join(filas)
+        
+        yield "'@ | ConvertFrom-Csv)\n"
+        
+        if fragmentos > 1:
+            yield f"""
+$Fragmentos = {fragmentos}
+$TodosLosObjetivos = $Objetivos
+
+0..($Fragmentos - 1) | ForEach-Object -ThrottleLimit $Throttle -Parallel {{
+    Import-Module ActiveDirectory
+    $Fragmento = $_
+    $ModoSeguro = $using:ModoSeguro
+    $TamanoLote = $using:TamanoLote
+    $Descripcion = $using:Descripcion
+    $Servidores = $using:Servidores
+    $todos = $using:TodosLosObjetivos
+    $Objetivos = @(for ($j = $Fragmento; $j -lt $todos.Count; $j += $using:Fragmentos) {{ $todos[$j] }})
+    $ArchivoLog = Join-Path $using:RutaReportes "{nombre_log}_f$($Fragmento + 1)de$($using:Fragmentos).csv"
+{self._indentar(_BUCLE_LOTES_PS, 4)}
+    Write-Host "Fragmento $($Fragmento + 1): $totalOk OK, $totalErrores errores (log: $ArchivoLog)" -ForegroundColor Green
+}}
+"""
+        else:
+            yield f"""
+$ArchivoLog = Join-Path $RutaReportes "{nombre_log}.csv"
+{_BUCLE_LOTES_PS}
+Write-Host "Cuentas OK: $totalOk - Errores: $totalErrores" -ForegroundColor $(if ($totalErrores -gt 0) {{ "Red" }} else {{ "Green" }})
+"""
+        
+        yield f"""
+# ========================================
+# REPORTE FINAL
+# ========================================
+Write-Host "`n========================================" -ForegroundColor Green
+Write-Host "PROCESO COMPLETADO" -ForegroundColor Green
+Write-Host "========================================" -ForegroundColor Green
+
+if ($ModoSeguro) {{
+    Write-Host "`n[INFORMACIÓN] En modo ejecución real, los resultados se registran en: $($RutaReportes){nombre_log}*.csv" -ForegroundColor Cyan
+}} else {{
+    Write-Host "`nResultados registrados en: $($RutaReportes){nombre_log}*.csv" -ForegroundColor Cyan
+    Write-Host "Si la ejecución se interrumpe, vuelva a ejecutar el script: se omiten las cuentas ya procesadas." -ForegroundColor Cyan
+}}
+
+Write-Host "`nNota: Revise el reporte antes de cualquier acción permanente." -ForegroundColor Magenta
+"""
+    
+    def _generar_script_rollback(self, objetivos: Iterable[Tuple[str, str, str, str]], total: int,
+                                 fecha: str, modo_seguro: bool, usuario: str,
+                                 tamano_lote: int = 500) -> Iterator[str]:
+        """
+        Genera script ROLLBACK para todas las cuentas de acción del proceso.
+        
+        El estado previo (Enabled, Description, OU) lo capturan los scripts de
+        bloqueo (compactos o por cuenta) en sus logs CSV; este script los lee (parámetro -Logs),
+        toma el primer registro OK de cada cuenta y restaura ese estado por
+        lotes, con el mismo formato compacto que el bloqueo.
+        """
+        sello = fecha.replace('-', '').replace(':', '').replace(' ', '_')
+        
+        yield f"""# Script ROLLBACK generado automáticamente - Sistema Conciliación AD
+# Fecha: {fecha}
+# Usuario: {usuario}
+# Total cuentas del proceso: {total}
+# Modo seguro: {'SI (comandos con -WhatIf)' if modo_seguro else 'NO (ejecución real)'}
+# Restaura el estado previo registrado por los scripts de bloqueo
+
+param([string]$Logs = "C:\\Reportes_AD\\bloqueos_*.csv")
+
+Import-Module ActiveDirectory
+
+Write-Host "========================================" -ForegroundColor Cyan
+Write-Host "ROLLBACK DE BLOQUEO MASIVO AD" -ForegroundColor Cyan
+Write-Host "Sistema de Conciliación RRHH-AD" -ForegroundColor Cyan
+Write-Host "========================================" -ForegroundColor Cyan
+Write-Host ""
+
+# Configuración
+$ModoSeguro = {'$true' if modo_seguro else '$false'}
+$TamanoLote = {tamano_lote}
+$RutaReportes = "C:\\Reportes_AD\\"
+$ArchivoLog = Join-Path $RutaReportes "rollback_{sello}.csv"
+{self._servidores_ps()}
+if (-not (Test-Path $RutaReportes)) {{
+    New-Item -ItemType Directory -Path $RutaReportes -Force | Out-Null
+}}
+
+# Cuentas del proceso (una fila por cuenta)
+$Objetivos = @(@'
+"SamAccountName","Rut","Dominio"
+"""
+        
+        filas = []
+        for usuario_ad, rut, _motivo, dominio in objetivos:
+            filas.append(self._fila_csv(usuario_ad, rut, dominio))
+            if len(filas) >= tamano_lote:
+                yield ''.join(filas)
+                filas = []
+        if filas:
+            yield ''.join(filas)
         
-        return script
+        yield f"""'@ | ConvertFrom-Csv)
+
+# Estado previo capturado por los bloqueos: el primer registro OK de cada cuenta (por dominio)
+$EstadoPrevio = @{{}}
+Get-ChildItem -Path $Logs -ErrorAction SilentlyContinue | Sort-Object Name | ForEach-Object {{
+    Import-Csv $_.FullName | Where-Object {{ $_.Resultado -eq "OK" -and $_.PSObject.Properties["EnabledAnterior"] }} | ForEach-Object {{
+        $clave = "$($_.Dominio)|$($_.SamAccountName)"
+        if (-not $EstadoPrevio.ContainsKey($clave)) {{ $EstadoPrevio[$clave] = $_ }}
+    }}
+}}
+$sinEstado = @($Objetivos | Where-Object {{ -not $EstadoPrevio.ContainsKey("$($_.Dominio)|$($_.SamAccountName)") }}).Count
+$Objetivos = @($Objetivos | Where-Object {{ $EstadoPrevio.ContainsKey("$($_.Dominio)|$($_.SamAccountName)") }})
+Write-Host "Cuentas con estado previo registrado: $($Objetivos.Count) (sin registro: $sinEstado)" -ForegroundColor Yellow
+
+{_BUCLE_ROLLBACK_PS}
+
+Write-Host "`n========================================" -ForegroundColor Green
+Write-Host "ROLLBACK COMPLETADO" -ForegroundColor Green
+Write-Host "Cuentas restauradas: $totalOk - Errores: $totalErrores" -ForegroundColor Green
+Write-Host "========================================" -ForegroundColor Green
+
+if ($ModoSeguro) {{
+    Write-Host "`n[INFORMACIÓN] En modo ejecución real, los resultados se registran en: $ArchivoLog" -ForegroundColor Cyan
+}} else {{
+    Write-Host "`nResultados registrados en: $ArchivoLog" -ForegroundColor Cyan
+}}
+"""
     
-    def _generar_script_reporte(self, conciliaciones: List[Dict], fecha: str) -> str:
+    def _generar_script_reporte(self, conciliaciones: Iterable[Dict], conteos: Dict[str, int],
+                                fecha: str) -> Iterator[str]:
         """Genera script para reporte informativo"""
         
-        script = f"""# Script de reporte - Sistema Conciliación AD
+        yield f"""# Script de reporte - Sistema Conciliación AD
 # Fecha: {fecha}
-# Total conciliaciones analizadas: {len(conciliaciones)}
+# Total conciliaciones analizadas: {sum(conteos.values())}
 
 Import-Module ActiveDirectory
 
@@ -135,9 +632,9 @@ Write-Host "========================================" -ForegroundColor Cyan
 Write-Host ""
 
 # Estadísticas
-$totalFantasmas = {sum(1 for c in conciliaciones if c['categoria'] == 'FANTASMA_TOTAL')}
-$totalInactivosConCuenta = {sum(1 for c in conciliaciones if c['categoria'] == 'INACTIVO_CON_CUENTA')}
-$totalOk = {sum(1 for c in conciliaciones if c['categoria'] in ['OK_ACTIVO', 'OK_INACTIVO'])}
+$totalFantasmas = {conteos.get('FANTASMA_TOTAL', 0)}
+$totalInactivosConCuenta = {conteos.get('INACTIVO_CON_CUENTA', 0)}
+$totalOk = {conteos.get('OK_ACTIVO', 0) + conteos.get('OK_INACTIVO', 0)}
 
 Write-Host "ESTADÍSTICAS:" -ForegroundColor Yellow
 Write-Host "  • Fantasmas totales: $totalFantasmas" -ForegroundColor Red
@@ -151,43 +648,68 @@ Write-Host "CUENTAS QUE REQUIEREN ATENCIÓN:" -ForegroundColor Yellow
 """
 
         for conc in conciliaciones:
-            if conc['categoria'] in ['FANTASMA_TOTAL', 'INACTIVO_CON_CUENTA']:
+            if conc['categoria'] in CATEGORIAS_ACCION:
                 rut = conc.get('rut', 'N/A')
                 categoria = conc.get('categoria', '')
                 descripcion = conc.get('descripcion', '')
                 
-                script += f"""Write-Host "  • {rut} - {categoria}" -ForegroundColor {"Red" if categoria == 'FANTASMA_TOTAL' else "Yellow"}
+                cuentas = ', '.join(self._usuarios_ad(conc)) or 'sin cuenta asociada'
+                if conc.get('dominio'):
+                    cuentas = f"{conc['dominio']}: {cuentas}"
+                
+                yield f"""Write-Host "  • {rut} ({cuentas}) - {categoria}" -ForegroundColor {"Red" if categoria == 'FANTASMA_TOTAL' else "Yellow"}
 Write-Host "      {descripcion}" -ForegroundColor Gray
 """
         
-        script += """
+        yield """
 Write-Host "`n========================================" -ForegroundColor Green
 Write-Host "FIN DEL REPORTE" -ForegroundColor Green
 Write-Host "========================================" -ForegroundColor Green
 """
-
-        return script
     
-    def _generar_script_generico(self, conciliaciones: List[Dict], fecha: str, modo_seguro: bool) -> str:
+    def _generar_script_generico(self, conteos: Dict[str, int], fecha: str, modo_seguro: bool) -> Iterator[str]:
         """Genera script genérico"""
-        return f"""# Script generado por Sistema Conciliación AD
+        yield f"""# Script generado por Sistema Conciliación AD
 # Fecha: {fecha}
-# Total registros: {len(conciliaciones)}
+# Total registros: {sum(conteos.values())}
 
 Write-Host "Script base para personalización" -ForegroundColor Cyan
 """
     
-    def _rut_a_usuario_ad(self, rut: str) -> str:
+    def _indentar(self, texto: str, espacios: int) -> str:
+        """Indenta cada línea no vacía del texto"""
+        prefijo = ' ' * espacios
+        return '\n'.join(prefijo + linea if linea else linea for linea in texto.split('\n'))
+    
+    def _motivo(self, categoria: str) -> str:
+        """Texto del motivo de bloqueo según categoría"""
+        return "No existe en nómina RRHH" if categoria == 'FANTASMA_TOTAL' else "Inactivo en RRHH"
+    
+    def _fila_csv(self, *valores: str) -> str:
+        """Fila CSV con todos los campos entre comillas (seguro dentro de un here-string)"""
+        return ','.join('"' + str(v).replace('"', '""') + '"' for v in valores) + '\n'
+    
+    def _escapar_ps(self, valor: str) -> str:
+        """Escapa un valor para usarlo dentro de un string PowerShell entre comillas dobles"""
+        return str(valor).replace('`', '``').replace('"', '`"').replace('$', '`$')
+    
+    def _servidores_ps(self) -> str:
         """
-        Convierte RUT a nombre de usuario AD (lógica básica)
-        En un sistema real, esto debería venir de la base de datos
+        Tabla dominio -> servidor (-Server) de los cmdlets AD. Por defecto el
+        nombre con que se cargó cada export; vacía en procesos de un dominio
+        (se usa el dominio del equipo que ejecuta el script).
         """
-        if not rut or '-' not in rut:
-            return "usuario.generico"
-        
-        # Extraer número sin DV
-        numero = rut.split('-')[0]
-        
-        # Usar primeros 8 dígitos como usuario
-        # En realidad, necesitarías mapeo real RUT -> usuario AD
-        return f"user{numero[-8:]}"
\ No newline at end of file
+        lineas = ''.join(
+            f'    "{dominio}" = "{dominio}"\n' for dominio in map(self._escapar_ps, self.dominios)
+        )
+        return f"""
+# Servidor o dominio AD (-Server) de cada export del proceso; ajustar si el
+# nombre del export no es el del dominio
+$Servidores = @{{
+{lineas}}}
+"""
+    
+    def _usuarios_ad(self, conc: Dict) -> List[str]:
+        """Cuentas AD (SamAccountName) del RUT de la conciliación en su dominio, según el índice del proceso"""
+        clave = clave_rut(conc.get('rut_numero'), conc.get('rut'))
+        return self.cuentas_por_rut.get((conc.get('dominio', ''), clave), [])
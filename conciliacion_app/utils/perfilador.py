@@ -0,0 +1,63 @@
+# conciliacion_app/utils/perfilador.py
+import os
+import sys
+import threading
+from collections import Counter
+
+
+class MuestreadorPilas:
+    """
+    Perfilador por muestreo: un hilo aparte toma la pila del hilo perfilado
+    cada `intervalo` segundos. El resultado se escribe en formato "collapsed"
+    (una línea `marco1;marco2;... cantidad` por pila), que es lo que leen
+    flamegraph.pl, speedscope e inferno.
+    
+    Tiene mucho menos costo que cProfile, por eso es el modo usado cuando el
+    perfil se activa por tasa de muestreo en producción.
+    """
+    
+    def __init__(self, intervalo: float = 0.005):
+        self.intervalo = intervalo
+        self.pilas = Counter()
+        self.muestras = 0
+        self._hilo_objetivo = None
+        self._hilo = None
+        self._detener = threading.Event()
+    
+    def __enter__(self):
+        self.iniciar()
+        return self
+    
+    def __exit__(self, *exc):
+        self.detener()
+        return False
+    
+    def iniciar(self):
+        """Empieza a muestrear el hilo que llama"""
+        self._hilo_objetivo = threading.get_ident()
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._muestrear, name='muestreador-pilas', daemon=True)
+        self._hilo.start()
+    
+    def detener(self):
+        self._detener.set()
+        self._hilo.join()
+    
+    def _muestrear(self):
+        while not self._detener.wait(self.intervalo):
+            marco = sys._current_frames().get(self._hilo_objetivo)
+            if marco is None:
+                continue
+            marcos = []
+            while marco is not None:
+                codigo = marco.f_code
+                marcos.append(f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})")
+                marco = marco.f_back
+            # Raíz primero, como espera el formato collapsed
+            self.pilas[';'.join(reversed(marcos))] += 1
+            self.muestras += 1
+    
+    def escribir_collapsed(self, ruta):
+        with open(ruta, 'w', encoding='utf-8') as f:
+            for pila, cantidad in self.pilas.most_common():
+                f.write(f"{pila} {cantidad}\n")
@@ -1,8 +1,22 @@
 # conciliacion_app/utils/procesadores.py
-import pandas as pd
+from __future__ import annotations
+
+import csv
+import logging
 import re
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Set, Tuple
+
+from .reglas import ReglasCompiladas, leer_reglas
+from .rut import clave_rut, digito_verificador, rut_valido, separar_rut, validar_ruts_lote
+
+# pandas se importa solo al procesar Excel: cargarlo en cada arranque
+# (workers, comandos de manage.py) cuesta más que todo el resto de la app
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
 
 class NormalizadorRUT:
     """Normaliza RUTs chilenos desde diferentes formatos"""
@@ -12,7 +26,7 @@ class NormalizadorRUT:
         """
         Normaliza un RUT chileno a formato estándar: 12345678-9
         """
-        if not rut_str or pd.isna(rut_str):
+        if not rut_str or rut_str != rut_str:  # vacío o NaN
             return None
         
         # Convertir a string y limpiar
@@ -31,6 +45,11 @@ class NormalizadorRUT:
         # Formatear
         return f"{numero}-{dv}"
     
+    @staticmethod
+    def validar_rut(rut: Optional[str]) -> bool:
+        """True si el RUT normalizado (12345678-9) tiene dígito verificador correcto"""
+        return rut_valido(rut)
+    
     @staticmethod
     def extraer_rut_desde_texto(texto: str) -> Optional[str]:
         """Extrae RUT desde texto que puede contener otros datos"""
@@ -56,6 +75,57 @@ class NormalizadorRUT:
         return None
 
 
+class EmpleadoProcesado:
+    """
+    Empleado único (por RUT) leído de la nómina. Con __slots__ ocupa una
+    fracción de lo que ocupaba el dict equivalente; los estados son
+    referencias a las mismas constantes de texto.
+    """
+    __slots__ = ('rut_normalizado', 'rut_numero', 'rut_dv', 'nombre', 'departamento', 'cargo',
+                 'estado_final', 'tiene_conflicto', 'registros_originales', 'rut_valido')
+    
+    def __init__(self, rut_normalizado: str, nombre: str, departamento: Optional[str],
+                 cargo: Optional[str], estado_final: str = 'ACTIVO',
+                 tiene_conflicto: bool = False, registros_originales: int = 0,
+                 rut_valido: bool = True):
+        self.rut_normalizado = rut_normalizado
+        self.rut_numero, self.rut_dv = separar_rut(rut_normalizado) or (None, '')
+        self.nombre = nombre
+        self.departamento = departamento
+        self.cargo = cargo
+        self.estado_final = estado_final
+        self.tiene_conflicto = tiene_conflicto
+        self.registros_originales = registros_originales
+        self.rut_valido = rut_valido  # Dígito verificador correcto
+    
+    def __repr__(self):
+        return f"EmpleadoProcesado({self.rut_normalizado!r}, {self.estado_final!r})"
+
+
+class CuentaProcesada:
+    """Cuenta leída del export de Active Directory"""
+    __slots__ = ('rut_normalizado', 'rut_numero', 'rut_dv', 'nombre_usuario', 'nombre_completo',
+                 'email', 'estado_cuenta', 'rut_valido')
+    
+    def __init__(self, rut_normalizado: str, nombre_usuario: str, nombre_completo: Optional[str],
+                 email: Optional[str], estado_cuenta: str, rut_valido: bool = True):
+        self.rut_normalizado = rut_normalizado
+        self.rut_numero, self.rut_dv = separar_rut(rut_normalizado) or (None, '')
+        self.nombre_usuario = nombre_usuario
+        self.nombre_completo = nombre_completo
+        self.email = email
+        self.estado_cuenta = estado_cuenta
+        self.rut_valido = rut_valido  # Dígito verificador correcto
+    
+    def __repr__(self):
+        return f"CuentaProcesada({self.rut_normalizado!r}, {self.nombre_usuario!r}, {self.estado_cuenta!r})"
+
+
+# Estados vistos para un mismo RUT en la nómina (máscara de bits)
+_VISTO_ACTIVO = 1
+_VISTO_INACTIVO = 2
+
+
 class ProcesadorExcelNomina:
     """Procesa archivos Excel de nómina RRHH"""
     
@@ -65,11 +135,13 @@ class ProcesadorExcelNomina:
     
     # conciliacion_app/utils/procesadores.py - MODIFICA el método procesar
 
-    def procesar(self, ruta_archivo: str) -> List[Dict]:
+    def procesar(self, ruta_archivo: str) -> List[EmpleadoProcesado]:
         """
         Procesa archivo Excel y retorna lista de empleados normalizados
         MANEJANDO DUPLICADOS
         """
+        import pandas as pd
+        
         try:
         # Leer Excel
             df = pd.read_excel(ruta_archivo, engine='openpyxl')
@@ -89,6 +161,7 @@ class ProcesadorExcelNomina:
         
         # AGRUPAR POR RUT PARA MANEJAR DUPLICADOS
             empleados_dict = {}
+            estados_vistos = {}  # RUT -> máscara de estados encontrados
         
             for _, row in df.iterrows():
                 rut = row['rut_normalizado']
@@ -96,55 +169,49 @@ class ProcesadorExcelNomina:
                     continue
             
             # Si es primera vez que vemos este RUT
-                if rut not in empleados_dict:
-                    empleados_dict[rut] = {
-                        'rut_normalizado': rut,
-                        'nombre': self._obtener_nombre(row),
-                        'departamento': self._obtener_valor(row, 'departamento', 'dpto', 'depto'),
-                        'cargo': self._obtener_valor(row, 'cargo', 'puesto', 'position'),
-                        'estados': [],  # Lista de todos los estados encontrados
-                        'registros_originales': 0,
-                        'tiene_conflicto': False,
-                    }
+                empleado = empleados_dict.get(rut)
+                if empleado is None:
+                    empleado = empleados_dict[rut] = EmpleadoProcesado(
+                        rut,
+                        self._obtener_nombre(row),
+                        self._obtener_valor(row, 'departamento', 'dpto', 'depto'),
+                        self._obtener_valor(row, 'cargo', 'puesto', 'position'),
+                    )
+                    estados_vistos[rut] = 0
             
             # Agregar estado de este registro
                 estado = self._determinar_estado_empleado(row, columna_estado)
-                empleados_dict[rut]['estados'].append(estado)
-                empleados_dict[rut]['registros_originales'] += 1
+                estados_vistos[rut] |= _VISTO_ACTIVO if estado == 'ACTIVO' else _VISTO_INACTIVO
+                empleado.registros_originales += 1
         
         # DETERMINAR ESTADO FINAL PARA CADA RUT
-            empleados = []
-            for rut, datos in empleados_dict.items():
-                estados = datos['estados']
+            empleados = list(empleados_dict.values())
+            for empleado in empleados:
+                vistos = estados_vistos[empleado.rut_normalizado]
             
             # Regla: Si hay AL MENOS UN "ACTIVO", el empleado está ACTIVO
-                if 'ACTIVO' in estados:
-                    estado_final = 'ACTIVO'
-                    tiene_conflicto = len(set(estados)) > 1  # Conflicto si hay mezcla
+                if vistos & _VISTO_ACTIVO:
+                    empleado.estado_final = 'ACTIVO'
+                    empleado.tiene_conflicto = vistos != _VISTO_ACTIVO  # Conflicto si hay mezcla
                 else:
                 # Si todos son INACTIVO
-                    estado_final = 'INACTIVO'
-                    tiene_conflicto = False
-            
-                empleado = {
-                    'rut_normalizado': rut,
-                    'nombre': datos['nombre'],
-                    'departamento': datos['departamento'],
-                    'cargo': datos['cargo'],
-                    'estado_final': estado_final,
-                    'tiene_conflicto': tiene_conflicto,
-                    'registros_originales': datos['registros_originales'],
-                    'estados_encontrados': estados,  # Para debug
-                }
-            
-                empleados.append(empleado)
+                    empleado.estado_final = 'INACTIVO'
+                    empleado.tiene_conflicto = False
+        
+        # VALIDAR DÍGITO VERIFICADOR DE TODA LA COLUMNA DE UNA VEZ
+            validos = validar_ruts_lote([emp.rut_normalizado for emp in empleados])
+            for empleado, valido in zip(empleados, validos.tolist()):
+                empleado.rut_valido = valido
         
             print(f"✓ Procesados {len(empleados)} empleados únicos (de {len(df)} registros)")
+            invalidos = len(empleados) - int(validos.sum())
+            if invalidos:
+                print(f"  ⚠️  {invalidos} RUT con dígito verificador inválido")
         
         # DEBUG: Mostrar duplicados
             for emp in empleados:
-                if emp['registros_originales'] > 1:
-                    print(f"  ⚠️  {emp['rut_normalizado']}: {emp['registros_originales']} registros -> Estado: {emp['estado_final']}")
+                if emp.registros_originales > 1:
+                    print(f"  ⚠️  {emp.rut_normalizado}: {emp.registros_originales} registros -> Estado: {emp.estado_final}")
         
             return empleados
         
@@ -202,6 +269,8 @@ class ProcesadorExcelNomina:
     
     def _obtener_nombre(self, row: pd.Series) -> str:
         """Obtiene nombre del empleado"""
+        import pandas as pd
+        
         # Buscar columnas de nombre
         nombres_cols = ['nombre', 'name', 'empleado', 'persona', 'fullname']
         
@@ -215,6 +284,8 @@ class ProcesadorExcelNomina:
     
     def _obtener_valor(self, row: pd.Series, *nombres_posibles: str) -> Optional[str]:
         """Obtiene valor de una columna por nombres posibles"""
+        import pandas as pd
+        
         for col in row.index:
             col_lower = str(col).lower()
             for nombre in nombres_posibles:
@@ -229,89 +300,120 @@ class ProcesadorTXTAD:
     def __init__(self):
         self.normalizador = NormalizadorRUT()
     
-    def procesar(self, ruta_archivo: str) -> List[Dict]:
+    def procesar(self, ruta_archivo: str) -> List[CuentaProcesada]:
         """
-        Procesa archivo TXT/CSV y retorna lista de cuentas AD
+        Procesa archivo TXT/CSV y retorna lista de cuentas AD.
+        
+        Se lee con el módulo csv (sin pandas): las filas se recorren una vez
+        y los valores vacíos se tratan como ausentes. Se ignora la línea
+        `#TYPE ...` que agrega Export-Csv de PowerShell.
         """
         try:
-            # Determinar delimitador
-            delimitador = self._detectar_delimitador(ruta_archivo)
-            
-            # Leer archivo
-            df = pd.read_csv(ruta_archivo, delimiter=delimitador, encoding='utf-8')
-            
-            # Detectar columnas importantes
-            columna_usuario = self._detectar_columna_usuario(df)
-            columna_rut = self._detectar_columna_rut(df)
-            
-            if not columna_usuario:
-                raise ValueError("No se pudo detectar columna de usuario en el archivo AD")
-            
-            # Procesar cuentas
-            cuentas = []
-            for _, row in df.iterrows():
-                # Obtener RUT
-                rut = None
-                if columna_rut and columna_rut in row:
-                    rut = self.normalizador.extraer_rut_desde_texto(row[columna_rut])
+            # utf-8-sig: Export-Csv suele escribir BOM
+            with open(ruta_archivo, 'r', encoding='utf-8-sig', newline='') as f:
+                lineas = self._sin_cabecera_tipo(f)
+                encabezado = next(lineas, None)
+                if encabezado is None:
+                    return []
                 
-                # Si no hay RUT, intentar extraer del nombre de usuario
-                if not rut and columna_usuario in row:
-                    usuario = str(row[columna_usuario])
-                    rut = self._extraer_rut_desde_usuario(usuario)
+                # Determinar delimitador
+                delimitador = self._detectar_delimitador(encabezado)
+                lector = csv.reader(lineas, delimiter=delimitador)
+                columnas = [c.strip() for c in next(csv.reader([encabezado], delimiter=delimitador))]
                 
-                if not rut:
-                    continue  # Saltar si no se pudo obtener RUT
+                # Detectar columnas importantes
+                columna_usuario = self._detectar_columna_usuario(columnas)
+                columna_rut = self._detectar_columna_rut(columnas)
                 
-                # Determinar estado de cuenta
-                estado_cuenta = self._determinar_estado_cuenta(row)
+                if not columna_usuario:
+                    raise ValueError("No se pudo detectar columna de usuario en el archivo AD")
                 
-                cuenta = {
-                    'rut_normalizado': rut,
-                    'nombre_usuario': str(row[columna_usuario]) if columna_usuario in row else 'N/A',
-                    'nombre_completo': self._obtener_valor(row, 'nombre', 'name', 'displayname'),
-                    'email': self._obtener_valor(row, 'email', 'mail', 'correo'),
-                    'estado_cuenta': estado_cuenta,
-                }
+                # Procesar cuentas; el DV de los RUTs leídos de la columna se
+                # valida al final, de una vez para todo el archivo
+                cuentas = []
+                por_validar = []
+                for valores in lector:
+                    if not valores:
+                        continue
+                    # Los campos vacíos o faltantes quedan fuera (equivale a NaN)
+                    row = {col: valor for col, valor in zip(columnas, valores) if valor != ''}
+                    
+                    # Obtener RUT
+                    rut = None
+                    if columna_rut and columna_rut in row:
+                        rut = self.normalizador.extraer_rut_desde_texto(row[columna_rut])
+                    desde_columna = rut is not None
+                    
+                    # Si no hay RUT, intentar extraer del nombre de usuario
+                    if not rut and columna_usuario in row:
+                        usuario = row[columna_usuario]
+                        rut = self._extraer_rut_desde_usuario(usuario)
+                        desde_columna = False  # El DV se calcula, siempre es correcto
+                    
+                    if not rut:
+                        continue  # Saltar si no se pudo obtener RUT
+                    
+                    # Determinar estado de cuenta
+                    estado_cuenta = self._determinar_estado_cuenta(row)
+                    
+                    cuenta = CuentaProcesada(
+                        rut,
+                        row.get(columna_usuario, 'N/A'),
+                        self._obtener_valor(row, 'nombre', 'name', 'displayname'),
+                        self._obtener_valor(row, 'email', 'mail', 'correo'),
+                        estado_cuenta,
+                    )
+                    
+                    cuentas.append(cuenta)
+                    if desde_columna:
+                        por_validar.append(cuenta)
                 
-                cuentas.append(cuenta)
+                validos = validar_ruts_lote([cuenta.rut_normalizado for cuenta in por_validar])
+                for cuenta, valido in zip(por_validar, validos.tolist()):
+                    cuenta.rut_valido = valido
             
             return cuentas
             
         except Exception as e:
             raise Exception(f"Error procesando archivo AD: {str(e)}")
     
-    def _detectar_delimitador(self, ruta_archivo: str) -> str:
-        """Detecta el delimitador del archivo"""
+    def _sin_cabecera_tipo(self, lineas: Iterable[str]) -> Iterable[str]:
+        """Omite las líneas `#TYPE` de Export-Csv y las líneas en blanco iniciales"""
+        lineas = iter(lineas)
+        for linea in lineas:
+            if linea.strip() and not linea.startswith('#TYPE'):
+                yield linea
+                break
+        yield from lineas
+    
+    def _detectar_delimitador(self, primera_linea: str) -> str:
+        """Detecta el delimitador a partir de la línea de encabezado"""
         delimitadores = [',', ';', '\t', '|']
         
-        with open(ruta_archivo, 'r', encoding='utf-8') as f:
-            primera_linea = f.readline()
-        
         for delim in delimitadores:
             if delim in primera_linea:
                 return delim
         
         return ','  # Por defecto
     
-    def _detectar_columna_usuario(self, df: pd.DataFrame) -> Optional[str]:
+    def _detectar_columna_usuario(self, columnas: List[str]) -> Optional[str]:
         """Detecta columna de nombre de usuario"""
         nombres_usuario = ['usuario', 'user', 'username', 'samaccountname', 'login']
         
-        for col in df.columns:
+        for col in columnas:
             col_lower = str(col).lower()
             for nombre in nombres_usuario:
                 if nombre in col_lower:
                     return col
         
         # Si no encuentra, usar primera columna
-        return df.columns[0] if len(df.columns) > 0 else None
+        return columnas[0] if len(columnas) > 0 else None
     
-    def _detectar_columna_rut(self, df: pd.DataFrame) -> Optional[str]:
+    def _detectar_columna_rut(self, columnas: List[str]) -> Optional[str]:
         """Detecta columna de RUT"""
         nombres_rut = ['rut', 'documento', 'cedula', 'dni', 'identificacion']
         
-        for col in df.columns:
+        for col in columnas:
             col_lower = str(col).lower()
             for nombre in nombres_rut:
                 if nombre in col_lower:
@@ -332,21 +434,21 @@ class ProcesadorTXTAD:
             match = re.search(patron, usuario)
             if match:
                 numero = match.group(1)
-                # Asumir dígito verificador (podría mejorarse)
-                return f"{numero}-0"  # Placeholder, debería calcular DV
+                # El usuario no trae DV: se calcula para que calce con la nómina
+                return f"{numero}-{digito_verificador(int(numero))}"
         
         return None
     
-    def _determinar_estado_cuenta(self, row: pd.Series) -> str:
+    def _determinar_estado_cuenta(self, row: Dict[str, str]) -> str:
         """Determina estado de la cuenta AD"""
         # Buscar columnas de estado
         estados_cols = ['estado', 'status', 'enabled', 'disabled', 'active']
         
-        for col in row.index:
-            col_lower = str(col).lower()
+        for col, valor in row.items():
+            col_lower = col.lower()
             for estado in estados_cols:
-                if estado in col_lower and pd.notna(row[col]):
-                    valor = str(row[col]).upper()
+                if estado in col_lower:
+                    valor = valor.upper()
                     if any(s in valor for s in ['ACTIV', 'ENABLED', 'TRUE', '1', 'SI', 'YES']):
                         return 'ACTIVA'
                     elif any(s in valor for s in ['INACTIV', 'DISABLED', 'FALSE', '0', 'NO']):
@@ -355,142 +457,273 @@ class ProcesadorTXTAD:
         # Por defecto, asumir activa
         return 'ACTIVA'
     
-    def _obtener_valor(self, row: pd.Series, *nombres_posibles: str) -> Optional[str]:
+    def _obtener_valor(self, row: Dict[str, str], *nombres_posibles: str) -> Optional[str]:
         """Obtiene valor de una columna por nombres posibles"""
-        for col in row.index:
-            col_lower = str(col).lower()
+        for col, valor in row.items():
+            col_lower = col.lower()
             for nombre in nombres_posibles:
-                if nombre in col_lower and pd.notna(row[col]):
-                    return str(row[col])
+                if nombre in col_lower:
+                    return valor
         return None
 
 
+class ProcesadorLogEjecucion:
+    """
+    Procesa el log CSV que escriben los scripts de bloqueo
+    (C:\\Reportes_AD\\bloqueos_*.csv) y determina qué RUTs quedaron resueltos
+    """
+    
+    def __init__(self):
+        self.normalizador = NormalizadorRUT()
+    
+    def procesar(self, lineas: Iterable[str], rut_por_usuario: Dict[Tuple[str, str], str],
+                 ruts_validos: Set[Tuple[str, str]], max_detalle_errores: int = 20,
+                 requiere_dominio: bool = False) -> Dict:
+        """
+        Recorre el log fila a fila (sin cargarlo completo) y cruza cada fila
+        con los índices entregados: (dominio, SamAccountName) -> RUT y el
+        conjunto de (dominio, RUT) de las conciliaciones; en procesos de un
+        solo dominio, dominio es ''. Un RUT queda resuelto en un dominio si
+        tuvo al menos una cuenta OK y ninguna con ERROR; una fila con
+        Resultado vacío cuenta como error.
+        
+        Un archivo sin columna Resultado no es un log de ejecución (p. ej. el
+        reporte final de cuentas deshabilitadas del script por cuenta) y se
+        rechaza con ValueError. Con `requiere_dominio` (proceso con varios
+        dominios) un log sin columna Dominio es ambiguo y también se rechaza.
+        """
+        lector = csv.DictReader(linea for linea in lineas if not linea.startswith('#TYPE'))
+        if 'Resultado' not in (lector.fieldnames or []):
+            raise ValueError("El archivo no tiene columna Resultado; suba el log de ejecución "
+                             "del script (bloqueos_*.csv), no el reporte de cuentas deshabilitadas")
+        if requiere_dominio and 'Dominio' not in (lector.fieldnames or []):
+            raise ValueError("El log no tiene columna Dominio; en un proceso con varios dominios "
+                             "no se puede saber a qué dominio corresponde cada cuenta")
+        
+        ruts_ok = set()
+        ruts_error = set()
+        filas = 0
+        filas_ok = 0
+        filas_error = 0
+        sin_coincidencia = 0
+        detalle_errores = []
+        
+        for fila in lector:
+            filas += 1
+            usuario = (fila.get('SamAccountName') or '').strip()
+            dominio = (fila.get('Dominio') or '').strip()
+            rut = rut_por_usuario.get((dominio, usuario))
+            if not rut and fila.get('Rut'):
+                rut = self.normalizador.normalizar_rut(fila['Rut'])
+            
+            clave = (dominio, rut)
+            if not rut or clave not in ruts_validos:
+                sin_coincidencia += 1
+                continue
+            
+            if (fila.get('Resultado') or '').strip().upper() == 'OK':
+                filas_ok += 1
+                ruts_ok.add(clave)
+            else:
+                filas_error += 1
+                ruts_error.add(clave)
+                if len(detalle_errores) < max_detalle_errores:
+                    cuenta = f"{dominio}\\{usuario}" if dominio else usuario
+                    detalle_errores.append(f"{cuenta} ({rut}): {fila.get('Error') or 'sin Resultado'}")
+        
+        return {
+            'filas': filas,
+            'filas_ok': filas_ok,
+            'filas_error': filas_error,
+            'sin_coincidencia': sin_coincidencia,
+            'ruts_resueltos': ruts_ok - ruts_error,
+            'detalle_errores': detalle_errores,
+        }
+
+
 #REVISION DESDE ACÁ
 
 # conciliacion_app/utils/procesadores.py - REVISA la clase Conciliador
 
 class Conciliador:
-    """Realiza la conciliación entre nómina y AD"""
+    """
+    Realiza la conciliación entre nómina y AD: cruza por RUT y categoriza
+    cada fila con las reglas de conciliacion_app/utils/reglas.py
+    """
+    
+    # Atributos de cada lado que usan las reglas, con su valor cuando falta
+    _CAMPOS_EMPLEADO = {'estado_final': '', 'tiene_conflicto': False, 'rut_dv': ''}
+    _CAMPOS_CUENTA = {'estado_cuenta': '', 'rut_dv': ''}
+    
+    def __init__(self, reglas: Optional[ReglasCompiladas] = None):
+        self.reglas = reglas or ReglasCompiladas(leer_reglas())
     
-    def conciliar(self, empleados: List[Dict], cuentas_ad: List[Dict]) -> List[Dict]:
+    def conciliar(self, empleados: List[EmpleadoProcesado], cuentas_ad: List[CuentaProcesada]) -> List[Dict]:
         """
-        Concilia empleados de nómina con cuentas de AD
-        VERSIÓN CORREGIDA
+        Concilia empleados de nómina con cuentas de AD (los registros tal como
+        los entregan los procesadores). Primero todas las cuentas AD (con o
+        sin empleado) y después los empleados sin cuenta.
         """
-        # DEBUG: Mostrar lo que recibimos
-        print(f"=== DEBUG CONCILIADOR ===")
-        print(f"Empleados recibidos: {len(empleados)}")
-        print(f"Cuentas AD recibidas: {len(cuentas_ad)}")
-        
-        # Mostrar primeros 5 de cada uno para verificar
-        print("Primeros 5 empleados:")
-        for e in empleados[:5]:
-            print(f"  {e.get('rut', 'NO_RUT')} - {e.get('estado_final', 'NO_ESTADO')}")
-        
-        print("Primeras 5 cuentas AD:")
-        for c in cuentas_ad[:5]:
-            print(f"  {c.get('rut', 'NO_RUT')} - {c.get('estado_cuenta', 'NO_ESTADO')}")
-        
-        # Crear diccionarios por RUT para búsqueda rápida
-        empleados_por_rut = {}
-        for e in empleados:
-            rut = e.get('rut')
-            if rut:
-                empleados_por_rut[rut] = e
-        
-        cuentas_por_rut = {}
-        for c in cuentas_ad:
-            rut = c.get('rut')
-            if rut:
-                cuentas_por_rut[rut] = c
-        
-        print(f"Empleados únicos por RUT: {len(empleados_por_rut)}")
-        print(f"Cuentas AD únicas por RUT: {len(cuentas_por_rut)}")
-        
-        resultados = []
+        import numpy as np
+        
+        logger.debug("Conciliador: %d empleados, %d cuentas AD recibidas", len(empleados), len(cuentas_ad))
+        empleados_por_rut = self._indexar(empleados)
+        cuentas_por_rut = self._indexar(cuentas_ad)
+        logger.debug("Conciliador: %d empleados y %d cuentas AD únicos por RUT",
+                     len(empleados_por_rut), len(cuentas_por_rut))
+        
+        # Cruce completo por RUT
+        claves = list(cuentas_por_rut)
+        claves.extend(clave for clave in empleados_por_rut if clave not in cuentas_por_rut)
+        posiciones_cuenta = np.full(len(claves), -1, dtype=np.int64)
+        posiciones_cuenta[:len(cuentas_por_rut)] = list(cuentas_por_rut.values())
+        resultados = self._categorizar(
+            claves,
+            empleados, self._posiciones(empleados_por_rut, claves),
+            cuentas_ad, posiciones_cuenta
+        )
+        
+        logger.debug("Conciliador: %d resultados", len(resultados))
+        return resultados
+    
+    def conciliar_dominios(self, empleados: List[EmpleadoProcesado],
+                           cuentas_por_dominio: Dict[str, List[CuentaProcesada]]) -> List[Dict]:
+        """
+        Concilia una nómina contra los exports AD de varios dominios. El
+        índice y las columnas de empleados se arman una sola vez y las
+        cuentas de cada dominio se cruzan contra ellos. Cada resultado lleva
+        su 'dominio'; los empleados sin cuenta en ningún dominio van al final
+        con dominio ''. Las cuentas cuyo RUT también tiene cuenta en otros
+        dominios llevan la lista en 'otros_dominios'.
+        """
+        import numpy as np
         
-        # 1. PRIMERO: Revisar TODAS las cuentas AD (esto es lo importante)
-        print("\n=== REVISANDO CUENTAS AD ===")
-        for rut, cuenta in cuentas_por_rut.items():
-            if rut in empleados_por_rut:
-                empleado = empleados_por_rut[rut]
-                
-                # Empleado existe en nómina
-                if empleado.get('estado_final') == 'INACTIVO':
-                    # CASO 2: INACTIVO CON CUENTA
-                    resultado = {
-                        'rut': rut,
-                        'existe_en_nomina': True,
-                        'tiene_cuenta_ad': True,
-                        'categoria': 'INACTIVO_CON_CUENTA',
-                        'prioridad': 'MEDIA',
-                        'accion_recomendada': 'BLOQUEAR_CUENTA',
-                        'descripcion': f"Empleado figura como INACTIVO en RRHH pero tiene cuenta AD activa",
-                    }
-                    print(f"  ⚠️  {rut}: INACTIVO con cuenta AD")
-                else:
-                    # CASO: ACTIVO CON CUENTA (TODO OK)
-                    resultado = {
-                        'rut': rut,
-                        'existe_en_nomina': True,
-                        'tiene_cuenta_ad': True,
-                        'categoria': 'OK_ACTIVO',
-                        'prioridad': 'NINGUNA',
-                        'accion_recomendada': 'MANTENER',
-                        'descripcion': f"Empleado ACTIVO con cuenta AD - Situación normal",
-                    }
-                    print(f"  ✓ {rut}: ACTIVO con cuenta (OK)")
-            else:
-                # CASO 1: FANTASMA TOTAL (no existe en nómina) - ¡ESTO ES LO QUE BUSCAMOS!
-                resultado = {
-                    'rut': rut,
-                    'existe_en_nomina': False,
-                    'tiene_cuenta_ad': True,
-                    'categoria': 'FANTASMA_TOTAL',
-                    'prioridad': 'ALTA',
-                    'accion_recomendada': 'ELIMINAR_CUENTA',
-                    'descripcion': f"Cuenta AD activa pero NO existe en nómina RRHH",
-                }
-                print(f"  🔴 {rut}: FANTASMA TOTAL (no en RRHH)")
-            
-            resultados.append(resultado)
+        empleados_por_rut = self._indexar(empleados)
+        columnas_empleado = self._columnas(empleados, self._CAMPOS_EMPLEADO)
+        logger.debug("Conciliador (%d dominios): %d empleados únicos por RUT",
+                     len(cuentas_por_dominio), len(empleados_por_rut))
         
-        # 2. Revisar empleados que no tienen cuenta AD (opcional para completitud)
-        print("\n=== REVISANDO EMPLEADOS SIN CUENTA AD ===")
-        for rut, empleado in empleados_por_rut.items():
-            if rut not in cuentas_por_rut:
-                if empleado.get('estado_final') == 'ACTIVO':
-                    # Empleado activo sin cuenta (no es problema para nuestra detección)
-                    resultado = {
-                        'rut': rut,
-                        'existe_en_nomina': True,
-                        'tiene_cuenta_ad': False,
-                        'categoria': 'OK_ACTIVO',  # O podríamos crear 'ACTIVO_SIN_CUENTA'
-                        'prioridad': 'NINGUNA',
-                        'accion_recomendada': 'MANTENER',
-                        'descripcion': f"Empleado ACTIVO sin cuenta AD",
-                    }
-                    print(f"  ⓘ {rut}: ACTIVO sin cuenta AD")
-                else:
-                    # Empleado inactivo sin cuenta (situación correcta)
-                    resultado = {
-                        'rut': rut,
-                        'existe_en_nomina': True,
-                        'tiene_cuenta_ad': False,
-                        'categoria': 'OK_INACTIVO',
-                        'prioridad': 'NINGUNA',
-                        'accion_recomendada': 'MANTENER',
-                        'descripcion': f"Empleado INACTIVO sin cuenta AD - Situación correcta",
-                    }
-                    print(f"  ✓ {rut}: INACTIVO sin cuenta (OK)")
-                
+        resultados = []
+        claves_resultados = []
+        dominios_por_rut = {}
+        for dominio, cuentas in cuentas_por_dominio.items():
+            cuentas_por_rut = self._indexar(cuentas)
+            claves = list(cuentas_por_rut)
+            logger.debug("Conciliador: %s, %d cuentas AD únicas por RUT", dominio, len(claves))
+            for resultado in self._categorizar(
+                claves,
+                empleados, self._posiciones(empleados_por_rut, claves),
+                cuentas, np.fromiter(cuentas_por_rut.values(), np.int64, len(claves)),
+                columnas_empleado=columnas_empleado
+            ):
+                resultado['dominio'] = dominio
                 resultados.append(resultado)
+            claves_resultados.extend(claves)
+            for clave in claves:
+                dominios_por_rut.setdefault(clave, []).append(dominio)
+        
+        # Hallazgos entre dominios: el mismo RUT con cuenta en más de un dominio
+        for clave, resultado in zip(claves_resultados, resultados):
+            dominios = dominios_por_rut[clave]
+            if len(dominios) > 1:
+                resultado['otros_dominios'] = [d for d in dominios if d != resultado['dominio']]
+                resultado['descripcion'] += f" (también con cuenta en {', '.join(resultado['otros_dominios'])})"
+        
+        sin_cuenta = [clave for clave in empleados_por_rut if clave not in dominios_por_rut]
+        for resultado in self._categorizar(
+            sin_cuenta,
+            empleados, self._posiciones(empleados_por_rut, sin_cuenta),
+            [], np.full(len(sin_cuenta), -1, dtype=np.int64),
+            columnas_empleado=columnas_empleado
+        ):
+            resultado['dominio'] = ''
+            resultados.append(resultado)
         
-        print(f"\n=== RESULTADOS FINALES ===")
-        print(f"Total resultados: {len(resultados)}")
-        fantasmas = sum(1 for r in resultados if r['categoria'] == 'FANTASMA_TOTAL')
-        inactivos_con_cuenta = sum(1 for r in resultados if r['categoria'] == 'INACTIVO_CON_CUENTA')
-        print(f"Fantasmas totales: {fantasmas}")
-        print(f"Inactivos con cuenta: {inactivos_con_cuenta}")
+        logger.debug("Conciliador: %d resultados", len(resultados))
+        return resultados
+    
+    def _indexar(self, filas: List) -> Dict:
+        """
+        Índice por RUT -> posición en `filas`, con clave entera (rut_numero)
+        cuando viene; si no, el texto del RUT. Con RUTs repetidos queda el último
+        """
+        indice = {}
+        for posicion, fila in enumerate(filas):
+            clave = clave_rut(fila.rut_numero, fila.rut_normalizado)
+            if clave:
+                indice[clave] = posicion
+        return indice
+    
+    @staticmethod
+    def _posiciones(indice: Dict, claves: List):
+        """Posición de cada clave en el índice, -1 si no está"""
+        import numpy as np
+        return np.fromiter((indice.get(clave, -1) for clave in claves), np.int64, len(claves))
+    
+    @staticmethod
+    def _columnas(filas: List, campos: Dict) -> Dict:
+        """
+        Una columna numpy por atributo de las filas, más una fila final con
+        el valor por defecto: indexar con la posición -1 ("sin fila") la toma
+        """
+        import numpy as np
+        return {
+            campo: np.array([getattr(fila, campo) or vacio for fila in filas] + [vacio], dtype=type(vacio))
+            for campo, vacio in campos.items()
+        }
+    
+    def _categorizar(self, claves: List, empleados: List[EmpleadoProcesado], posiciones_empleado,
+                     cuentas: List[CuentaProcesada], posiciones_cuenta,
+                     columnas_empleado: Optional[Dict] = None) -> List[Dict]:
+        """
+        Aplica las reglas a las filas del cruce (alineadas con `claves`) de
+        una vez. `posiciones_*` son arreglos con la posición de cada clave en
+        `empleados`/`cuentas` (-1 si ese lado no tiene fila)
+        """
+        import numpy as np
+        
+        if columnas_empleado is None:
+            columnas_empleado = self._columnas(empleados, self._CAMPOS_EMPLEADO)
+        columnas_cuenta = self._columnas(cuentas, self._CAMPOS_CUENTA)
+        
+        # Las columnas del cruce se arman por indexación, sin recorrer las filas
+        dv_empleado = columnas_empleado['rut_dv'][posiciones_empleado]
+        dv_cuenta = columnas_cuenta['rut_dv'][posiciones_cuenta]
+        columnas = {
+            'existe_en_nomina': posiciones_empleado >= 0,
+            'tiene_cuenta_ad': posiciones_cuenta >= 0,
+            'tiene_conflicto': columnas_empleado['tiene_conflicto'][posiciones_empleado],
+            # El cruce es por el cuerpo entero del RUT: si ambos lados traen
+            # dígito verificador y no coinciden, uno de los dos está mal digitado
+            'dv_distinto': (dv_empleado != '') & (dv_cuenta != '') & (dv_empleado != dv_cuenta),
+            'estado_final': columnas_empleado['estado_final'][posiciones_empleado],
+            'estado_cuenta': columnas_cuenta['estado_cuenta'][posiciones_cuenta],
+        }
+        
+        # Todas las reglas de una vez sobre las columnas completas
+        indices = self.reglas.clasificar(columnas)
+        sin_regla = np.flatnonzero(indices < 0)
+        if len(sin_regla):
+            raise ValueError(f"{len(sin_regla)} RUT sin regla de conciliación aplicable "
+                             f"(p. ej. {claves[sin_regla[0]]})")
+        
+        categorias = [regla.resultado for regla in self.reglas.reglas]
+        resultados = []
+        for posicion_empleado, posicion_cuenta, indice in zip(
+            posiciones_empleado.tolist(), posiciones_cuenta.tolist(), indices.tolist()
+        ):
+            origen = cuentas[posicion_cuenta] if posicion_cuenta >= 0 else empleados[posicion_empleado]
+            resultado = {
+                'rut': origen.rut_normalizado,
+                'rut_numero': origen.rut_numero,
+                'existe_en_nomina': posicion_empleado >= 0,
+                'tiene_cuenta_ad': posicion_cuenta >= 0,
+            }
+            resultado.update(categorias[indice])
+            resultados.append(resultado)
         
-        return resultados
\ No newline at end of file
+        if logger.isEnabledFor(logging.DEBUG):
+            for regla, cantidad in zip(self.reglas.reglas, np.bincount(indices, minlength=len(categorias))):
+                if cantidad:
+                    logger.debug("Conciliador: regla %s, %d filas", regla.nombre, cantidad)
+        return resultados
@@ -0,0 +1,110 @@
+# conciliacion_app/utils/reglas.py
+"""
+Reglas declarativas de categorización de la conciliación.
+
+Cada regla indica, para las columnas del cruce nómina/AD, los valores que
+deben tener ('si') y los que no ('no'), más la categoría, prioridad, acción y
+descripción que asigna. Gana la primera regla que calza, como una cadena de
+if/elif, pero cada regla se evalúa como una máscara numpy sobre la columna
+completa: agregar reglas suma operaciones vectoriales, no trabajo por fila.
+
+Las reglas por defecto están en reglas_conciliacion.json (mismo directorio)
+y se puede usar otro archivo con REGLAS_CONCILIACION_ARCHIVO.
+"""
+import json
+import os
+from typing import Dict, List, NamedTuple, Optional
+
+RUTA_REGLAS_POR_DEFECTO = os.path.join(os.path.dirname(__file__), 'reglas_conciliacion.json')
+
+# Columnas del cruce que pueden usar las reglas y su tipo
+COLUMNAS = {
+    'existe_en_nomina': bool,
+    'tiene_cuenta_ad': bool,
+    'tiene_conflicto': bool,
+    'dv_distinto': bool,  # Mismo cuerpo de RUT en ambos lados, distinto dígito verificador
+    'estado_final': str,
+    'estado_cuenta': str,
+}
+
+CAMPOS_RESULTADO = ('categoria', 'prioridad', 'accion', 'descripcion')
+
+
+class Condicion(NamedTuple):
+    columna: str
+    valores: tuple
+    negada: bool
+
+
+class Regla(NamedTuple):
+    nombre: str
+    condiciones: List[Condicion]
+    resultado: Dict[str, str]  # categoria, prioridad, accion_recomendada, descripcion
+
+
+def leer_reglas(ruta: str = RUTA_REGLAS_POR_DEFECTO) -> List[dict]:
+    with open(ruta, encoding='utf-8') as archivo:
+        return json.load(archivo)['reglas']
+
+
+def _condiciones(nombre, valores_por_columna, negada):
+    condiciones = []
+    for columna, valores in (valores_por_columna or {}).items():
+        if columna not in COLUMNAS:
+            raise ValueError(f"Regla '{nombre}': columna desconocida '{columna}' "
+                             f"(disponibles: {', '.join(COLUMNAS)})")
+        valores = tuple(valores) if isinstance(valores, list) else (valores,)
+        tipo = COLUMNAS[columna]
+        if not valores or not all(isinstance(valor, tipo) for valor in valores):
+            raise ValueError(f"Regla '{nombre}': '{columna}' espera valores {tipo.__name__}")
+        condiciones.append(Condicion(columna, valores, negada))
+    return condiciones
+
+
+class ReglasCompiladas:
+    """Reglas validadas y listas para evaluar sobre columnas numpy"""
+    
+    def __init__(self, reglas: List[dict], permitidos: Optional[Dict[str, set]] = None):
+        """
+        `permitidos` restringe los valores de categoria, prioridad y accion
+        (p. ej. a las opciones del modelo Conciliacion)
+        """
+        self.reglas = []
+        for i, regla in enumerate(reglas):
+            nombre = regla.get('nombre') or f'regla_{i + 1}'
+            faltantes = [campo for campo in CAMPOS_RESULTADO if not regla.get(campo)]
+            if faltantes:
+                raise ValueError(f"Regla '{nombre}': faltan {', '.join(faltantes)}")
+            for campo, valores in (permitidos or {}).items():
+                if regla[campo] not in valores:
+                    raise ValueError(f"Regla '{nombre}': {campo} '{regla[campo]}' no es válido")
+            
+            condiciones = _condiciones(nombre, regla.get('si'), False) + _condiciones(nombre, regla.get('no'), True)
+            self.reglas.append(Regla(nombre, condiciones, {
+                'categoria': regla['categoria'],
+                'prioridad': regla['prioridad'],
+                'accion_recomendada': regla['accion'],
+                'descripcion': regla['descripcion'],
+            }))
+        if not self.reglas:
+            raise ValueError('No hay reglas de conciliación')
+    
+    def clasificar(self, columnas):
+        """
+        Índice de la regla que calza con cada fila (-1 si ninguna). `columnas`
+        es {columna: arreglo numpy} con todas las columnas de COLUMNAS.
+        """
+        import numpy as np
+        filas = len(next(iter(columnas.values())))
+        mascaras = []
+        for regla in self.reglas:
+            mascara = np.ones(filas, dtype=bool)
+            for condicion in regla.condiciones:
+                columna = columnas[condicion.columna]
+                if len(condicion.valores) == 1:
+                    coincide = columna == condicion.valores[0]
+                else:
+                    coincide = np.isin(columna, condicion.valores)
+                mascara &= ~coincide if condicion.negada else coincide
+            mascaras.append(mascara)
+        return np.select(mascaras, list(range(len(mascaras))), default=-1)
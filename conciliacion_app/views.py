@@ -1,23 +1,45 @@
 # views.py - VERSIÓN COMPLETA CON DEBUG
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib import messages
-from django.http import HttpResponse
-from django.db import transaction
-from django.db.models import Q
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import BooleanField, Count, ExpressionWrapper, Q
+from django.template.loader import render_to_string
+from django.urls import reverse
 from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.text import get_valid_filename
+from django.views.decorators.http import condition, require_http_methods, require_POST
+import hashlib
+import io
 import os
 import sys
+import tempfile
 import traceback
+import uuid
+import zipfile
+import zlib
 
 from .models import (
     ArchivoCargado, EmpleadoNomina, CuentaActiveDirectory,
-    Conciliacion, ProcesoConciliacion
+    Conciliacion, ProcesoConciliacion, ScriptPowershell, PerfilSolicitud,
+    CargaFragmentada, FragmentoCarga, archivo_upload_path
 )
 
 # Importamos nuestras utilidades
-from .utils.procesadores import ProcesadorExcelNomina, ProcesadorTXTAD, Conciliador
-from .utils.generadores import GeneradorScriptsPowershell
+from . import metricas
+from .archivado import conciliaciones_archivadas
+from .historial import linea_de_tiempo
+from .utils.procesadores import NormalizadorRUT, ProcesadorLogEjecucion
+from .pipeline import ejecutar_conciliacion, ejecutar_conciliacion_dominios
+from .utils.generadores import GeneradorScriptsPowershell, agrupar_trozos, construir_indice_cuentas
+from .utils.rut import clave_rut, rut_valido, separar_rut
 
 # ============ FUNCIÓN DE DEBUG ============
 
@@ -26,6 +48,160 @@ def debug_log(msg):
     timestamp = timezone.now().strftime("%H:%M:%S.%f")[:-3]
     print(f"[DEBUG {timestamp}] {msg}", file=sys.stderr)
 
+def indice_cuentas_proceso(proceso, conciliaciones):
+    """
+    Índice (dominio, RUT) -> SamAccountName(s) de las cuentas AD del proceso,
+    limitado a los RUTs de `conciliaciones` y con clave `clave_rut` (cuerpo
+    entero del RUT). Con varios dominios cada conciliación solo ve las
+    cuentas de su dominio. Una sola consulta para todo el script.
+    """
+    filas = CuentaActiveDirectory.objects.filter(
+        Q(rut_numero__in=conciliaciones.values('rut_numero'))
+        | Q(rut_numero__isnull=True, rut__in=conciliaciones.filter(rut_numero__isnull=True).values('rut')),
+        archivo_origen__in=proceso.ids_archivos_ad()
+    ).order_by('nombre_usuario').values_list('rut_numero', 'rut', 'nombre_usuario', 'archivo_origen__dominio')
+    return construir_indice_cuentas(
+        ((dominio, clave_rut(rut_numero, rut)), usuario)
+        for rut_numero, rut, usuario, dominio in filas.iterator(chunk_size=2000)
+    )
+
+def preparar_generador(proceso, incluir_resueltos=False):
+    """
+    Conciliaciones que requieren acción (solo pendientes, salvo que se pidan
+    también las resueltas, como en ROLLBACK) y un generador con el índice
+    (dominio, RUT) -> cuentas AD del proceso ya construido
+    """
+    conciliaciones = proceso.conciliaciones().filter(
+        categoria__in=['FANTASMA_TOTAL', 'INACTIVO_CON_CUENTA']
+    )
+    if not incluir_resueltos:
+        conciliaciones = conciliaciones.filter(resuelto=False)
+    generador = GeneradorScriptsPowershell(
+        indice_cuentas_proceso(proceso, conciliaciones),
+        dominios=[d['dominio'] for d in proceso.resumen_dominios.get('dominios', [])]
+    )
+    return conciliaciones, generador
+
+
+def obtener_o_generar_script(proceso, tipo_script, modo_seguro, compacto, usuario, fragmentos=1):
+    """
+    Retorna el ScriptPowershell guardado para (proceso, tipo, modo, versión de
+    resoluciones); si no existe lo genera una vez y lo almacena (comprimido
+    según settings.SCRIPTS_COMPRIMIR).
+    """
+    parametros = {
+        'proceso': proceso,
+        'tipo_script': tipo_script,
+        'modo_seguro': modo_seguro,
+        # El formato compacto solo cambia el bloqueo: el resto no depende de él
+        'compacto': tipo_script == 'BLOQUEO_MASIVO' and (compacto or fragmentos > 1),
+        'fragmentos': fragmentos,
+        'version_resoluciones': proceso.version_resoluciones,
+    }
+    script = ScriptPowershell.objects.filter(**parametros).defer(
+        'contenido', 'contenido_comprimido'
+    ).first()
+    if script:
+        debug_log(f"Script reutilizado: {script.id}")
+        return script
+    
+    # El rollback revierte todas las cuentas bloqueadas, aunque ya estén resueltas
+    conciliaciones, generador = preparar_generador(
+        proceso, incluir_resueltos=tipo_script == 'ROLLBACK'
+    )
+    
+    # Conteos por categoría para la cabecera (una sola consulta agregada)
+    conteos = {
+        fila['categoria']: fila['total']
+        for fila in conciliaciones.order_by().values('categoria').annotate(total=Count('id'))
+    }
+    
+    # Los datos se recorren con iterator(); solo se acumula la salida (comprimida si aplica)
+    datos_script = conciliaciones.values(
+        'rut', 'rut_numero', 'categoria', 'descripcion', 'dominio'
+    ).iterator(chunk_size=2000)
+    
+    # Generar script (identidades reales resueltas con un índice en memoria)
+    trozos = generador.generar_script_stream(
+        datos_script,
+        tipo_script=tipo_script,
+        modo_seguro=modo_seguro,
+        usuario=usuario.username,
+        conteos=conteos,
+        compacto=compacto,
+        fragmentos=fragmentos
+    )
+    
+    hash_contenido = hashlib.sha256()
+    partes = []
+    compresor = zlib.compressobj(wbits=31) if settings.SCRIPTS_COMPRIMIR else None
+    for bloque in agrupar_trozos(trozos):
+        hash_contenido.update(bloque)
+        partes.append(compresor.compress(bloque) if compresor else bloque)
+    
+    script = ScriptPowershell(usuario_generacion=usuario, hash_contenido=hash_contenido.hexdigest(), **parametros)
+    if compresor:
+        partes.append(compresor.flush())
+        script.contenido_comprimido = b''.join(partes)
+    else:
+        script.contenido = b''.join(partes).decode('utf-8')
+    
+    try:
+        with transaction.atomic():
+            script.save()
+    except IntegrityError:
+        # Otra petición generó el mismo script en paralelo
+        return ScriptPowershell.objects.get(**parametros)
+    
+    debug_log(f"Script generado y guardado: {script.id}")
+    return script
+
+
+def respuesta_zip_fragmentos(proceso, fragmentos, modo_seguro, usuario):
+    """
+    ZIP con un script compacto por fragmento, para repartirlos entre varios
+    controladores de dominio. Se arma en un archivo temporal, no en memoria.
+    """
+    conciliaciones, generador = preparar_generador(proceso)
+    datos_script = conciliaciones.values(
+        'rut', 'rut_numero', 'categoria', 'descripcion', 'dominio'
+    ).iterator(chunk_size=2000)
+    
+    archivo = tempfile.TemporaryFile()
+    with zipfile.ZipFile(archivo, 'w', zipfile.ZIP_DEFLATED) as zip_salida:
+        scripts = generador.generar_scripts_fragmentados(
+            datos_script, fragmentos, modo_seguro=modo_seguro, usuario=usuario.username
+        )
+        for nombre, trozos in scripts:
+            with zip_salida.open(nombre, 'w') as destino:
+                for bloque in agrupar_trozos(trozos):
+                    destino.write(bloque)
+    archivo.seek(0)
+    
+    debug_log(f"ZIP de {fragmentos} fragmentos generado para proceso {proceso.id}")
+    return FileResponse(archivo, as_attachment=True, filename='bloqueo_ad_fragmentos.zip')
+
+
+def _envia_gzip(request, comprimido):
+    """True si se envían los bytes gzip guardados tal cual (Content-Encoding: gzip)"""
+    return comprimido and 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+
+
+def _etag_script(request, script_id):
+    """
+    ETag del script almacenado (hash de su contenido). La versión gzip es otra
+    representación de los mismos datos y lleva el sufijo -gzip
+    """
+    fila = ScriptPowershell.objects.filter(
+        id=script_id, proceso__usuario=request.user
+    ).annotate(
+        comprimido=ExpressionWrapper(Q(contenido_comprimido__isnull=False), output_field=BooleanField())
+    ).values_list('hash_contenido', 'comprimido').first()
+    if not fila:
+        return None
+    hash_contenido, comprimido = fila
+    return f"{hash_contenido}-gzip" if _envia_gzip(request, comprimido) else hash_contenido
+
 # ============ VISTAS PRINCIPALES ============
 
 @login_required
@@ -48,6 +224,20 @@ def dashboard(request):
     return render(request, 'dashboard.html', context)
 
 
+def dominios_desde_nombres(nombres):
+    """Nombre de dominio de cada export AD: el nombre del archivo sin extensión, sin repetir"""
+    dominios = []
+    for nombre in nombres:
+        base = os.path.splitext(os.path.basename(nombre))[0] or 'AD'
+        dominio = base
+        sufijo = 2
+        while dominio in dominios:
+            dominio = f"{base}_{sufijo}"
+            sufijo += 1
+        dominios.append(dominio)
+    return dominios
+
+
 @login_required
 def subir_archivos(request):
     """Subir ambos archivos y ejecutar conciliación automática"""
@@ -65,15 +255,15 @@ def subir_archivos(request):
         for key, file in request.FILES.items():
             debug_log(f"  Archivo '{key}': {file.name} ({file.size} bytes)")
         
-        # 2. OBTENER ARCHIVOS
+        # 2. OBTENER ARCHIVOS (un export AD por dominio)
         nomina_file = request.FILES.get('nomina_file')
-        ad_file = request.FILES.get('ad_file')
+        ad_files = request.FILES.getlist('ad_file')
         
         debug_log(f"Nomina file: {'✅' if nomina_file else '❌'} {nomina_file}")
-        debug_log(f"AD file: {'✅' if ad_file else '❌'} {ad_file}")
+        debug_log(f"AD files: {'✅' if ad_files else '❌'} {[f.name for f in ad_files]}")
         
         # 3. VALIDACIÓN BÁSICA
-        if not nomina_file or not ad_file:
+        if not nomina_file or not ad_files:
             debug_log("❌ ERROR: Faltan uno o ambos archivos")
             messages.error(request, 'Debes seleccionar ambos archivos')
             return redirect('subir_archivos')
@@ -86,13 +276,20 @@ def subir_archivos(request):
             messages.error(request, 'La nómina debe ser un archivo Excel (.xlsx o .xls)')
             return redirect('subir_archivos')
         
-        if not ad_file.name.lower().endswith(('.txt', '.csv')):
-            debug_log(f"❌ ERROR: AD no es TXT/CSV: {ad_file.name}")
-            messages.error(request, 'El archivo AD debe ser .txt o .csv')
-            return redirect('subir_archivos')
+        for ad_file in ad_files:
+            if not ad_file.name.lower().endswith(('.txt', '.csv')):
+                debug_log(f"❌ ERROR: AD no es TXT/CSV: {ad_file.name}")
+                messages.error(request, 'El archivo AD debe ser .txt o .csv')
+                return redirect('subir_archivos')
         
+        dominios = dominios_desde_nombres([ad_file.name for ad_file in ad_files])
         debug_log("✅ Validación de tipos OK")
         
+        metricas.ARCHIVO_BYTES.observar(nomina_file.size, tipo='NOMINA')
+        for ad_file in ad_files:
+            metricas.ARCHIVO_BYTES.observar(ad_file.size, tipo='AD')
+        metricas.PROCESOS_EN_CURSO.inc()
+        archivos_ad = {}
         try:
             # 5. GUARDAR ARCHIVOS EN BD
             debug_log("💾 Guardando archivo nómina...")
@@ -105,135 +302,37 @@ def subir_archivos(request):
             )
             debug_log(f"✅ Nómina guardada: {archivo_nomina.id}")
             
-            debug_log("💾 Guardando archivo AD...")
-            archivo_ad = ArchivoCargado.objects.create(
-                nombre_original=ad_file.name,
-                tipo_archivo='AD',
-                archivo=ad_file,
-                usuario=request.user,
-                estado='PENDIENTE'
-            )
-            debug_log(f"✅ AD guardado: {archivo_ad.id}")
-            
-            # 6. PROCESAR ARCHIVOS (en una transacción)
-            debug_log("🔄 Iniciando procesamiento...")
-            with transaction.atomic():
-                # Procesar nómina Excel
-                debug_log("📊 Procesando nómina Excel...")
-                procesador_excel = ProcesadorExcelNomina()
-                empleados = procesador_excel.procesar(archivo_nomina.archivo.path)
-                debug_log(f"✅ Nómina procesada: {len(empleados)} empleados")
-                
-                for emp in empleados:
-                    EmpleadoNomina.objects.create(
-                        rut=emp['rut_normalizado'],
-                        nombre=emp['nombre'],
-                        estado_final=emp['estado_final'],
-                        tiene_conflicto=emp.get('tiene_conflicto', False),
-                        archivo_origen=archivo_nomina
-                    )
-                
-                archivo_nomina.registros_procesados = len(empleados)
-                archivo_nomina.estado = 'COMPLETADO'
-                archivo_nomina.save()
-                
-                # Procesar AD TXT/CSV
-                debug_log("🔐 Procesando Active Directory...")
-                procesador_txt = ProcesadorTXTAD()
-                cuentas = procesador_txt.procesar(archivo_ad.archivo.path)
-                debug_log(f"✅ AD procesado: {len(cuentas)} cuentas")
-                
-                for cuenta in cuentas:
-                    CuentaActiveDirectory.objects.create(
-                        rut=cuenta['rut_normalizado'],
-                        nombre_usuario=cuenta['nombre_usuario'],
-                        estado_cuenta=cuenta['estado_cuenta'],
-                        archivo_origen=archivo_ad
-                    )
-                
-                archivo_ad.registros_procesados = len(cuentas)
-                archivo_ad.estado = 'COMPLETADO'
-                archivo_ad.save()
-            
-            debug_log("✅ Procesamiento de archivos COMPLETADO")
-            
-            # 7. EJECUTAR CONCILIACIÓN
-            debug_log("🔍 Iniciando conciliación...")
-            proceso = ProcesoConciliacion.objects.create(
-                usuario=request.user,
-                archivo_nomina=archivo_nomina,
-                archivo_ad=archivo_ad,
-                estado='PROCESANDO'
-            )
-            debug_log(f"✅ Proceso creado: {proceso.id}")
-            
-            # Obtener datos para conciliar
-            empleados_data = list(EmpleadoNomina.objects.filter(
-                archivo_origen=archivo_nomina
-            ).values('rut', 'estado_final'))
-            
-            cuentas_data = list(CuentaActiveDirectory.objects.filter(
-                archivo_origen=archivo_ad
-            ).values('rut', 'estado_cuenta'))
-            
-            debug_log(f"📊 Datos para conciliar: {len(empleados_data)} empleados, {len(cuentas_data)} cuentas")
-            
-            # Ejecutar conciliación
-            conciliador = Conciliador()
-            resultados = conciliador.conciliar(empleados_data, cuentas_data)
-            
-            debug_log(f"✅ Conciliación completada: {len(resultados)} resultados")
-            
-            # Guardar resultados
-            for resultado in resultados:
-                # Buscar objetos relacionados
-                empleado_obj = EmpleadoNomina.objects.filter(
-                    rut=resultado['rut'],
-                    archivo_origen=archivo_nomina
-                ).first()
-                
-                cuenta_obj = CuentaActiveDirectory.objects.filter(
-                    rut=resultado['rut'],
-                    archivo_origen=archivo_ad
-                ).first()
-                
-                # Crear registro de conciliación
-                Conciliacion.objects.create(
-                    empleado_nomina=empleado_obj,
-                    cuenta_ad=cuenta_obj,
-                    rut=resultado['rut'],
-                    categoria=resultado['categoria'],
-                    prioridad=resultado['prioridad'],
-                    accion_recomendada=resultado['accion_recomendada'],
-                    descripcion=resultado['descripcion'],
-                    usuario_deteccion=request.user
+            for dominio, ad_file in zip(dominios, ad_files):
+                debug_log(f"💾 Guardando archivo AD {ad_file.name}...")
+                archivos_ad[dominio] = ArchivoCargado.objects.create(
+                    nombre_original=ad_file.name,
+                    tipo_archivo='AD',
+                    archivo=ad_file,
+                    usuario=request.user,
+                    estado='PENDIENTE'
                 )
+                debug_log(f"✅ AD guardado: {archivos_ad[dominio].id}")
             
-            # Actualizar estadísticas del proceso
-            proceso.total_empleados = len(empleados_data)
-            proceso.total_cuentas_ad = len(cuentas_data)
-            proceso.conciliaciones_generadas = len(resultados)
-            
-            # Contar por categoría
-            for r in resultados:
-                if r['categoria'] == 'FANTASMA_TOTAL':
-                    proceso.fantasmas_totales += 1
-                elif r['categoria'] == 'INACTIVO_CON_CUENTA':
-                    proceso.inactivos_con_cuenta += 1
-                elif r['categoria'] in ['OK_ACTIVO', 'OK_INACTIVO']:
-                    proceso.ok_activos += 1
-            
-            proceso.estado = 'COMPLETADO'
-            proceso.fecha_fin = timezone.now()
-            proceso.save()
+            # 6. PROCESAR Y CONCILIAR (la lectura fuera de transacción; la escritura
+            # en bloques cortos para no bloquear a otros usuarios durante la carga).
+            # Con varios exports AD la nómina se lee y guarda una sola vez
+            debug_log("🔄 Iniciando procesamiento...")
+            if len(archivos_ad) > 1:
+                proceso = ejecutar_conciliacion_dominios(archivo_nomina, archivos_ad, request.user)
+            else:
+                proceso = ejecutar_conciliacion(archivo_nomina, next(iter(archivos_ad.values())), request.user)
+            for m in proceso.metricas_etapas:
+                debug_log(f"⏱️ {m['etapa']}: {m['segundos']}s ({m['cpu_segundos']}s CPU), "
+                          f"{m['filas']} filas, {m['memoria_pico_kb']} KB")
             
             debug_log("🏁 PROCESO COMPLETADO EXITOSAMENTE")
             debug_log(f"📊 Resultados: {proceso.fantasmas_totales} fantasmas, {proceso.inactivos_con_cuenta} inactivos")
             
-            messages.success(request, f'¡Conciliación completada! {len(resultados)} resultados encontrados')
+            messages.success(request, f'¡Conciliación completada! {proceso.conciliaciones_generadas} resultados encontrados')
             return redirect('ver_resultados', proceso_id=proceso.id)
-            
+        
         except Exception as e:
+            metricas.PROCESOS.inc(estado='ERROR')
             debug_log(f"💥 ERROR CRÍTICO: {str(e)}")
             debug_log("📋 Traceback completo:")
             traceback.print_exc(file=sys.stderr)
@@ -246,15 +345,18 @@ def subir_archivos(request):
             except:
                 pass
             
-            try:
-                if 'archivo_ad' in locals() and archivo_ad.archivo:
-                    archivo_ad.archivo.delete(save=False)
-                    archivo_ad.delete()
-            except:
-                pass
+            for archivo_ad in archivos_ad.values():
+                try:
+                    if archivo_ad.archivo:
+                        archivo_ad.archivo.delete(save=False)
+                        archivo_ad.delete()
+                except:
+                    pass
             
             messages.error(request, f'Error en el proceso: {str(e)}')
             return redirect('subir_archivos')
+        finally:
+            metricas.PROCESOS_EN_CURSO.dec()
     
     # Si es GET, mostrar el formulario
     debug_log("📄 Sirviendo formulario (GET)")
@@ -268,16 +370,36 @@ def ver_resultados(request, proceso_id):
     
     proceso = get_object_or_404(ProcesoConciliacion, id=proceso_id, usuario=request.user)
     
-    # Obtener conciliaciones de este proceso
-    conciliaciones = Conciliacion.objects.filter(
-        Q(empleado_nomina__archivo_origen=proceso.archivo_nomina) |
-        Q(cuenta_ad__archivo_origen=proceso.archivo_ad)
-    ).select_related('empleado_nomina', 'cuenta_ad').order_by('prioridad', '-fecha_deteccion')
+    # Un proceso COMPLETADO solo cambia al marcar resoluciones, que incrementan
+    # version_resoluciones; la tabla renderizada se cachea bajo esa versión
+    cacheable = proceso.estado == 'COMPLETADO'
+    clave_cache = proceso.clave_cache_resultados()
+    datos_tabla = cache.get(clave_cache) if cacheable else None
+    
+    if datos_tabla is None:
+        debug_log("Renderizando tabla de resultados (sin caché)")
+        if proceso.archivado:
+            # Las filas ya no están en la base: se leen del archivo del proceso
+            conciliaciones = conciliaciones_archivadas(proceso)
+        else:
+            conciliaciones = proceso.conciliaciones().select_related(
+                'empleado_nomina', 'cuenta_ad'
+            ).order_by('prioridad', '-fecha_deteccion')
+        
+        datos_tabla = {
+            'html': render_to_string('resultados_tabla.html', {
+                'conciliaciones': conciliaciones,
+                'archivado': proceso.archivado,
+            }),
+            'total_pendientes': sum(1 for c in conciliaciones if not c.resuelto),
+        }
+        if cacheable:
+            cache.set(clave_cache, datos_tabla, settings.RESULTADOS_CACHE_TIMEOUT)
     
     context = {
         'proceso': proceso,
-        'conciliaciones': conciliaciones,
-        'total_pendientes': conciliaciones.filter(resuelto=False).count(),
+        'tabla_resultados': datos_tabla['html'],
+        'total_pendientes': datos_tabla['total_pendientes'],
     }
     return render(request, 'resultados.html', context)
 
@@ -288,15 +410,119 @@ def marcar_resuelto(request, conciliacion_id):
     debug_log(f"MARCAR_RESUELTO - Conciliación: {conciliacion_id}")
     
     if request.method == 'POST':
-        conciliacion = get_object_or_404(Conciliacion, id=conciliacion_id)
+        # El formulario indica el proceso cuya tabla se está viendo; la
+        # conciliación debe pertenecer a él
+        try:
+            proceso = ProcesoConciliacion.objects.get(id=request.POST.get('proceso_id'), usuario=request.user)
+        except (ProcesoConciliacion.DoesNotExist, ValidationError):
+            messages.error(request, 'No existe el proceso indicado')
+            return redirect('dashboard')
+        conciliacion = get_object_or_404(proceso.conciliaciones(), id=conciliacion_id)
         conciliacion.resuelto = True
         conciliacion.fecha_resolucion = timezone.now()
         conciliacion.save()
+        proceso.incrementar_version_resoluciones()
         messages.success(request, f'Conciliación {conciliacion.rut} marcada como resuelta')
     
     return redirect(request.META.get('HTTP_REFERER', 'dashboard'))
 
 
+@login_required
+def cargar_log_ejecucion(request, proceso_id):
+    """Cargar el log CSV de un script ejecutado y marcar resueltas sus conciliaciones"""
+    debug_log(f"CARGAR_LOG - Proceso: {proceso_id}")
+    
+    proceso = get_object_or_404(ProcesoConciliacion, id=proceso_id, usuario=request.user)
+    
+    if request.method != 'POST':
+        return redirect('ver_resultados', proceso_id=proceso.id)
+    
+    if proceso.archivado:
+        messages.error(request, 'El proceso está archivado; sus conciliaciones ya no se pueden modificar')
+        return redirect('ver_resultados', proceso_id=proceso.id)
+    
+    log_file = request.FILES.get('log_file')
+    if not log_file or not log_file.name.lower().endswith(('.csv', '.txt')):
+        messages.error(request, 'Debes seleccionar el log CSV generado por el script')
+        return redirect('ver_resultados', proceso_id=proceso.id)
+    
+    script_id = request.POST.get('script_id')
+    if script_id:
+        try:
+            script_id = uuid.UUID(script_id)
+        except ValueError:
+            messages.error(request, 'El script indicado no es válido')
+            return redirect('ver_resultados', proceso_id=proceso.id)
+    
+    # Índices en memoria: (dominio, SamAccountName) -> RUT y (dominio, RUT) ->
+    # conciliación (dos consultas). El mismo usuario o RUT puede estar en varios dominios
+    rut_por_usuario = {
+        (dominio, usuario): rut for dominio, usuario, rut in CuentaActiveDirectory.objects.filter(
+            archivo_origen__in=proceso.ids_archivos_ad()
+        ).values_list('archivo_origen__dominio', 'nombre_usuario', 'rut').iterator(chunk_size=2000)
+    }
+    
+    pendientes = proceso.conciliaciones().filter(
+        resuelto=False,
+        categoria__in=['FANTASMA_TOTAL', 'INACTIVO_CON_CUENTA']
+    )
+    conciliacion_por_rut = {
+        (dominio, rut): pk
+        for dominio, rut, pk in pendientes.values_list('dominio', 'rut', 'id').iterator(chunk_size=2000)
+    }
+    
+    # El archivo se lee como stream, fila a fila
+    lineas = io.TextIOWrapper(log_file.file, encoding='utf-8-sig', newline='')
+    try:
+        resumen = ProcesadorLogEjecucion().procesar(
+            lineas, rut_por_usuario, set(conciliacion_por_rut), requiere_dominio=proceso.es_multidominio()
+        )
+    except UnicodeDecodeError:
+        # Los scripts escriben el log en UTF-8; p. ej. Windows PowerShell 5 sin -Encoding usa otra codificación
+        messages.error(request, 'El log debe estar codificado en UTF-8 (Export-Csv -Encoding UTF8)')
+        return redirect('ver_resultados', proceso_id=proceso.id)
+    except ValueError as e:
+        messages.error(request, str(e))
+        return redirect('ver_resultados', proceso_id=proceso.id)
+    debug_log(f"Log procesado: {resumen['filas']} filas, {len(resumen['ruts_resueltos'])} RUTs resueltos")
+    
+    ahora = timezone.now()
+    ids_resueltos = [conciliacion_por_rut[clave] for clave in resumen['ruts_resueltos']]
+    resueltas = 0
+    with transaction.atomic():
+        # UPDATE masivo por bloques (límite de parámetros de SQLite)
+        for i in range(0, len(ids_resueltos), 500):
+            resueltas += Conciliacion.objects.filter(
+                id__in=ids_resueltos[i:i + 500], resuelto=False
+            ).update(resuelto=True, fecha_resolucion=ahora, usuario_resolucion=request.user)
+        
+        if resueltas:
+            proceso.incrementar_version_resoluciones()
+        
+        # El log corresponde al script elegido o, por defecto, al último bloqueo en modo real
+        scripts = ScriptPowershell.objects.filter(proceso=proceso)
+        if script_id:
+            scripts = scripts.filter(id=script_id)
+        else:
+            scripts = scripts.filter(tipo_script='BLOQUEO_MASIVO', modo_seguro=False)
+        script_id = scripts.order_by('-fecha_generacion').values_list('id', flat=True)[:1]
+        
+        resultado = (
+            f"Log {log_file.name}: {resumen['filas']} filas, {resumen['filas_ok']} OK, "
+            f"{resumen['filas_error']} con error, {resumen['sin_coincidencia']} sin coincidencia. "
+            f"Conciliaciones resueltas: {resueltas}."
+        )
+        if resumen['detalle_errores']:
+            resultado += "\nErrores:\n" + "\n".join(resumen['detalle_errores'])
+        
+        ScriptPowershell.objects.filter(id__in=list(script_id)).update(
+            ejecutado=True, fecha_ejecucion=ahora, resultado_ejecucion=resultado
+        )
+    
+    messages.success(request, f'Log cargado: {resueltas} conciliaciones marcadas como resueltas')
+    return redirect('ver_resultados', proceso_id=proceso.id)
+
+
 @login_required
 def generar_script_powershell(request, proceso_id):
     """Generar script PowerShell para un proceso"""
@@ -304,39 +530,41 @@ def generar_script_powershell(request, proceso_id):
     
     proceso = get_object_or_404(ProcesoConciliacion, id=proceso_id, usuario=request.user)
     
+    if proceso.archivado:
+        messages.info(request, 'El proceso está archivado y no tiene cuentas pendientes')
+        return redirect('ver_resultados', proceso_id=proceso.id)
+    
     # Obtener conciliaciones que necesitan acción
-    conciliaciones = Conciliacion.objects.filter(
-        Q(empleado_nomina__archivo_origen=proceso.archivo_nomina) |
-        Q(cuenta_ad__archivo_origen=proceso.archivo_ad),
+    conciliaciones = proceso.conciliaciones().filter(
         resuelto=False,
         categoria__in=['FANTASMA_TOTAL', 'INACTIVO_CON_CUENTA']
     )
     
     if request.method == 'POST':
         modo_seguro = request.POST.get('modo_seguro') == 'true'
+        modo_compacto = request.POST.get('modo_compacto') == 'true'
+        tipo_script = request.POST.get('tipo_script', 'BLOQUEO_MASIVO')
+        if tipo_script not in dict(ScriptPowershell.TIPO_SCRIPT):
+            tipo_script = 'BLOQUEO_MASIVO'
+        try:
+            fragmentos = min(max(int(request.POST.get('fragmentos', 1)), 1), settings.SCRIPTS_MAX_FRAGMENTOS)
+        except ValueError:
+            fragmentos = 1
         
-        # Preparar datos para el script
-        datos_script = []
-        for conc in conciliaciones:
-            datos_script.append({
-                'rut': conc.rut,
-                'categoria': conc.categoria,
-                'descripcion': conc.descripcion,
-            })
+        # Solo el bloqueo se fragmenta
+        if tipo_script != 'BLOQUEO_MASIVO':
+            fragmentos = 1
         
-        # Generar script
-        generador = GeneradorScriptsPowershell()
-        script_content = generador.generar_script(
-            datos_script, 
-            tipo_script='BLOQUEO_MASIVO',
-            modo_seguro=modo_seguro,
-            usuario=request.user.username
-        )
+        # Varios scripts independientes: se entregan en un ZIP (no se guardan)
+        if fragmentos > 1 and request.POST.get('salida_fragmentos') == 'zip':
+            return respuesta_zip_fragmentos(proceso, fragmentos, modo_seguro, request.user)
         
-        # Crear respuesta para descargar
-        response = HttpResponse(script_content, content_type='text/plain')
-        response['Content-Disposition'] = 'attachment; filename="bloqueo_ad.ps1"'
-        return response
+        # Se reutiliza el script guardado mientras no cambien las resoluciones
+        script = obtener_o_generar_script(
+            proceso, tipo_script, modo_seguro, modo_compacto, request.user,
+            fragmentos=fragmentos
+        )
+        return redirect('descargar_script', script_id=script.id)
     
     context = {
         'proceso': proceso,
@@ -346,6 +574,26 @@ def generar_script_powershell(request, proceso_id):
     return render(request, 'generar_script.html', context)
 
 
+@login_required
+@condition(etag_func=_etag_script)
+def descargar_script(request, script_id):
+    """Descargar un script guardado (soporta GET condicional con ETag)"""
+    debug_log(f"DESCARGAR_SCRIPT - Script: {script_id}")
+    
+    script = get_object_or_404(ScriptPowershell, id=script_id, proceso__usuario=request.user)
+    
+    if _envia_gzip(request, script.esta_comprimido()):
+        # El cliente acepta gzip: se envía tal como está guardado
+        response = HttpResponse(bytes(script.contenido_comprimido), content_type='text/plain; charset=utf-8')
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = StreamingHttpResponse(script.iter_contenido(), content_type='text/plain; charset=utf-8')
+    
+    patch_vary_headers(response, ['Accept-Encoding'])
+    response['Content-Disposition'] = f'attachment; filename="{script.nombre_archivo()}"'
+    return response
+
+
 @login_required
 def historial_procesos(request):
     """Ver historial de procesos"""
@@ -353,7 +601,7 @@ def historial_procesos(request):
     
     procesos = ProcesoConciliacion.objects.filter(
         usuario=request.user
-    ).order_by('-fecha_inicio')
+    ).select_related('archivo_nomina', 'archivo_ad').order_by('-fecha_inicio')
     
     debug_log(f"Procesos encontrados: {procesos.count()}")
     
@@ -377,6 +625,266 @@ def historial_procesos(request):
     return render(request, 'historial.html', context)
 
 
+@staff_member_required
+def historial_rut(request, rut):
+    """
+    Línea de tiempo de un RUT en todos los procesos (JSON): cuándo apareció,
+    cuándo se marcó por primera vez y desde cuándo es fantasma. Sale del
+    índice HistorialRut, así que no abre ningún proceso.
+    """
+    rut_normalizado = NormalizadorRUT.normalizar_rut(rut)
+    partes = separar_rut(rut_normalizado)
+    if not partes:
+        return JsonResponse({'error': 'RUT inválido; se espera el formato 12.345.678-5'}, status=400)
+    
+    historial = linea_de_tiempo(partes[0])
+    historial['rut'] = rut_normalizado
+    historial['rut_valido'] = rut_valido(rut_normalizado)
+    return JsonResponse(historial)
+
+
+@staff_member_required
+def descargar_perfil(request, perfil_id):
+    """Descargar el archivo de un perfil de solicitud (enlazado desde el admin)"""
+    perfil = get_object_or_404(PerfilSolicitud, id=perfil_id)
+    ruta = os.path.join(settings.PERFILAMIENTO_DIRECTORIO, perfil.archivo)
+    if not os.path.exists(ruta):
+        messages.error(request, 'El archivo del perfil ya no existe')
+        return redirect('admin:conciliacion_app_perfilsolicitud_changelist')
+    
+    return FileResponse(open(ruta, 'rb'), as_attachment=True, filename=perfil.archivo)
+
+
+def exponer_metricas(request):
+    """Métricas en formato de texto de Prometheus (solo desde IPs permitidas)"""
+    if request.META.get('REMOTE_ADDR') not in settings.METRICAS_IPS_PERMITIDAS:
+        return HttpResponse('Acceso denegado', status=403, content_type='text/plain; charset=utf-8')
+    
+    return HttpResponse(
+        metricas.REGISTRO.exponer(),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+
+# ============ CARGA FRAGMENTADA (REANUDABLE) ============
+#
+# Para archivos grandes, desde un cliente JS o un script:
+#   1. POST cargas/                      nombre, tipo_archivo (NOMINA|AD), tamano_total [, tamano_fragmento]
+#   2. PUT  cargas/<id>/fragmentos/<n>/  cuerpo = bytes del fragmento n (desde 0);
+#                                        cabecera opcional X-Fragmento-SHA256 para verificarlo
+#      GET  cargas/<id>/                 fragmentos faltantes (para reanudar tras un corte)
+#   3. POST cargas/finalizar/            nomina=<id>&ad=<id>: completa ambas cargas y concilia
+# Los fragmentos pueden llegar en cualquier orden y reintentarse: se escriben
+# en su posición del archivo en disco, sin pasar por memoria.
+
+_BLOQUE_LECTURA = 64 * 1024
+
+_EXTENSIONES_CARGA = {'NOMINA': ('.xlsx', '.xls'), 'AD': ('.txt', '.csv')}
+
+
+def _estado_carga(carga):
+    total = carga.total_fragmentos()
+    recibidos = set(carga.fragmentos.values_list('numero', flat=True))
+    return {
+        'id': str(carga.id),
+        'estado': carga.estado,
+        'nombre': carga.nombre_original,
+        'tipo_archivo': carga.tipo_archivo,
+        'tamano_total': carga.tamano_total,
+        'tamano_fragmento': carga.tamano_fragmento,
+        'total_fragmentos': total,
+        'recibidos': len(recibidos),
+        'faltantes': [n for n in range(total) if n not in recibidos],
+        'hash_contenido': carga.hash_contenido,
+    }
+
+
+def _completar_carga(carga):
+    """
+    Mueve el archivo armado a archivos/ y crea su ArchivoCargado, sin copiarlo
+    ni releerlo: la huella se calcula con los SHA-256 de los fragmentos
+    """
+    huellas = carga.fragmentos.order_by('numero').values_list('sha256', flat=True)
+    huella = hashlib.sha256(b''.join(bytes.fromhex(h) for h in huellas)).hexdigest()
+    
+    nombre = default_storage.get_available_name(
+        archivo_upload_path(None, get_valid_filename(carga.nombre_original))
+    )
+    destino = default_storage.path(nombre)
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    os.replace(carga.ruta_parcial(), destino)
+    
+    archivo = ArchivoCargado.objects.create(
+        nombre_original=carga.nombre_original,
+        tipo_archivo=carga.tipo_archivo,
+        archivo=nombre,
+        usuario=carga.usuario,
+        estado='PENDIENTE'
+    )
+    carga.estado = 'COMPLETADA'
+    carga.hash_contenido = f"{huella}-{carga.total_fragmentos()}"
+    carga.archivo = archivo
+    carga.save()
+    return archivo
+
+
+def _reabrir_carga(carga, archivo):
+    """
+    Deshace _completar_carga si la conciliación falla: el archivo vuelve a su
+    ruta parcial y la carga queda EN_CURSO, con todos sus fragmentos, para
+    reintentar la finalización sin reenviar nada
+    """
+    os.makedirs(os.path.dirname(carga.ruta_parcial()), exist_ok=True)
+    os.replace(archivo.archivo.path, carga.ruta_parcial())
+    archivo.eliminar_con_procesos()  # Con sus filas y el proceso fallido
+    carga.estado = 'EN_CURSO'
+    carga.hash_contenido = ''
+    carga.archivo = None
+    carga.save()
+
+
+@login_required
+@require_POST
+def iniciar_carga(request):
+    """Crea una carga fragmentada y reserva su archivo en disco"""
+    nombre = os.path.basename(request.POST.get('nombre', '')).strip()
+    tipo_archivo = request.POST.get('tipo_archivo', '')
+    try:
+        tamano_total = int(request.POST.get('tamano_total', ''))
+        tamano_fragmento = int(request.POST.get('tamano_fragmento') or settings.CARGAS_TAMANO_FRAGMENTO)
+    except ValueError:
+        return JsonResponse({'error': 'tamano_total y tamano_fragmento deben ser enteros'}, status=400)
+    
+    if not nombre.lower().endswith(_EXTENSIONES_CARGA.get(tipo_archivo, ())):
+        return JsonResponse({'error': 'La nómina debe ser Excel (.xlsx o .xls) y el archivo AD .txt o .csv'}, status=400)
+    if not 0 < tamano_total <= settings.CARGAS_TAMANO_MAXIMO:
+        return JsonResponse({'error': f'El archivo debe pesar entre 1 byte y {settings.CARGAS_TAMANO_MAXIMO} bytes'},
+                            status=413)
+    if not settings.CARGAS_TAMANO_FRAGMENTO_MINIMO <= tamano_fragmento <= settings.CARGAS_TAMANO_FRAGMENTO_MAXIMO:
+        return JsonResponse({'error': 'tamano_fragmento fuera del rango permitido'}, status=400)
+    
+    CargaFragmentada.descartar_vencidas()
+    carga = CargaFragmentada.objects.create(
+        usuario=request.user,
+        tipo_archivo=tipo_archivo,
+        nombre_original=nombre,
+        tamano_total=tamano_total,
+        tamano_fragmento=tamano_fragmento
+    )
+    os.makedirs(os.path.dirname(carga.ruta_parcial()), exist_ok=True)
+    with open(carga.ruta_parcial(), 'wb') as destino:
+        destino.truncate(tamano_total)  # Archivo disperso: cada fragmento va a su posición
+    
+    debug_log(f"CARGA INICIADA - {carga.id}: {nombre} ({tamano_total} bytes, {carga.total_fragmentos()} fragmentos)")
+    return JsonResponse(_estado_carga(carga), status=201)
+
+
+@login_required
+def estado_carga(request, carga_id):
+    """Estado de una carga: fragmentos recibidos y faltantes"""
+    carga = get_object_or_404(CargaFragmentada, id=carga_id, usuario=request.user)
+    return JsonResponse(_estado_carga(carga))
+
+
+@login_required
+@require_http_methods(['PUT'])
+def subir_fragmento(request, carga_id, numero):
+    """Escribe un fragmento en su posición del archivo calculando su SHA-256 al vuelo"""
+    carga = get_object_or_404(CargaFragmentada, id=carga_id, usuario=request.user)
+    if carga.estado != 'EN_CURSO':
+        return JsonResponse({'error': 'La carga ya fue finalizada'}, status=409)
+    if not 0 <= numero < carga.total_fragmentos():
+        return JsonResponse({'error': f'Fragmento fuera de rango (0 a {carga.total_fragmentos() - 1})'}, status=400)
+    
+    esperado = carga.tamano_esperado(numero)
+    sha256 = hashlib.sha256()
+    recibido = 0
+    with open(carga.ruta_parcial(), 'r+b') as destino:
+        destino.seek(numero * carga.tamano_fragmento)
+        while True:
+            # Se pide un byte de más para detectar un fragmento demasiado largo
+            # sin escribir sobre el siguiente
+            bloque = request.read(min(_BLOQUE_LECTURA, esperado - recibido + 1))
+            if not bloque:
+                break
+            recibido += len(bloque)
+            if recibido > esperado:
+                break
+            sha256.update(bloque)
+            destino.write(bloque)
+    
+    huella = sha256.hexdigest()
+    error = None
+    if recibido != esperado:
+        error = f'El fragmento {numero} debe tener {esperado} bytes'
+    elif request.headers.get('X-Fragmento-SHA256', huella).lower() != huella:
+        error = f'El SHA-256 del fragmento {numero} no coincide'
+    if error:
+        # Lo escrito pudo pisar una versión anterior válida: hay que reenviarlo
+        carga.fragmentos.filter(numero=numero).delete()
+        return JsonResponse({'error': error}, status=400)
+    
+    FragmentoCarga.objects.update_or_create(
+        carga=carga, numero=numero,
+        defaults={'tamano': recibido, 'sha256': huella}
+    )
+    CargaFragmentada.objects.filter(id=carga.id).update(fecha_actualizacion=timezone.now())
+    return JsonResponse({
+        'numero': numero,
+        'sha256': huella,
+        'recibidos': carga.fragmentos.count(),
+        'total_fragmentos': carga.total_fragmentos(),
+    })
+
+
+@login_required
+@require_POST
+def finalizar_cargas(request):
+    """Completa las cargas de nómina y AD y ejecuta la conciliación"""
+    cargas = []
+    for tipo, campo in (('NOMINA', 'nomina'), ('AD', 'ad')):
+        try:
+            carga = CargaFragmentada.objects.get(id=request.POST.get(campo), usuario=request.user, tipo_archivo=tipo)
+        except (CargaFragmentada.DoesNotExist, ValidationError):
+            return JsonResponse({'error': f'No existe la carga indicada en "{campo}"'}, status=404)
+        if carga.estado != 'EN_CURSO':
+            return JsonResponse({'error': f'La carga {carga.nombre_original} ya fue finalizada'}, status=409)
+        faltantes = carga.total_fragmentos() - carga.fragmentos.count()
+        if faltantes:
+            return JsonResponse({'error': f'Faltan {faltantes} fragmentos de {carga.nombre_original}',
+                                 'carga': _estado_carga(carga)}, status=409)
+        cargas.append(carga)
+    
+    for carga in cargas:
+        metricas.ARCHIVO_BYTES.observar(carga.tamano_total, tipo=carga.tipo_archivo)
+    metricas.PROCESOS_EN_CURSO.inc()
+    archivos = []
+    try:
+        for carga in cargas:
+            archivos.append(_completar_carga(carga))
+        debug_log(f"CARGAS FINALIZADAS - {', '.join(c.hash_contenido for c in cargas)}")
+        proceso = ejecutar_conciliacion(archivos[0], archivos[1], request.user)
+    except Exception as e:
+        metricas.PROCESOS.inc(estado='ERROR')
+        debug_log(f"💥 ERROR CRÍTICO: {str(e)}")
+        traceback.print_exc(file=sys.stderr)
+        # Las cargas se reabren (no se borran): se puede volver a finalizar
+        for carga, archivo in zip(cargas, archivos):
+            _reabrir_carga(carga, archivo)
+        return JsonResponse({'error': f'Error en el proceso: {str(e)}',
+                             'cargas': [_estado_carga(carga) for carga in cargas]}, status=500)
+    finally:
+        metricas.PROCESOS_EN_CURSO.dec()
+    
+    return JsonResponse({
+        'proceso_id': str(proceso.id),
+        'url_resultados': reverse('ver_resultados', args=[proceso.id]),
+        'conciliaciones_generadas': proceso.conciliaciones_generadas,
+        'hash_nomina': cargas[0].hash_contenido,
+        'hash_ad': cargas[1].hash_contenido,
+    })
+
+
 # ============ VISTA DE PRUEBA PARA DEBUG ============
 
 @login_required